@@ -1,19 +1,30 @@
 from django.contrib import admin
-from .models import AIServiceLog, PromptTemplate
+from .models import AIServiceLog, PromptTemplate, GenerationJob, ResponseCacheEntry, PromptBlob
 
 
 @admin.register(AIServiceLog)
 class AIServiceLogAdmin(admin.ModelAdmin):
     """Admin configuration for AIServiceLog model."""
     
-    list_display = ['user', 'topic', 'status', 'model_used', 'response_time_seconds', 'created_at']
-    list_filter = ['status', 'model_used', 'created_at']
+    list_display = ['user', 'topic', 'status', 'model_used', 'response_time_seconds', 'total_tokens',
+                    'estimated_cost', 'cache_hit', 'created_at']
+    list_filter = ['status', 'model_used', 'fallback_from', 'cache_hit', 'coalesced', 'hedge_won', 'template', 'created_at']
     search_fields = ['user__email', 'topic__title', 'error_message']
     ordering = ['-created_at']
-    readonly_fields = ['created_at']
+    # Prompts and responses are stored deduplicated and compressed; show them as text
+    exclude = ['prompt', 'response', 'prompt_blob', 'prompt_variables']
+    readonly_fields = ['prompt_text', 'response_text', 'created_at']
     
     def has_add_permission(self, request):
         return False  # Logs should only be created by the system
+    
+    @admin.display(description='Prompt')
+    def prompt_text(self, obj):
+        return obj.prompt_text
+    
+    @admin.display(description='Response')
+    def response_text(self, obj):
+        return obj.response_text
 
 
 @admin.register(PromptTemplate)
@@ -25,3 +36,41 @@ class PromptTemplateAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     ordering = ['template_type', 'name']
     readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    """Admin configuration for GenerationJob model."""
+    
+    list_display = ['topic', 'user', 'kind', 'status', 'attempts', 'worker_id', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['user__email', 'topic__title', 'error_message']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'updated_at']
+
+
+@admin.register(ResponseCacheEntry)
+class ResponseCacheEntryAdmin(admin.ModelAdmin):
+    """Admin configuration for ResponseCacheEntry model."""
+    
+    list_display = ['key', 'model_name', 'hit_count', 'last_accessed_at', 'expires_at']
+    list_filter = ['model_name']
+    search_fields = ['key']
+    ordering = ['-last_accessed_at']
+    readonly_fields = ['key', 'model_name', 'created_at']
+    
+    def has_add_permission(self, request):
+        return False  # Entries are only created by the AI service
+
+
+@admin.register(PromptBlob)
+class PromptBlobAdmin(admin.ModelAdmin):
+    """Admin configuration for PromptBlob model."""
+    
+    list_display = ['hash', 'created_at']
+    search_fields = ['hash']
+    ordering = ['-created_at']
+    readonly_fields = ['hash', 'content', 'created_at']
+    
+    def has_add_permission(self, request):
+        return False  # Blobs are only created when logs are written
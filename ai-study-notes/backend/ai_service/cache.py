@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Optional
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import ResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Two-level cache of raw AI responses keyed on the rendered prompt.
+
+    The in-process L1 layer is a small LRU dict in front of the shared
+    ResponseCacheEntry table. Entries expire after AI_RESPONSE_CACHE_TTL
+    seconds and the table is trimmed to AI_RESPONSE_CACHE_MAX_ENTRIES by
+    evicting the least recently accessed rows. Trimming scans the table, so
+    each process does it at most every AI_RESPONSE_CACHE_EVICT_INTERVAL
+    seconds rather than on every write.
+    """
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_evict = 0.0
+        self.local_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt: str, model_name: str) -> str:
+        """Content address for a prompt sent to a given model."""
+        return hashlib.sha256(f'{model_name}\0{prompt}'.encode('utf-8')).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.AI_RESPONSE_CACHE_ENABLED
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[str]:
+        """Return the cached response for a key, or None on a miss."""
+
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            cached = self._local.get(key)
+            if cached is not None:
+                response, expires_at = cached
+                if expires_at > time.time():
+                    self._local.move_to_end(key)
+                    self.local_hits += 1
+                    return response
+                del self._local[key]
+
+        try:
+            entry = ResponseCacheEntry.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+        except Exception as e:
+            logger.error(f"Response cache lookup failed: {str(e)}")
+            entry = None
+
+        if entry is None:
+            if count_miss:
+                with self._lock:
+                    self.misses += 1
+            return None
+
+        try:
+            ResponseCacheEntry.objects.filter(pk=entry.pk).update(
+                hit_count=F('hit_count') + 1,
+                last_accessed_at=timezone.now()
+            )
+        except Exception as e:
+            # The entry is still valid; only its access stats are lost
+            logger.error(f"Response cache hit update failed: {str(e)}")
+
+        with self._lock:
+            self.db_hits += 1
+            self._store_local(key, entry.response, entry.expires_at.timestamp())
+
+        return entry.response
+
+    def set(self, key: str, model_name: str, response: str):
+        """Store a response under a key in both cache levels."""
+
+        if not self.enabled or not response:
+            return
+
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.AI_RESPONSE_CACHE_TTL)
+
+        try:
+            ResponseCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model_name': model_name,
+                    'response': response,
+                    'last_accessed_at': now,
+                    'expires_at': expires_at,
+                }
+            )
+            if self._evict_due():
+                self._evict()
+        except Exception as e:
+            logger.error(f"Response cache store failed: {str(e)}")
+
+        with self._lock:
+            self._store_local(key, response, expires_at.timestamp())
+
+    def _store_local(self, key: str, response: str, expires_at: float):
+        # Caller holds the lock
+        self._local[key] = (response, expires_at)
+        self._local.move_to_end(key)
+        while len(self._local) > settings.AI_RESPONSE_CACHE_LOCAL_ENTRIES:
+            self._local.popitem(last=False)
+
+    def _evict_due(self) -> bool:
+        """Whether this process should trim the table now; claims the next run if so."""
+
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_evict:
+                return False
+            self._next_evict = now + settings.AI_RESPONSE_CACHE_EVICT_INTERVAL
+            return True
+
+    def _evict(self):
+        """Drop expired rows and trim the table to its maximum size."""
+
+        ResponseCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+
+        stale_ids = list(
+            ResponseCacheEntry.objects
+            .order_by('-last_accessed_at')
+            .values_list('pk', flat=True)[settings.AI_RESPONSE_CACHE_MAX_ENTRIES:]
+        )
+        if stale_ids:
+            ResponseCacheEntry.objects.filter(pk__in=stale_ids).delete()
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_stats(self) -> Dict:
+        """Hit and miss counters for this process."""
+
+        with self._lock:
+            hits = self.local_hits + self.db_hits
+            lookups = hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'local_entries': len(self._local),
+                'local_hits': self.local_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
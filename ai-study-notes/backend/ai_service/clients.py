@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+import google.generativeai as genai
+from google.generativeai.client import get_default_generative_client
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Process-wide Gemini models keyed by (model name, API key)
+_models: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+_configured_api_key: Optional[str] = None
+_lock = threading.Lock()
+
+
+def get_model(model_name: str, api_key: str) -> genai.GenerativeModel:
+    """
+    Return the shared GenerativeModel for a model name and API key.
+
+    genai.configure() throws away the underlying gRPC clients, so it is only
+    called when the active API key changes rather than once per request.
+    """
+    key = (model_name, api_key)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            _configure(api_key)
+            model = genai.GenerativeModel(model_name)
+            _models[key] = model
+
+    return model
+
+
+def _configure(api_key: str):
+    # Caller holds the lock
+    global _configured_api_key
+
+    if _configured_api_key != api_key:
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+
+        # Models bound to the previous key would now talk through the new one
+        for cached_key in [k for k in _models if k[1] != api_key]:
+            del _models[cached_key]
+
+
+def warm_up(model_name: Optional[str] = None, api_key: Optional[str] = None) -> bool:
+    """
+    Build the model and gRPC client ahead of the first request.
+
+    Called when a web or generation worker boots. Returns False when the API
+    key is not configured.
+    """
+    model_name = model_name or settings.GEMINI_MODEL
+    api_key = api_key or settings.GEMINI_API_KEY
+
+    if not api_key:
+        logger.warning("Skipping Gemini client warm-up: GEMINI_API_KEY is not configured")
+        return False
+
+    try:
+        get_model(model_name, api_key)
+        with _lock:
+            get_default_generative_client()
+    except Exception as e:
+        logger.error(f"Gemini client warm-up failed: {str(e)}")
+        return False
+
+    return True
+
+
+def reset():
+    """Forget all clients so they are rebuilt on next use."""
+
+    global _configured_api_key
+
+    with _lock:
+        _models.clear()
+        _configured_api_key = None
+
+
+def _reset_after_fork():
+    # gRPC channels must not be shared with a forked child, and the lock may
+    # have been held by another thread at fork time.
+    global _lock, _configured_api_key
+
+    _lock = threading.Lock()
+    _models.clear()
+    _configured_api_key = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
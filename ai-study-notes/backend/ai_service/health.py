@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from django.conf import settings
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(ordered: List[float], percent: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return round(ordered[index], 3)
+
+
+class HealthMonitor:
+    """
+    Upstream health from a background prober and from real API calls.
+
+    A daemon thread sends a cheap probe request (count_tokens for Gemini) every
+    AI_HEALTH_PROBE_INTERVAL seconds. Probe results and the outcome of every
+    real API call are kept for AI_HEALTH_WINDOW_SECONDS, so a status check
+    only reads in-memory state and never calls the API itself. Each process
+    runs its own prober.
+    """
+
+    MAX_SAMPLES = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._probes = deque(maxlen=self.MAX_SAMPLES)
+        self._traffic = deque(maxlen=self.MAX_SAMPLES)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    def record_call(self, latency: float, ok: bool):
+        """Record the outcome of a real API call."""
+        with self._lock:
+            self._traffic.append((time.monotonic(), latency, ok))
+
+    def probe(self) -> bool:
+        """Send one probe request and record its outcome."""
+
+        start = time.monotonic()
+        error = ''
+        try:
+            get_provider().probe()
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            self._probes.append((time.monotonic(), time.monotonic() - start, not error, error))
+        return not error
+
+    def ensure_started(self) -> bool:
+        """Start the prober in this process if it is enabled and not running yet."""
+
+        if settings.AI_HEALTH_PROBE_INTERVAL <= 0:
+            return False
+
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return True
+
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ai-health-prober', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"AI health probe failed: {str(e)}")
+            self._stop.wait(settings.AI_HEALTH_PROBE_INTERVAL)
+
+    def _window(self, samples: deque) -> List:
+        # Caller holds the lock
+        cutoff = time.monotonic() - settings.AI_HEALTH_WINDOW_SECONDS
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return list(samples)
+
+    def snapshot(self) -> Dict:
+        """Current upstream health from the rolling window."""
+
+        with self._lock:
+            probes = self._window(self._probes)
+            traffic = self._window(self._traffic)
+
+        now = time.monotonic()
+        last_probe = probes[-1] if probes else None
+        latencies = sorted(latency for _, latency, ok in traffic if ok)
+        errors = sum(1 for _, _, ok in traffic if not ok)
+        error_rate = errors / len(traffic) if traffic else 0.0
+
+        if last_probe is None and not traffic:
+            status = 'unknown'
+        elif last_probe is not None and not last_probe[2]:
+            status = 'error'
+        elif error_rate > settings.AI_HEALTH_DEGRADED_ERROR_RATE:
+            status = 'degraded'
+        else:
+            status = 'operational'
+
+        return {
+            'status': status,
+            'error': last_probe[3] if last_probe and not last_probe[2] else '',
+            'probe': {
+                'running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+                'last_ok': last_probe[2] if last_probe else None,
+                'last_latency_seconds': round(last_probe[1], 3) if last_probe else None,
+                'last_age_seconds': round(now - last_probe[0], 1) if last_probe else None,
+                'success_rate': sum(1 for probe in probes if probe[2]) / len(probes) if probes else None,
+            },
+            'traffic': {
+                'window_seconds': settings.AI_HEALTH_WINDOW_SECONDS,
+                'calls': len(traffic),
+                'error_rate': round(error_rate, 3),
+                'p50_latency_seconds': _percentile(latencies, 50),
+                'p95_latency_seconds': _percentile(latencies, 95),
+            },
+        }
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+
+health_monitor = HealthMonitor()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=health_monitor._reset_after_fork)
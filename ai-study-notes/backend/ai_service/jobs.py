@@ -0,0 +1,211 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import GenerationJob
+from .services import AIService
+from .throttling import CircuitOpenError, RateLimitExceeded
+from core.metrics import timing
+from notes.models import StudyTopic, StudyNote, NoteAnalytics, UserPreference
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_generation_job(topic: StudyTopic, kind: str = 'generate') -> GenerationJob:
+    """
+    Queue a note generation job for a topic.
+
+    If the topic already has a queued or running job, that job is returned
+    instead of creating a duplicate.
+
+    Args:
+        topic: StudyTopic instance
+        kind: 'generate' or 'regenerate'
+
+    Returns:
+        The queued GenerationJob
+    """
+    with transaction.atomic():
+        # Lock the topic row so concurrent requests cannot queue twice
+        topic = StudyTopic.objects.select_for_update().get(pk=topic.pk)
+
+        job = active_job(topic)
+        if job:
+            return job
+
+        topic.status = 'processing'
+        topic.save()
+
+        return GenerationJob.objects.create(user=topic.user, topic=topic, kind=kind)
+
+
+def active_job(topic: StudyTopic) -> Optional[GenerationJob]:
+    """The topic's queued or running generation job, if it has one."""
+
+    return GenerationJob.objects.filter(topic=topic, status__in=GenerationJob.ACTIVE_STATUSES).first()
+
+
+def claim_next_job(worker_id: str) -> Optional[GenerationJob]:
+    """
+    Claim the oldest queued job for this worker.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED so that any number of workers can
+    poll the queue concurrently without blocking on or double-claiming a job.
+    """
+    with transaction.atomic():
+        job = (
+            GenerationJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='queued')
+            .filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now()))
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.worker_id = worker_id
+        job.attempts += 1
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'worker_id', 'attempts', 'started_at', 'updated_at'])
+
+    return job
+
+
+def heartbeat(job_ids: Iterable[int]) -> int:
+    """Bump updated_at of running jobs so that requeue_stale_jobs() leaves them alone."""
+
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    return GenerationJob.objects.filter(pk__in=job_ids, status='running').update(updated_at=timezone.now())
+
+
+def requeue_stale_jobs(stale_after_seconds: int, max_attempts: Optional[int] = None) -> int:
+    """
+    Put running jobs whose worker went away back on the queue.
+
+    Workers bump updated_at of their running jobs with heartbeat(), so a job
+    is stale when its heartbeat stopped, not when it has merely been running
+    for a long time. A stale job that already had max_attempts attempts
+    fails instead, so a job that keeps killing its worker isn't retried forever.
+
+    Args:
+        stale_after_seconds: Seconds without a heartbeat after which a job is stale
+        max_attempts: Attempts after which a stale job fails (default GENERATION_JOB_MAX_ATTEMPTS)
+
+    Returns:
+        Number of jobs put back on the queue
+    """
+    if max_attempts is None:
+        max_attempts = settings.GENERATION_JOB_MAX_ATTEMPTS
+
+    now = timezone.now()
+    stale = GenerationJob.objects.filter(status='running', updated_at__lt=now - timedelta(seconds=stale_after_seconds))
+
+    with transaction.atomic():
+        exhausted = stale.filter(attempts__gte=max_attempts).select_related('topic').select_for_update(skip_locked=True)
+        for job in exhausted:
+            logger.error(f"Generation job {job.pk} failed: its worker stopped responding on {job.attempts} attempt(s)")
+
+            topic = job.topic
+            topic.status = 'completed' if StudyNote.objects.filter(topic=topic).exists() else 'failed'
+            topic.save(update_fields=['status', 'updated_at'])
+
+            job.status = 'failed'
+            job.worker_id = ''
+            job.error_message = f'The worker stopped responding on {job.attempts} attempt(s)'
+            job.finished_at = now
+            job.save(update_fields=['status', 'worker_id', 'error_message', 'finished_at', 'updated_at'])
+
+    return stale.filter(attempts__lt=max_attempts).update(status='queued', worker_id='', updated_at=now)
+
+
+def save_generated_note(topic: StudyTopic, result: Dict) -> StudyNote:
+    """Persist a generation result as the topic's study note, replacing any existing note."""
+
+    with timing('save'), transaction.atomic():
+        StudyNote.objects.filter(topic=topic).delete()
+
+        study_note = StudyNote.objects.create(
+            topic=topic,
+            content=result['content'],
+            summary=result['summary'],
+            key_points=result['key_points'],
+            references=result['references'],
+            word_count=result['word_count'],
+            reading_time_minutes=result['reading_time_minutes'],
+            ai_model_used=result['ai_model_used'],
+            generation_time_seconds=result['generation_time_seconds']
+        )
+
+        # Create analytics
+        NoteAnalytics.objects.create(note=study_note)
+
+        # Update topic status
+        topic.status = 'completed'
+        topic.save()
+
+    return study_note
+
+
+def run_generation_job(job: GenerationJob) -> GenerationJob:
+    """Generate and store the study note for a claimed job."""
+
+    topic = job.topic
+
+    existing_note = StudyNote.objects.filter(topic=topic).first()
+    if job.kind == 'generate' and existing_note:
+        # Another request generated the notes while this job was queued
+        job.status = 'succeeded'
+        job.note = existing_note
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'note', 'finished_at', 'updated_at'])
+        return job
+
+    try:
+        user_preferences = UserPreference.objects.filter(user=topic.user).first()
+
+        ai_service = AIService()
+        # Regeneration asks for fresh notes, so it bypasses the response cache
+        result = ai_service.generate_study_notes(
+            topic, user_preferences, use_cache=(job.kind == 'generate')
+        )
+
+        study_note = save_generated_note(topic, result)
+
+        job.status = 'succeeded'
+        job.note = study_note
+        job.error_message = ''
+
+    except (RateLimitExceeded, CircuitOpenError) as e:
+        # Out of API budget or upstream unhealthy: try again later
+        logger.warning(f"Generation job {job.pk} deferred: {str(e)}")
+
+        job.status = 'queued'
+        job.worker_id = ''
+        job.run_after = timezone.now() + timedelta(seconds=e.retry_after)
+        job.error_message = str(e)
+        # Nothing was attempted, so a deferral doesn't count towards GENERATION_JOB_MAX_ATTEMPTS
+        job.attempts = max(0, job.attempts - 1)
+        job.save(update_fields=['status', 'worker_id', 'run_after', 'error_message', 'attempts', 'updated_at'])
+        return job
+
+    except Exception as e:
+        logger.error(f"Generation job {job.pk} failed: {str(e)}")
+
+        # A failed regeneration leaves the previous notes in place
+        topic.status = 'completed' if existing_note else 'failed'
+        topic.save()
+
+        job.status = 'failed'
+        job.error_message = str(e)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'note', 'error_message', 'finished_at', 'updated_at'])
+
+    return job
@@ -0,0 +1,125 @@
+import hashlib
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import transaction
+from .models import AIServiceLog, PromptBlob, render_prompt
+from .prompts import compile_template
+
+# hash -> PromptBlob id; prompt templates are few, so this rarely fills up
+_blob_ids: Dict[str, int] = {}
+_blob_ids_lock = threading.Lock()
+BLOB_ID_CACHE_SIZE = 1024
+
+
+def compress_text(text: str) -> Optional[bytes]:
+    """zlib-compress text for AIServiceLog.response_data; empty text is stored as NULL."""
+
+    if not text:
+        return None
+    return zlib.compress(text.encode('utf-8'), settings.AI_LOG_COMPRESSION_LEVEL)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def pack_prompt(log: AIServiceLog, prompt: str, template_source: str = '', variables: Optional[Dict] = None):
+    """
+    Store a prompt on an unsaved log as a blob reference plus variables.
+
+    When the prompt is the template with the variables filled in, the blob
+    is the template text, which every log of that template shares.
+    Otherwise the whole prompt becomes the blob, shared only by identical
+    prompts. The blob is left unsaved; resolve_prompt_blobs() saves it.
+
+    Args:
+        log: Unsaved AIServiceLog
+        prompt: The rendered prompt
+        template_source: Text of the template the prompt was rendered from
+        variables: Values substituted into the template
+    """
+    log.prompt = ''
+    if not prompt:
+        log.prompt_blob = None
+        log.prompt_variables = {}
+        return
+
+    if not template_source or variables is None or render_prompt(template_source, variables) != prompt:
+        template_source, variables = prompt, {}
+
+    log.prompt_blob = PromptBlob(hash=content_hash(template_source), content=template_source)
+    log.prompt_variables = variables
+
+
+def extract_variables(template_source: str, prompt: str) -> Optional[Dict]:
+    """
+    Recover the variables a prompt was rendered with from its template.
+
+    Returns:
+        Dict of variable values as strings, or None if the prompt wasn't
+        rendered from this template
+    """
+    pattern = []
+    seen = set()
+    for literal, name in compile_template(template_source):
+        pattern.append(re.escape(literal))
+        if name is None:
+            continue
+        pattern.append(f'(?P={name})' if name in seen else f'(?P<{name}>.*?)')
+        seen.add(name)
+
+    match = re.fullmatch(''.join(pattern), prompt, re.DOTALL)
+    if match is None:
+        return None
+
+    variables = match.groupdict()
+    return variables if render_prompt(template_source, variables) == prompt else None
+
+
+def resolve_prompt_blobs(logs: List[AIServiceLog]) -> List[PromptBlob]:
+    """
+    Save the unsaved prompt blobs of logs, reusing blobs that already exist.
+
+    Returns:
+        The blobs that were not in the database yet
+    """
+    pending = {}
+    for log in logs:
+        blob = log.prompt_blob if log.prompt_blob_id is None else None
+        if blob is not None and blob.pk is None:
+            pending.setdefault(blob.hash, []).append(blob)
+    if not pending:
+        return []
+
+    with _blob_ids_lock:
+        ids = {blob_hash: _blob_ids[blob_hash] for blob_hash in pending if blob_hash in _blob_ids}
+
+    missing = [blob_hash for blob_hash in pending if blob_hash not in ids]
+    created = []
+    if missing:
+        ids.update(PromptBlob.objects.filter(hash__in=missing).values_list('hash', 'id'))
+        created = [pending[blob_hash][0] for blob_hash in missing if blob_hash not in ids]
+        if created:
+            # Another process may save the same blob meanwhile
+            PromptBlob.objects.bulk_create(
+                [PromptBlob(hash=blob.hash, content=blob.content) for blob in created], ignore_conflicts=True
+            )
+            ids.update(PromptBlob.objects.filter(hash__in=[blob.hash for blob in created]).values_list('hash', 'id'))
+
+        def remember():
+            with _blob_ids_lock:
+                if len(_blob_ids) + len(missing) > BLOB_ID_CACHE_SIZE:
+                    _blob_ids.clear()
+                _blob_ids.update((blob_hash, ids[blob_hash]) for blob_hash in missing)
+
+        # Blobs created in a transaction that rolls back must not be cached
+        transaction.on_commit(remember)
+
+    for blob_hash, blobs in pending.items():
+        for blob in blobs:
+            blob.pk = ids[blob_hash]
+
+    return created
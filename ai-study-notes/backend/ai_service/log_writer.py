@@ -0,0 +1,180 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from .log_storage import resolve_prompt_blobs
+from .models import AIServiceLog
+from .rollups import record_usage
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedLogWriter:
+    """
+    Write AIServiceLog rows from a background thread in batches.
+
+    write() only appends the unsaved row to an in-memory buffer. A daemon
+    thread saves the buffer with bulk_create once it holds
+    AI_LOG_FLUSH_BATCH_SIZE rows or AI_LOG_FLUSH_INTERVAL seconds have
+    passed, and the buffer is flushed at interpreter exit. When the buffer
+    already holds AI_LOG_BUFFER_MAX_SIZE rows, new rows are dropped and
+    counted. With AI_LOG_ASYNC off, rows are saved immediately instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._buffer: List[AIServiceLog] = []
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def write(self, log: AIServiceLog):
+        """Queue an unsaved log row; never waits on the database."""
+
+        if not settings.AI_LOG_ASYNC:
+            self._save([log])
+            with self._lock:
+                self.written += 1
+            return
+
+        self._ensure_started()
+        with self._lock:
+            if len(self._buffer) >= settings.AI_LOG_BUFFER_MAX_SIZE:
+                self.dropped += 1
+                return
+            self._buffer.append(log)
+            if len(self._buffer) >= settings.AI_LOG_FLUSH_BATCH_SIZE:
+                self._wake.notify()
+
+    def flush(self) -> int:
+        """Save everything buffered so far in the calling thread. Returns the rows written."""
+
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        try:
+            self._save(batch)
+            written = len(batch)
+        except Exception as e:
+            logger.warning(f"Failed to write {len(batch)} AI service log(s) at once, retrying one by one: {str(e)}")
+            written = self._save_each(batch)
+
+        with self._lock:
+            self.written += written
+            self.failed += len(batch) - written
+            self.flushes += 1
+        return written
+
+    def _save(self, batch: List[AIServiceLog]):
+        # Logs and their usage rollups are saved together, so each log is counted once
+        with transaction.atomic():
+            resolve_prompt_blobs(batch)
+            for log in batch:
+                log.rolled_up = True
+            AIServiceLog.objects.bulk_create(batch, batch_size=settings.AI_LOG_FLUSH_BATCH_SIZE)
+            record_usage(batch)
+
+    def _save_each(self, batch: List[AIServiceLog]) -> int:
+        # One bad row, e.g. of a topic deleted since, shouldn't cost the whole batch
+        written = 0
+        for log in batch:
+            _mark_unsaved(log)
+            try:
+                self._save([log])
+                written += 1
+            except Exception as e:
+                logger.error(f"Dropped the AI service log of a {log.model_used} call: {str(e)}")
+        return written
+
+    def close(self):
+        """Stop the flush thread and save what is left."""
+
+        with self._lock:
+            self._stopping = True
+            self._wake.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=settings.AI_LOG_FLUSH_INTERVAL + 5)
+        self.flush()
+
+    def _ensure_started(self):
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ai-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + settings.AI_LOG_FLUSH_INTERVAL
+            with self._lock:
+                while (not self._stopping and len(self._buffer) < settings.AI_LOG_FLUSH_BATCH_SIZE
+                       and time.monotonic() < deadline):
+                    self._wake.wait(max(0.0, deadline - time.monotonic()))
+                stopping = self._stopping
+
+            if stopping:
+                # close() flushes the rest in its own thread
+                break
+
+            close_old_connections()
+            self.flush()
+
+        connection.close()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'async': settings.AI_LOG_ASYNC,
+                'buffered': len(self._buffer),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+            }
+
+    def _reset_after_fork(self):
+        # Rows buffered in the parent are the parent's to write
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._buffer = []
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+
+def _mark_unsaved(log: AIServiceLog):
+    # bulk_create() set the pk even though the transaction rolled back
+    log.pk = None
+    log._state.adding = True
+
+    blob = log.prompt_blob if AIServiceLog.prompt_blob.is_cached(log) else None
+    if blob is not None:
+        # The blob may have been created in the rolled back transaction too
+        log.prompt_blob_id = None
+        blob.pk = None
+        log.prompt_blob = blob
+
+
+log_writer = BufferedLogWriter()
+
+atexit.register(log_writer.close)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_writer._reset_after_fork)
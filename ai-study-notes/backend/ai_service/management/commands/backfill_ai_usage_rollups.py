@@ -0,0 +1,52 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ai_service.models import AIServiceLog, AIUsageRollup
+from ai_service.rollups import LOG_FIELDS, record_usage
+
+
+class Command(BaseCommand):
+    help = 'Add AI service logs that are not counted in the usage rollups yet, such as logs written before rollups existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Delete all rollups and count every log again. Stop log writers first; '
+                 'logs written during the rebuild may be counted twice.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+
+        if options['rebuild']:
+            with transaction.atomic():
+                deleted, _ = AIUsageRollup.objects.all().delete()
+                AIServiceLog.objects.filter(rolled_up=True).update(rolled_up=False)
+            self.stdout.write(f'Deleted {deleted} rollups')
+
+        count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # Locked, so that two backfills can't count a log twice; a row another
+                # backfill marked while this one waited no longer matches the filter
+                batch = list(
+                    AIServiceLog.objects
+                    .filter(rolled_up=False, id__gt=last_id)
+                    .only(*LOG_FIELDS)
+                    .order_by('id')
+                    .select_for_update()[:options['batch_size']]
+                )
+                if not batch:
+                    break
+
+                record_usage(batch)
+                AIServiceLog.objects.filter(id__in=[log.id for log in batch]).update(rolled_up=True)
+
+            last_id = batch[-1].id
+            count += len(batch)
+            self.stdout.write(f'Rolled up {count} logs')
+
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {count} logs in {time.monotonic() - start:.1f}s'))
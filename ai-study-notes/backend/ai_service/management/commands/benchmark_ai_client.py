@@ -0,0 +1,68 @@
+import statistics
+import time
+import google.generativeai as genai
+from google.generativeai.client import get_default_generative_client
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ai_service import clients
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request Gemini client setup cost with and without the shared client registry.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--model', default=settings.GEMINI_MODEL)
+        parser.add_argument(
+            '--api-key',
+            default=settings.GEMINI_API_KEY or 'benchmark-key',
+            help='No requests are sent, so any non-empty key works.',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        model_name = options['model']
+        api_key = options['api_key']
+
+        def per_request_setup():
+            # What every request used to do: reconfigure, build a model and,
+            # on the first generate_content call, a new gRPC client.
+            genai.configure(api_key=api_key)
+            genai.GenerativeModel(model_name)
+            get_default_generative_client()
+
+        def shared_registry():
+            clients.get_model(model_name, api_key)
+
+        clients.reset()
+        legacy = self._measure(per_request_setup, iterations)
+
+        clients.reset()
+        clients.warm_up(model_name, api_key)
+        shared = self._measure(shared_registry, iterations)
+
+        self._report('per-request setup', legacy)
+        self._report('shared registry', shared)
+
+        speedup = statistics.mean(legacy) / max(statistics.mean(shared), 1e-9)
+        saved_ms = (statistics.mean(legacy) - statistics.mean(shared)) * 1000
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {saved_ms:.3f} ms per request ({speedup:,.0f}x less setup work)'
+        ))
+
+    def _measure(self, func, iterations):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def _report(self, label, samples):
+        ordered = sorted(samples)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        self.stdout.write(
+            f'{label:>18}: mean {statistics.mean(samples) * 1e6:10.1f} us  '
+            f'p50 {statistics.median(samples) * 1e6:10.1f} us  '
+            f'p95 {p95 * 1e6:10.1f} us'
+        )
@@ -0,0 +1,154 @@
+import json
+import statistics
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from ai_service.parsing import parse_response
+
+CORPUS_DIR = Path(__file__).resolve().parents[2] / 'benchmarks' / 'parser_corpus'
+FIELDS = ('content', 'summary', 'key_points', 'references')
+
+
+def _normalize(value):
+    # Compare text ignoring whitespace differences the renderer would not show
+    if isinstance(value, list):
+        return [' '.join(item.split()) for item in value]
+    return ' '.join(value.split())
+
+
+def legacy_parse_response(response):
+    """The previous AIService._parse_response, kept for comparison."""
+
+    sections = response.split('**')
+
+    content = ""
+    summary = ""
+    key_points = []
+    references = []
+
+    current_section = None
+
+    for section in sections:
+        section = section.strip()
+        if not section:
+            continue
+
+        if 'CONTENT:' in section:
+            current_section = 'content'
+            content = section.replace('CONTENT:', '').strip()
+        elif 'SUMMARY:' in section:
+            current_section = 'summary'
+            summary = section.replace('SUMMARY:', '').strip()
+        elif 'KEY POINTS:' in section:
+            current_section = 'key_points'
+            points_text = section.replace('KEY POINTS:', '').strip()
+            key_points = [point.strip('- ').strip() for point in points_text.split('\n') if point.strip().startswith('-')]
+        elif 'REFERENCES:' in section:
+            current_section = 'references'
+            refs_text = section.replace('REFERENCES:', '').strip()
+            references = [ref.strip('- ').strip() for ref in refs_text.split('\n') if ref.strip().startswith('-')]
+        elif current_section == 'content':
+            content += " " + section
+        elif current_section == 'summary':
+            summary += " " + section
+        elif current_section == 'key_points':
+            if section.strip().startswith('-'):
+                key_points.append(section.strip('- ').strip())
+        elif current_section == 'references':
+            if section.strip().startswith('-'):
+                references.append(section.strip('- ').strip())
+
+    if not content:
+        content = response
+
+    return {
+        'content': content,
+        'summary': summary,
+        'key_points': key_points,
+        'references': references,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare the response parser against the legacy parser on the recorded corpus.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument(
+            '--scale',
+            type=int,
+            default=50,
+            help='Also time a long note built from this many copies of every corpus content section.',
+        )
+        parser.add_argument('--verbose', action='store_true', help='Show each field that does not match.')
+
+    def handle(self, *args, **options):
+        corpus = self._load_corpus()
+        parsers = [('legacy', legacy_parse_response), ('single-pass', parse_response)]
+
+        self.stdout.write(f'Corpus: {len(corpus)} responses from {CORPUS_DIR}')
+
+        for label, parse in parsers:
+            matched, mismatches = self._accuracy(parse, corpus)
+            total = len(corpus) * len(FIELDS)
+            self.stdout.write(f'{label:>12}: {matched}/{total} fields correct ({matched / total:.0%})')
+            if options['verbose']:
+                for name, field in mismatches:
+                    self.stdout.write(f'{"":>14}{name}: {field}')
+
+        long_note = self._long_note(corpus, options['scale'])
+        workloads = [
+            ('corpus', lambda parse: [parse(response) for _, response, _ in corpus]),
+            (f'long note ({len(long_note) // 1024} KiB)', lambda parse: parse(long_note)),
+        ]
+
+        for workload, run in workloads:
+            timings = {}
+            for label, parse in parsers:
+                timings[label] = self._measure(lambda: run(parse), options['iterations'])
+                self.stdout.write(
+                    f'{workload:>22} {label:>12}: mean {statistics.mean(timings[label]) * 1e6:10.1f} us  '
+                    f'p50 {statistics.median(timings[label]) * 1e6:10.1f} us'
+                )
+            speedup = statistics.mean(timings['legacy']) / max(statistics.mean(timings['single-pass']), 1e-9)
+            self.stdout.write(self.style.SUCCESS(f'{workload:>22}: single-pass is {speedup:.2f}x the legacy speed'))
+
+    def _load_corpus(self):
+        corpus = []
+        for path in sorted(CORPUS_DIR.glob('*.txt')):
+            # Read bytes so CRLF line endings are kept as recorded
+            response = path.read_bytes().decode('utf-8')
+            expected = json.loads(path.with_suffix('.json').read_text(encoding='utf-8'))
+            corpus.append((path.stem, response, expected))
+        return corpus
+
+    def _accuracy(self, parse, corpus):
+        matched = 0
+        mismatches = []
+        for name, response, expected in corpus:
+            result = parse(response)
+            for field in FIELDS:
+                if _normalize(result[field]) == _normalize(expected[field]):
+                    matched += 1
+                else:
+                    mismatches.append((name, field))
+        return matched, mismatches
+
+    def _long_note(self, corpus, scale):
+        # One very long content section followed by the other sections
+        body = '\n\n'.join(expected['content'] for _, _, expected in corpus)
+        _, _, first = corpus[0]
+        return (
+            '**CONTENT:**\n' + '\n\n'.join([body] * scale) +
+            '\n\n**SUMMARY:**\n' + first['summary'] +
+            '\n\n**KEY POINTS:**\n' + '\n'.join(f'- {point}' for point in first['key_points']) +
+            '\n\n**REFERENCES:**\n' + '\n'.join(f'- {ref}' for ref in first['references'])
+        )
+
+    def _measure(self, func, iterations):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        return samples
@@ -0,0 +1,84 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from ai_service.log_storage import compress_text, extract_variables, pack_prompt, resolve_prompt_blobs
+from ai_service.models import AIServiceLog, PromptBlob
+
+UPDATED_FIELDS = ['prompt', 'response', 'prompt_blob', 'prompt_variables', 'response_data']
+
+
+def _size(text):
+    return len(text.encode('utf-8'))
+
+
+class Command(BaseCommand):
+    help = 'Move AI service logs stored as plain text to prompt blobs and compressed responses, reporting the space saved.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report the savings without changing anything.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        count = 0
+        before = 0
+        after = 0
+        seen_hashes = set()
+        last_id = 0
+
+        # Rows written before compaction are the only ones with text in these columns
+        legacy = (
+            AIServiceLog.objects
+            .filter(~Q(prompt='') | ~Q(response=''))
+            .select_related('template')
+            .order_by('id')
+        )
+
+        while True:
+            batch = list(legacy.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for log in batch:
+                prompt, response = log.prompt, log.response
+                before += _size(prompt) + _size(response)
+
+                # Logs of a template share its text when the prompt can be split back into variables
+                template_source = log.template.prompt_template if log.template else ''
+                variables = extract_variables(template_source, prompt) if template_source and prompt else None
+                pack_prompt(log, prompt, template_source, variables)
+                log.response = ''
+                log.response_data = compress_text(response)
+
+                after += len(log.response_data or b'')
+                if log.prompt_variables:
+                    after += _size(json.dumps(log.prompt_variables))
+
+            # Blob text counts once, and only for blobs this run adds
+            blobs = {log.prompt_blob.hash: log.prompt_blob for log in batch if log.prompt_blob is not None}
+            existing = set(PromptBlob.objects.filter(hash__in=blobs).values_list('hash', flat=True))
+            for blob_hash, blob in blobs.items():
+                if blob_hash not in existing and blob_hash not in seen_hashes:
+                    after += _size(blob.content)
+            seen_hashes.update(blobs)
+
+            if not options['dry_run']:
+                with transaction.atomic():
+                    resolve_prompt_blobs(batch)
+                    AIServiceLog.objects.bulk_update(batch, UPDATED_FIELDS)
+
+            count += len(batch)
+            self.stdout.write(f'{"Checked" if options["dry_run"] else "Compacted"} {count} logs')
+
+        saved = before - after
+        percent = saved * 100 / before if before else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would compact" if options["dry_run"] else "Compacted"} {count} logs in {time.monotonic() - start:.1f}s: '
+            f'{before / 1024:.1f} KiB of prompts and responses now take {after / 1024:.1f} KiB, '
+            f'{saved / 1024:.1f} KiB ({percent:.1f}%) saved'
+        ))
+        if count and not options['dry_run']:
+            self.stdout.write('PostgreSQL reuses the freed space; run VACUUM FULL on ai_service_aiservicelog to return it to the OS.')
@@ -0,0 +1,147 @@
+import os
+import signal
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+from ai_service import providers
+from ai_service.jobs import claim_next_job, heartbeat, requeue_stale_jobs, run_generation_job
+from ai_service.log_writer import log_writer
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = 'Process queued study note generation jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling for new jobs.',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.GENERATION_WORKER_CONCURRENCY,
+            help='Number of jobs to run in parallel in this process.',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.GENERATION_WORKER_POLL_INTERVAL,
+            help='Seconds to sleep when the queue is empty.',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=settings.GENERATION_JOB_STALE_SECONDS,
+            help='Requeue running jobs whose worker sent no heartbeat for this many seconds.',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            default=settings.GENERATION_WORKER_METRICS_PORT,
+            help='Serve the stage timing histograms in the Prometheus format on this port (0 to disable).',
+        )
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = max(1, options['concurrency'])
+        self.stopping = False
+        self.running_jobs = set()
+        self.running_jobs_lock = threading.Lock()
+
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        providers.warm_up()
+        self.stdout.write(f'Generation worker {worker_id} started with {concurrency} thread(s)')
+
+        # Jobs run outside any web process, so their timings are served from here
+        if options['metrics_port']:
+            metrics.serve(options['metrics_port'])
+            self.stdout.write(f'Serving metrics on port {options["metrics_port"]}')
+
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+
+        threads = [
+            threading.Thread(
+                target=self._work_loop,
+                args=(f'{worker_id}:{index}', options),
+                name=f'generation-worker-{index}',
+                daemon=True,
+            )
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Sleep in short steps so signals are handled promptly
+        last_stale_check = last_heartbeat = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+
+            if time.monotonic() - last_heartbeat > settings.GENERATION_JOB_HEARTBEAT_SECONDS:
+                self._send_heartbeat()
+                last_heartbeat = time.monotonic()
+
+            if time.monotonic() - last_stale_check > options['stale_after']:
+                requeued = requeue_stale_jobs(options['stale_after'])
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+                last_stale_check = time.monotonic()
+
+        # Save the logs of the last jobs before exiting
+        log_writer.close()
+        close_old_connections()
+        self.stdout.write(f'Generation worker {worker_id} stopped')
+
+    def _work_loop(self, worker_id, options):
+        """Claim and run jobs until stopped (or until the queue is empty with --once)."""
+
+        try:
+            while not self.stopping:
+                close_old_connections()
+
+                try:
+                    job = claim_next_job(worker_id)
+                except DatabaseError as e:
+                    self.stderr.write(f'Failed to claim a job: {str(e)}')
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                with self.running_jobs_lock:
+                    self.running_jobs.add(job.pk)
+                try:
+                    with metrics.timing('job'):
+                        job = run_generation_job(job)
+                finally:
+                    with self.running_jobs_lock:
+                        self.running_jobs.discard(job.pk)
+                self.stdout.write(f'Job {job.pk} ({job.kind} topic {job.topic_id}): {job.status}')
+        finally:
+            connection.close()
+
+    def _send_heartbeat(self):
+        # Slow jobs stay claimed as long as this process is alive
+        with self.running_jobs_lock:
+            job_ids = list(self.running_jobs)
+        try:
+            heartbeat(job_ids)
+        except DatabaseError as e:
+            self.stderr.write(f'Failed to send a heartbeat: {str(e)}')
+
+    def _request_stop(self, signum, frame):
+        # Finish the current job, then exit
+        self.stopping = True
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0007_ratelimitbucket_generationjob_run_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='hedge_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='hedge_won',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0008_aiservicelog_hedge_count_aiservicelog_hedge_won'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='candidates_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='estimated_cost',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='max_word_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='logs', to='ai_service.prompttemplate'),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='total_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0009_aiservicelog_candidates_tokens_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='fallback_from',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0010_aiservicelog_fallback_from'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='prompt_variables',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='response_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='aiservicelog',
+            name='prompt',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='aiservicelog',
+            name='response',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='prompt_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='logs', to='ai_service.promptblob'),
+        ),
+    ]
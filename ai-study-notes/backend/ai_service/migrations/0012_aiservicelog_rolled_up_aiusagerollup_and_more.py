@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ai_service', '0011_promptblob_aiservicelog_prompt_variables_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiservicelog',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='AIUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_used', models.CharField(max_length=50)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('successful_requests', models.PositiveIntegerField(default=0)),
+                ('failed_requests', models.PositiveIntegerField(default=0)),
+                ('cache_hits', models.PositiveIntegerField(default=0)),
+                ('coalesced_requests', models.PositiveIntegerField(default=0)),
+                ('hedged_requests', models.PositiveIntegerField(default=0)),
+                ('hedges_won', models.PositiveIntegerField(default=0)),
+                ('fallback_requests', models.PositiveIntegerField(default=0)),
+                ('response_time_sum', models.FloatField(default=0.0)),
+                ('latency_histogram', models.JSONField(default=list)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('candidates_tokens', models.BigIntegerField(default=0)),
+                ('total_tokens', models.BigIntegerField(default=0)),
+                ('estimated_cost', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_usage_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='aiusagerollup',
+            constraint=models.UniqueConstraint(fields=('user', 'granularity', 'period_start', 'model_used'), name='unique_ai_usage_rollup'),
+        ),
+    ]
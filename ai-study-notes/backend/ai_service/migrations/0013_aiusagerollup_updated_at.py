@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0012_aiservicelog_rolled_up_aiusagerollup_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiusagerollup',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,6 +1,32 @@
+import re
+import zlib
 from django.db import models
 from django.conf import settings
-from notes.models import StudyTopic
+from django.core.exceptions import ValidationError
+from notes.models import StudyTopic, StudyNote
+
+# Variables available to prompt templates as {name}
+PROMPT_VARIABLES = ('topic_title', 'topic_description', 'difficulty', 'subject', 'max_words')
+PLACEHOLDER_RE = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+def render_prompt(text: str, variables: dict) -> str:
+    """Fill in the placeholders that have a value; any other braces are literal text."""
+    
+    return PLACEHOLDER_RE.sub(
+        lambda match: str(variables[match.group(1)]) if match.group(1) in variables else match.group(0), text
+    )
+
+
+class PromptBlob(models.Model):
+    """Model for prompt text shared by many logs, stored once per content hash."""
+    
+    hash = models.CharField(max_length=64, unique=True)  # SHA-256 of the content
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Prompt {self.hash[:12]} ({len(self.content)} chars)"
 
 
 class AIServiceLog(models.Model):
@@ -14,17 +40,51 @@ class AIServiceLog(models.Model):
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     topic = models.ForeignKey(StudyTopic, on_delete=models.CASCADE, null=True, blank=True)
-    prompt = models.TextField()
-    response = models.TextField()
+    # Rows written before prompts and responses were compacted keep them as plain text here
+    prompt = models.TextField(blank=True)
+    response = models.TextField(blank=True)
+    # The prompt is the blob with prompt_variables filled in
+    prompt_blob = models.ForeignKey(PromptBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='logs')
+    prompt_variables = models.JSONField(default=dict, blank=True)
+    response_data = models.BinaryField(null=True, blank=True)  # zlib-compressed UTF-8
+    rolled_up = models.BooleanField(default=False)  # Counted in AIUsageRollup
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     model_used = models.CharField(max_length=50, default='gemini-pro')
+    fallback_from = models.CharField(max_length=50, blank=True)  # Model that failed or was too slow first
     response_time_seconds = models.FloatField(default=0.0)
     error_message = models.TextField(blank=True)
+    cache_hit = models.BooleanField(default=False)
+    coalesced = models.BooleanField(default=False)
+    hedge_count = models.PositiveSmallIntegerField(default=0)
+    hedge_won = models.BooleanField(default=False)
+    template = models.ForeignKey('PromptTemplate', on_delete=models.SET_NULL, null=True, blank=True, related_name='logs')
+    max_word_count = models.PositiveIntegerField(null=True, blank=True)
+    # Token usage reported by the API; empty when no API call was made
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    candidates_tokens = models.PositiveIntegerField(null=True, blank=True)
+    total_tokens = models.PositiveIntegerField(null=True, blank=True)
+    estimated_cost = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True)  # USD
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"AI Log - {self.user.email} - {self.status} - {self.created_at}"
     
+    @property
+    def prompt_text(self) -> str:
+        """The full prompt, whichever way it is stored."""
+        
+        if self.prompt_blob_id is None:
+            return self.prompt
+        return render_prompt(self.prompt_blob.content, self.prompt_variables)
+    
+    @property
+    def response_text(self) -> str:
+        """The raw response, whichever way it is stored."""
+        
+        if self.response_data is None:
+            return self.response
+        return zlib.decompress(self.response_data).decode('utf-8')
+    
     class Meta:
         ordering = ['-created_at']
 
@@ -51,5 +111,147 @@ class PromptTemplate(models.Model):
     def __str__(self):
         return f"{self.name} ({self.template_type})"
     
+    def clean(self):
+        unknown = sorted(set(PLACEHOLDER_RE.findall(self.prompt_template)) - set(PROMPT_VARIABLES))
+        if unknown:
+            raise ValidationError({
+                'prompt_template': f"Unknown placeholder(s): {', '.join('{%s}' % name for name in unknown)}. "
+                                   f"Available: {', '.join('{%s}' % name for name in PROMPT_VARIABLES)}"
+            })
+        if '{topic_title}' not in self.prompt_template:
+            raise ValidationError({'prompt_template': "Template must include the {topic_title} placeholder"})
+    
+    def save(self, *args, **kwargs):
+        # Templates are compiled and cached on use, so reject bad ones up front
+        self.clean()
+        super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['template_type', 'name']
+
+
+class GenerationJob(models.Model):
+    """Model for note generation requests processed by background workers."""
+    
+    KIND_CHOICES = [
+        ('generate', 'Generate'),
+        ('regenerate', 'Regenerate'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='generation_jobs')
+    topic = models.ForeignKey(StudyTopic, on_delete=models.CASCADE, related_name='generation_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='generate')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    note = models.ForeignKey(StudyNote, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error_message = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker_id = models.CharField(max_length=100, blank=True)
+    run_after = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Job {self.pk} - {self.topic.title} - {self.status}"
+    
+    ACTIVE_STATUSES = ('queued', 'running')
+    
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+class ResponseCacheEntry(models.Model):
+    """Model for caching raw AI responses keyed on a hash of the prompt and model."""
+    
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=50)
+    response = models.TextField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Cached response {self.key[:12]} ({self.model_name})"
+    
+    class Meta:
+        ordering = ['-last_accessed_at']
+
+
+class GenerationLease(models.Model):
+    """Model for cross-process leases that let one worker call the AI API per prompt."""
+    
+    key = models.CharField(max_length=64, unique=True)
+    owner = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Lease {self.key[:12]} held by {self.owner}"
+
+
+class RateLimitBucket(models.Model):
+    """Model for token buckets that rate limit AI API calls across processes."""
+    
+    key = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f} tokens"
+
+
+class AIUsageRollup(models.Model):
+    """Model for per user, model and hour or day totals of AIServiceLog rows."""
+    
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_usage_rollups')
+    model_used = models.CharField(max_length=50)
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    requests = models.PositiveIntegerField(default=0)
+    successful_requests = models.PositiveIntegerField(default=0)
+    failed_requests = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    coalesced_requests = models.PositiveIntegerField(default=0)
+    hedged_requests = models.PositiveIntegerField(default=0)
+    hedges_won = models.PositiveIntegerField(default=0)
+    fallback_requests = models.PositiveIntegerField(default=0)
+    # Latency of successful requests: the sum for the mean, and counts per rollups.LATENCY_BUCKETS bucket
+    response_time_sum = models.FloatField(default=0.0)
+    latency_histogram = models.JSONField(default=list)
+    prompt_tokens = models.BigIntegerField(default=0)
+    candidates_tokens = models.BigIntegerField(default=0)
+    total_tokens = models.BigIntegerField(default=0)
+    estimated_cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)  # USD
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.model_used} - {self.granularity} from {self.period_start}"
+    
+    class Meta:
+        ordering = ['-period_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'granularity', 'period_start', 'model_used'], name='unique_ai_usage_rollup'
+            ),
+        ]
@@ -0,0 +1,154 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# A section header at the start of a line, e.g. "**KEY POINTS:**", "## **Summary**:"
+# or "**CONTENT:** text that starts on the same line"
+SECTION_HEADER_RE = re.compile(
+    r'[ \t]*(?:#{1,6}[ \t]*)?\*\*[ \t]*(CONTENT|SUMMARY|KEY POINTS|REFERENCES)[ \t]*'
+    r'(?::[ \t]*\*\*|\*\*[ \t]*:)[ \t]*(.*)',
+    re.IGNORECASE
+)
+
+# A list item in the key points or references section: "- x", "* x", "• x", "1. x"
+LIST_ITEM_RE = re.compile(r'^[ \t]*(?:[-*+•]|\d{1,3}[.)])[ \t]+(.*)$')
+
+SECTIONS = ('content', 'summary', 'key_points', 'references')
+
+
+class ResponseParser:
+    """
+    Single-pass parser for AI responses in the prompt's section format.
+
+    Text can be fed in arbitrary chunks as it streams in. Complete lines are
+    scanned once for section headers and the text between headers is
+    appended to the current section, so parsing is linear in the response
+    length and bold text inside a section is left alone. Text before the
+    first header belongs to the content section.
+
+    feed() and close() return ('section', {'section': name}) events when a
+    header is seen and ('delta', {'section': name, 'text': text}) events for
+    the section text that followed. result() returns the parsed sections.
+    """
+
+    def __init__(self, emit_events: bool = True):
+        self.section: Optional[str] = None
+        self._emit_events = emit_events
+        self._pending = ''
+        self._chunks: List[str] = []
+        self._parts: Dict[str, List[str]] = {name: [] for name in SECTIONS}
+
+    def feed(self, text: str) -> List[Tuple[str, Dict]]:
+        """Consume a chunk of response text and return the events it completed."""
+
+        self._chunks.append(text)
+
+        # Headers are matched a whole line at a time, so hold back a partial last line
+        end = text.rfind('\n')
+        if end == -1:
+            self._pending += text
+            return []
+
+        block = self._pending + text[:end + 1]
+        self._pending = text[end + 1:]
+        return self._block(block)
+
+    def close(self) -> List[Tuple[str, Dict]]:
+        """Flush the final line once the response is complete."""
+
+        if not self._pending:
+            return []
+
+        block, self._pending = self._pending, ''
+        return self._block(block)
+
+    def _block(self, block: str) -> List[Tuple[str, Dict]]:
+        if '\r' in block:
+            block = block.replace('\r\n', '\n')
+
+        events = []
+        position = 0
+        # Every header starts with '**', so only lines containing it are matched
+        marker = block.find('**')
+        while marker != -1:
+            line_start = block.rfind('\n', 0, marker) + 1
+            match = SECTION_HEADER_RE.match(block, line_start)
+            if match:
+                self._append(block[position:line_start], events)
+
+                self.section = match.group(1).lower().replace(' ', '_')
+                if self._emit_events:
+                    events.append(('section', {'section': self.section}))
+
+                # Keep text that follows the header on the same line
+                position = match.start(2) if match.group(2).strip() else match.end() + 1
+
+            line_end = block.find('\n', marker)
+            if line_end == -1:
+                break
+            marker = block.find('**', line_end)
+
+        self._append(block[position:], events)
+        return events
+
+    def _append(self, text: str, events: List[Tuple[str, Dict]]):
+        if text:
+            section = self.section or 'content'
+            self._parts[section].append(text)
+            if self._emit_events:
+                events.append(('delta', {'section': section, 'text': text}))
+
+    def result(self) -> Dict:
+        """Parsed sections; falls back to the raw response if there is no content."""
+
+        content = ''.join(self._parts['content']).strip()
+        if not content:
+            content = ''.join(self._chunks)
+
+        return {
+            'content': content,
+            'summary': ''.join(self._parts['summary']).strip(),
+            'key_points': self._list_items(''.join(self._parts['key_points'])),
+            'references': self._list_items(''.join(self._parts['references'])),
+        }
+
+    @staticmethod
+    def _list_items(text: str) -> List[str]:
+        items = []
+        for line in text.split('\n'):
+            if not line or line.isspace():
+                continue
+            match = LIST_ITEM_RE.match(line)
+            if match:
+                items.append(match.group(1).strip())
+            elif items and line[:1] in (' ', '\t'):
+                # Indented continuation of the previous item
+                items[-1] += ' ' + line.strip()
+        return items
+
+
+def parse_response(response: str) -> Dict:
+    """Parse a complete AI response into content, summary, key points and references."""
+
+    parser = ResponseParser(emit_events=False)
+    parser.feed(response)
+    parser.close()
+    return parser.result()
+
+
+def parse_outline(text: str) -> List[str]:
+    """
+    Section headings from an outline response.
+
+    List items are the headings if there are any, so that an introductory
+    line is ignored; otherwise every non-empty line is a heading.
+    """
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    items = [match.group(1) for match in map(LIST_ITEM_RE.match, lines) if match]
+
+    headings = []
+    for heading in items or lines:
+        heading = heading.strip().strip('*#').strip().rstrip(':').strip()
+        if heading:
+            headings.append(heading)
+    return headings
@@ -0,0 +1,177 @@
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from .models import PROMPT_VARIABLES, PromptTemplate
+
+# Only known variables are substituted; other braces are literal text
+VARIABLE_RE = re.compile(r'\{(%s)\}' % '|'.join(PROMPT_VARIABLES))
+
+
+class CompiledTemplate:
+    """A prompt template split once into literal text and variable slots."""
+
+    __slots__ = ('template_id', 'name', 'template_type', 'source', 'segments')
+
+    def __init__(self, template: PromptTemplate):
+        self.template_id = template.pk
+        self.name = template.name
+        self.template_type = template.template_type
+        self.source = template.prompt_template
+        self.segments = compile_template(template.prompt_template)
+
+    def render(self, variables: Dict) -> str:
+        """Fill in the variables; each segment is visited once."""
+
+        parts = []
+        for literal, name in self.segments:
+            parts.append(literal)
+            if name is not None:
+                parts.append(str(variables[name]))
+        return ''.join(parts)
+
+
+def compile_template(text: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Split template text into (literal, variable name or None) segments."""
+
+    segments: List[Tuple[str, Optional[str]]] = []
+    position = 0
+    for match in VARIABLE_RE.finditer(text):
+        segments.append((text[position:match.start()], match.group(1)))
+        position = match.end()
+    segments.append((text[position:], None))
+    return tuple(segments)
+
+
+class TemplateCache:
+    """
+    In-process cache of compiled prompt templates keyed by template type.
+
+    Entries are dropped when a PromptTemplate is saved or deleted in this
+    process. Other processes only see the change once their entry is older
+    than PROMPT_TEMPLATE_CACHE_TTL seconds, as do changes made with
+    queryset.update(), which sends no signals. A type with no active
+    template is cached as missing too.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Optional[CompiledTemplate], float]] = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, template_type: str) -> Optional[CompiledTemplate]:
+        """Return the active template of a type, or None if there is none."""
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(template_type)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            version = self._version
+
+        template = PromptTemplate.objects.filter(template_type=template_type, is_active=True).first()
+        compiled = CompiledTemplate(template) if template else None
+
+        with self._lock:
+            self.loads += 1
+            # Don't store a template that was invalidated while it was loading
+            if version == self._version:
+                self._entries[template_type] = (compiled, now + settings.PROMPT_TEMPLATE_CACHE_TTL)
+
+        return compiled
+
+    def invalidate(self, template_type: Optional[str] = None):
+        """Drop one template type, or everything."""
+
+        with self._lock:
+            self._version += 1
+            if template_type is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(template_type, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'cached_types': len(self._entries),
+                'hits': self.hits,
+                'loads': self.loads,
+            }
+
+
+template_cache = TemplateCache()
+
+
+def _invalidate_template(sender, instance, **kwargs):
+    # The type may have changed on save, so drop everything; templates are few.
+    # Drop again on commit in case another thread re-read the old row meanwhile.
+    template_cache.invalidate()
+    transaction.on_commit(template_cache.invalidate)
+
+
+def connect_signals():
+    """Wire cache invalidation to PromptTemplate changes. Called from AppConfig.ready()."""
+
+    post_save.connect(_invalidate_template, sender=PromptTemplate, dispatch_uid='prompt_template_cache_save')
+    post_delete.connect(_invalidate_template, sender=PromptTemplate, dispatch_uid='prompt_template_cache_delete')
+
+
+# Prompts for sectioned generation of long notes: an outline first, then each
+# section, then a summary of the assembled sections. Filled in with str.format().
+OUTLINE_PROMPT = """
+You are an expert educator planning study notes on the following topic:
+
+Topic: {topic_title}
+Description: {topic_description}
+Difficulty Level: {difficulty}
+Subject: {subject}
+
+Write an outline of exactly {sections} section headings that together cover the
+topic at {difficulty} level, in a logical order. Reply with the headings only,
+one per line, as a numbered list.
+"""
+
+SECTION_PROMPT = """
+You are an expert educator writing one section of study notes on the following topic:
+
+Topic: {topic_title}
+Description: {topic_description}
+Difficulty Level: {difficulty}
+Subject: {subject}
+
+The notes have these sections:
+{outline}
+
+Write section {number}, "{heading}", in about {section_words} words. Use clear,
+educational language appropriate for {difficulty} level, include examples where
+helpful, and don't cover material that belongs to the other sections. Reply with
+the section text only, without the section heading.
+"""
+
+SUMMARY_PROMPT = """
+Below are study notes on "{topic_title}" ({difficulty} level).
+
+{content}
+
+Based only on these notes, format your response as:
+
+**SUMMARY:**
+[A concise summary of the main points (2-3 paragraphs)]
+
+**KEY POINTS:**
+- [Key point 1]
+- [Key point 2]
+- [Key point 3]
+...
+
+**REFERENCES:**
+- [Reference 1]
+- [Reference 2]
+...
+"""
@@ -0,0 +1,301 @@
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict, Iterator, Optional, Type
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+from . import clients
+from .parsing import SECTION_HEADER_RE
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderResponse:
+    """Generated text, or one streamed chunk of it, with token usage if reported."""
+
+    __slots__ = ('text', 'prompt_tokens', 'candidates_tokens', 'total_tokens')
+
+    def __init__(self, text: str, prompt_tokens: Optional[int] = None,
+                 candidates_tokens: Optional[int] = None, total_tokens: Optional[int] = None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.candidates_tokens = candidates_tokens
+        self.total_tokens = total_tokens
+
+    @property
+    def has_usage(self) -> bool:
+        return self.total_tokens is not None
+
+
+class BaseProvider:
+    """
+    Interface between AIService and an LLM backend.
+
+    Transient failures should raise one of throttling.RETRYABLE_ERRORS so
+    that retries and the circuit breaker treat every backend alike.
+    """
+
+    name = ''
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or self.default_model_name()
+
+    @classmethod
+    def default_model_name(cls) -> str:
+        raise NotImplementedError
+
+    def generate(self, prompt: str) -> ProviderResponse:
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> Iterator[ProviderResponse]:
+        """
+        Start a streaming generation and return an iterator of chunks.
+
+        The request must be sent before this returns, so that errors in
+        starting the stream surface here rather than on first iteration.
+        """
+        raise NotImplementedError
+
+    def probe(self):
+        """Send a cheap request to check the backend is reachable; raise on failure."""
+        raise NotImplementedError
+
+    def warm_up(self) -> bool:
+        """Prepare clients ahead of the first request."""
+        return True
+
+
+class GeminiProvider(BaseProvider):
+    """Google Gemini through google-generativeai, using the shared client registry."""
+
+    name = 'gemini'
+
+    def __init__(self, model_name: Optional[str] = None):
+        super().__init__(model_name)
+        self.api_key = settings.GEMINI_API_KEY
+
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY is not configured")
+
+        # Reuse the process-wide Gemini client
+        self.model = clients.get_model(self.model_name, self.api_key)
+
+    @classmethod
+    def default_model_name(cls) -> str:
+        return settings.GEMINI_MODEL
+
+    def generate(self, prompt: str) -> ProviderResponse:
+        return self._wrap(self.model.generate_content(prompt))
+
+    def stream(self, prompt: str) -> Iterator[ProviderResponse]:
+        response = self.model.generate_content(prompt, stream=True)
+        return (self._wrap(chunk) for chunk in response)
+
+    def probe(self):
+        self.model.count_tokens("Hello")
+
+    def warm_up(self) -> bool:
+        return clients.warm_up(self.model_name, self.api_key)
+
+    @staticmethod
+    def _wrap(response) -> ProviderResponse:
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return ProviderResponse(response.text)
+
+        prompt_tokens = usage.prompt_token_count or 0
+        candidates_tokens = usage.candidates_token_count or 0
+        return ProviderResponse(
+            response.text,
+            prompt_tokens=prompt_tokens,
+            candidates_tokens=candidates_tokens,
+            total_tokens=usage.total_token_count or prompt_tokens + candidates_tokens,
+        )
+
+
+FAKE_VOCABULARY = (
+    'analysis', 'concept', 'energy', 'system', 'process', 'structure', 'function', 'model',
+    'theory', 'example', 'method', 'result', 'pattern', 'principle', 'variable', 'evidence',
+    'cycle', 'network', 'signal', 'balance', 'change', 'force', 'value', 'element',
+    'the', 'of', 'and', 'a', 'to', 'in', 'is', 'that', 'for', 'with', 'as', 'by',
+)
+
+# Shared by all FakeProvider instances so latencies and errors follow one seeded sequence
+_fake_random: Optional[random.Random] = None
+_fake_lock = threading.Lock()
+
+
+class FakeProvider(BaseProvider):
+    """
+    Local stand-in for the LLM API, for load and capacity tests.
+
+    Responses are generated from the prompt, so the same prompt always gets
+    the same text, in the section format the parser expects. Latency follows
+    AI_FAKE_LATENCY ('fixed', 'uniform' or 'lognormal') around
+    AI_FAKE_LATENCY_MEDIAN seconds, and AI_FAKE_ERROR_RATE of calls fail with
+    a retryable ServiceUnavailable error. Latencies and errors are drawn from
+    one random sequence seeded with AI_FAKE_SEED.
+    """
+
+    name = 'fake'
+
+    @classmethod
+    def default_model_name(cls) -> str:
+        return 'fake'
+
+    def generate(self, prompt: str) -> ProviderResponse:
+        latency, fail = self._draw()
+        time.sleep(latency)
+        if fail:
+            raise google_exceptions.ServiceUnavailable("Fake provider error")
+
+        text = self.response_text(prompt)
+        return self._with_usage(prompt, text)
+
+    def stream(self, prompt: str) -> Iterator[ProviderResponse]:
+        latency, fail = self._draw()
+
+        # Time to first chunk is a fifth of the total, the rest is spread over the chunks
+        time.sleep(latency * 0.2)
+        if fail:
+            raise google_exceptions.ServiceUnavailable("Fake provider error")
+
+        return self._stream_chunks(prompt, latency * 0.8)
+
+    def probe(self):
+        time.sleep(self._draw()[0] * 0.1)
+
+    def _stream_chunks(self, prompt: str, duration: float) -> Iterator[ProviderResponse]:
+        text = self.response_text(prompt)
+        lines = text.splitlines(keepends=True)
+        chunk_size = max(1, len(lines) // 20)
+        chunks = [''.join(lines[i:i + chunk_size]) for i in range(0, len(lines), chunk_size)]
+
+        for index, chunk in enumerate(chunks):
+            time.sleep(duration / len(chunks))
+            if index == len(chunks) - 1:
+                # Like Gemini, report usage with the final chunk
+                yield self._with_usage(prompt, chunk, full_text=text)
+            else:
+                yield ProviderResponse(chunk)
+
+    def _draw(self):
+        global _fake_random
+
+        with _fake_lock:
+            if _fake_random is None:
+                _fake_random = random.Random(settings.AI_FAKE_SEED)
+            rng = _fake_random
+
+            median = settings.AI_FAKE_LATENCY_MEDIAN
+            distribution = settings.AI_FAKE_LATENCY
+            if distribution == 'fixed':
+                latency = median
+            elif distribution == 'uniform':
+                latency = rng.uniform(0, 2 * median)
+            elif distribution == 'lognormal':
+                latency = median * math.exp(rng.gauss(0, settings.AI_FAKE_LATENCY_SIGMA))
+            else:
+                raise ValueError(f"Unknown AI_FAKE_LATENCY distribution: {distribution}")
+
+            fail = rng.random() < settings.AI_FAKE_ERROR_RATE
+
+        return latency, fail
+
+    def response_text(self, prompt: str) -> str:
+        """
+        The deterministic response for a prompt.
+
+        A prompt that names section headers ("**SUMMARY:**") gets those
+        sections, one asking for an outline gets a numbered list of headings
+        and one asking for section text only gets paragraphs. Anything else
+        gets a full note with all four sections.
+        """
+
+        seed = hashlib.sha256(prompt.encode('utf-8')).digest()
+        rng = random.Random(seed)
+
+        def sentence(words):
+            return ' '.join(rng.choice(FAKE_VOCABULARY) for _ in range(words)).capitalize() + '.'
+
+        content_words = max(10, settings.AI_FAKE_RESPONSE_WORDS)
+        paragraphs = []
+        while content_words > 0:
+            paragraphs.append(' '.join(sentence(12) for _ in range(5)))
+            content_words -= 60
+
+        sections = {
+            'CONTENT': ['\n\n'.join(paragraphs)],
+            'SUMMARY': [' '.join(sentence(15) for _ in range(3))],
+            'KEY POINTS': [f'- {sentence(8)}' for _ in range(5)],
+            'REFERENCES': [f'- {sentence(6)}' for _ in range(2)],
+        }
+
+        requested = []
+        for line in prompt.splitlines():
+            match = SECTION_HEADER_RE.match(line)
+            if match and match.group(1).upper() not in requested:
+                requested.append(match.group(1).upper())
+
+        if not requested:
+            lowered = prompt.lower()
+            if 'outline' in lowered:
+                return '\n'.join(f'{number}. {sentence(3)[:-1]}' for number in range(1, 7))
+            if 'section text only' in lowered:
+                return sections['CONTENT'][0]
+            requested = list(sections)
+
+        lines = []
+        for name in requested:
+            lines.extend([f'**{name}:**', *sections[name], ''])
+        return '\n'.join(lines).rstrip('\n')
+
+    @staticmethod
+    def _with_usage(prompt: str, text: str, full_text: Optional[str] = None) -> ProviderResponse:
+        # Roughly four characters per token
+        prompt_tokens = len(prompt) // 4
+        candidates_tokens = len(full_text or text) // 4
+        return ProviderResponse(
+            text,
+            prompt_tokens=prompt_tokens,
+            candidates_tokens=candidates_tokens,
+            total_tokens=prompt_tokens + candidates_tokens,
+        )
+
+
+PROVIDERS: Dict[str, Type[BaseProvider]] = {
+    GeminiProvider.name: GeminiProvider,
+    FakeProvider.name: FakeProvider,
+}
+
+
+def _provider_class() -> Type[BaseProvider]:
+    provider_class = PROVIDERS.get(settings.AI_PROVIDER)
+    if provider_class is None:
+        raise ValueError(f"Unknown AI_PROVIDER: {settings.AI_PROVIDER}")
+    return provider_class
+
+
+def get_provider(model_name: Optional[str] = None) -> BaseProvider:
+    """Return the configured provider (AI_PROVIDER) for a model."""
+
+    return _provider_class()(model_name)
+
+
+def default_model() -> str:
+    """The model the configured provider uses when none is given."""
+
+    return _provider_class().default_model_name()
+
+
+def warm_up() -> bool:
+    """Prepare the configured provider's clients; False if it cannot be used."""
+
+    try:
+        return get_provider().warm_up()
+    except ValueError as e:
+        logger.warning(f"Skipping AI provider warm-up: {str(e)}")
+        return False
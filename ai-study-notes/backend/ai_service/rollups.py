@@ -0,0 +1,202 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.db.models import Q
+from django.utils import timezone
+from .models import AIServiceLog, AIUsageRollup
+
+# Upper bounds in seconds of the latency histogram buckets; one more bucket counts anything slower
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0)
+
+GRANULARITIES = ('hour', 'day')
+
+# The log fields rollups need; backfills load only these
+LOG_FIELDS = (
+    'id', 'user_id', 'model_used', 'status', 'cache_hit', 'coalesced', 'hedge_count', 'hedge_won',
+    'fallback_from', 'response_time_seconds', 'prompt_tokens', 'candidates_tokens', 'total_tokens',
+    'estimated_cost', 'created_at',
+)
+
+COUNTERS = (
+    'requests', 'successful_requests', 'failed_requests', 'cache_hits', 'coalesced_requests',
+    'hedged_requests', 'hedges_won', 'fallback_requests', 'prompt_tokens', 'candidates_tokens', 'total_tokens',
+)
+UPDATED_FIELDS = [*COUNTERS, 'response_time_sum', 'latency_histogram', 'estimated_cost']
+
+
+def period_start(moment: datetime, granularity: str) -> datetime:
+    """Start of the UTC hour or day a moment falls in."""
+
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == 'day' else moment
+
+
+def _bucket(seconds: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _empty_totals() -> Dict:
+    totals = dict.fromkeys(COUNTERS, 0)
+    totals['response_time_sum'] = 0.0
+    totals['latency_histogram'] = [0] * (len(LATENCY_BUCKETS) + 1)
+    totals['estimated_cost'] = Decimal(0)
+    return totals
+
+
+def _add_log(totals: Dict, log: AIServiceLog):
+    totals['requests'] += 1
+    if log.status == 'success':
+        totals['successful_requests'] += 1
+        totals['response_time_sum'] += log.response_time_seconds
+        totals['latency_histogram'][_bucket(log.response_time_seconds)] += 1
+    elif log.status == 'failed':
+        totals['failed_requests'] += 1
+    totals['cache_hits'] += int(log.cache_hit)
+    totals['coalesced_requests'] += int(log.coalesced)
+    totals['hedged_requests'] += int(log.hedge_count > 0)
+    totals['hedges_won'] += int(log.hedge_won)
+    totals['fallback_requests'] += int(bool(log.fallback_from))
+    totals['prompt_tokens'] += log.prompt_tokens or 0
+    totals['candidates_tokens'] += log.candidates_tokens or 0
+    totals['total_tokens'] += log.total_tokens or 0
+    totals['estimated_cost'] += log.estimated_cost or 0
+
+
+def _merge(target: Dict, totals: Dict):
+    for field in COUNTERS:
+        target[field] += totals[field]
+    target['response_time_sum'] += totals['response_time_sum']
+    target['estimated_cost'] += totals['estimated_cost']
+    histogram = target['latency_histogram']
+    for index, count in enumerate(totals['latency_histogram']):
+        histogram[index] += count
+
+
+def aggregate(logs: Iterable[AIServiceLog]) -> Dict[Tuple, Dict]:
+    """Totals of saved logs per (user id, model, granularity, period start)."""
+
+    totals: Dict[Tuple, Dict] = {}
+    for log in logs:
+        for granularity in GRANULARITIES:
+            key = (log.user_id, log.model_used, granularity, period_start(log.created_at, granularity))
+            if key not in totals:
+                totals[key] = _empty_totals()
+            _add_log(totals[key], log)
+    return totals
+
+
+def record_usage(logs: List[AIServiceLog]):
+    """
+    Add saved logs to their hourly and daily rollups.
+
+    Call inside the transaction that saves the logs, with their rolled_up
+    flag set, so that every log is counted exactly once.
+    """
+    totals = aggregate(logs)
+    if not totals:
+        return
+
+    # Create missing rows first, so that concurrent writers update the same row
+    AIUsageRollup.objects.bulk_create([
+        AIUsageRollup(user_id=user_id, model_used=model_used, granularity=granularity, period_start=start,
+                      latency_histogram=[0] * (len(LATENCY_BUCKETS) + 1))
+        for user_id, model_used, granularity, start in totals
+    ], ignore_conflicts=True)
+
+    condition = Q()
+    for user_id, model_used, granularity, start in totals:
+        condition |= Q(user_id=user_id, model_used=model_used, granularity=granularity, period_start=start)
+
+    # Lock in id order so that writers with overlapping rows don't deadlock
+    rows = list(AIUsageRollup.objects.select_for_update().filter(condition).order_by('id'))
+    now = timezone.now()
+    for row in rows:
+        row_totals = {field: getattr(row, field) for field in UPDATED_FIELDS}
+        row_totals['latency_histogram'] = _padded(row.latency_histogram)
+        _merge(row_totals, totals[(row.user_id, row.model_used, row.granularity, row.period_start)])
+        for field, value in row_totals.items():
+            setattr(row, field, value)
+        # bulk_update() doesn't set auto_now fields
+        row.updated_at = now
+
+    AIUsageRollup.objects.bulk_update(rows, [*UPDATED_FIELDS, 'updated_at'])
+
+
+def _padded(histogram: List[int]) -> List[int]:
+    return list(histogram) + [0] * (len(LATENCY_BUCKETS) + 1 - len(histogram))
+
+
+def latency_percentile(histogram: List[int], percent: float) -> Optional[float]:
+    """Estimate a latency percentile from histogram counts, interpolating within the bucket."""
+
+    total = sum(histogram)
+    if not total:
+        return None
+
+    rank = total * percent / 100
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        if count and cumulative + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            if index == len(LATENCY_BUCKETS):
+                return lower  # Slower than the last bound; all we know is the lower limit
+            return round(lower + (LATENCY_BUCKETS[index] - lower) * (rank - cumulative) / count, 3)
+        cumulative += count
+    return None
+
+
+def usage_stats(user, days: Optional[int] = None, hours: Optional[int] = None) -> Dict:
+    """
+    AI usage statistics of a user from the rollups, in one query.
+
+    Args:
+        user: User whose usage to report
+        days: Only the last this many UTC days (including today), from the daily rollups
+        hours: Only the last this many UTC hours (including this one), from the hourly rollups
+
+    Returns:
+        Dict of request counts, mean and percentile latency, usage per model, tokens and cost
+    """
+    rows = AIUsageRollup.objects.filter(user=user)
+    if hours:
+        since = period_start(timezone.now(), 'hour') - timedelta(hours=hours - 1)
+        rows = rows.filter(granularity='hour', period_start__gte=since)
+    else:
+        rows = rows.filter(granularity='day')
+        if days:
+            rows = rows.filter(period_start__gte=period_start(timezone.now(), 'day') - timedelta(days=days - 1))
+
+    totals = _empty_totals()
+    model_usage: Dict[str, int] = {}
+    for row in rows.values('model_used', 'latency_histogram', *COUNTERS, 'response_time_sum', 'estimated_cost'):
+        row['latency_histogram'] = _padded(row['latency_histogram'])
+        _merge(totals, row)
+        model_usage[row['model_used']] = model_usage.get(row['model_used'], 0) + row['requests']
+
+    histogram = totals['latency_histogram']
+    successful = totals['successful_requests']
+
+    return {
+        'total_requests': totals['requests'],
+        'successful_requests': successful,
+        'failed_requests': totals['failed_requests'],
+        'cache_hits': totals['cache_hits'],
+        'coalesced_requests': totals['coalesced_requests'],
+        'hedged_requests': totals['hedged_requests'],
+        'hedges_won': totals['hedges_won'],
+        'fallback_requests': totals['fallback_requests'],
+        'average_response_time': totals['response_time_sum'] / successful if successful else 0,
+        'response_time_percentiles': {
+            'p50': latency_percentile(histogram, 50),
+            'p95': latency_percentile(histogram, 95),
+            'p99': latency_percentile(histogram, 99),
+        },
+        'model_usage': model_usage,
+        'total_tokens_used': totals['total_tokens'],
+        'prompt_tokens_used': totals['prompt_tokens'],
+        'candidates_tokens_used': totals['candidates_tokens'],
+        'estimated_cost': totals['estimated_cost'],
+    }
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import AIServiceLog, PromptTemplate
+from .models import AIServiceLog, PromptTemplate, GenerationJob
 
 
 class AIServiceLogSerializer(serializers.ModelSerializer):
@@ -7,12 +7,17 @@ class AIServiceLogSerializer(serializers.ModelSerializer):
     
     topic_title = serializers.CharField(source='topic.title', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
+    # Stored as a prompt blob plus variables and a compressed response
+    prompt = serializers.CharField(source='prompt_text', read_only=True)
+    response = serializers.CharField(source='response_text', read_only=True)
     
     class Meta:
         model = AIServiceLog
         fields = ['id', 'user', 'user_email', 'topic', 'topic_title', 'prompt', 
-                 'response', 'status', 'model_used', 'response_time_seconds', 
-                 'error_message', 'created_at']
+                 'response', 'status', 'model_used', 'fallback_from', 'response_time_seconds', 
+                 'error_message', 'cache_hit', 'coalesced', 'hedge_count', 'hedge_won', 
+                 'template', 'max_word_count', 'prompt_tokens', 'candidates_tokens', 
+                 'total_tokens', 'estimated_cost', 'created_at']
         read_only_fields = ['id', 'user', 'user_email', 'topic_title', 'created_at']
 
 
@@ -23,4 +28,17 @@ class PromptTemplateSerializer(serializers.ModelSerializer):
         model = PromptTemplate
         fields = ['id', 'name', 'template_type', 'prompt_template', 
                  'description', 'is_active', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at'] 
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    """Serializer for GenerationJob model."""
+    
+    topic_title = serializers.CharField(source='topic.title', read_only=True)
+    
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'topic', 'topic_title', 'kind', 'status', 'note', 
+                 'error_message', 'attempts', 'created_at', 'started_at', 
+                 'finished_at', 'updated_at']
+        read_only_fields = fields
@@ -1,73 +1,480 @@
+import math
+import os
+import socket
+import threading
 import time
 import logging
-from typing import Dict, List, Optional
-import google.generativeai as genai
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Avg, Count, ExpressionWrapper, F, FloatField, Q
 from django.utils import timezone
-from .models import AIServiceLog, PromptTemplate
+from .cache import response_cache
+from .health import health_monitor
+from .log_storage import compress_text, pack_prompt
+from .log_writer import log_writer
+from .models import AIServiceLog, PromptTemplate, GenerationLease
+from .parsing import ResponseParser, parse_outline, parse_response
+from .prompts import OUTLINE_PROMPT, SECTION_PROMPT, SUMMARY_PROMPT, CompiledTemplate, template_cache
+from .providers import ProviderResponse, default_model, get_provider
+from .throttling import (
+    CircuitOpenError, RateLimitExceeded, backoff_delay, circuit_breaker,
+    is_retryable_error, rate_limiter
+)
+from core.metrics import submit, timing
 from notes.models import StudyTopic, StudyNote, UserPreference
 
 logger = logging.getLogger(__name__)
 
 
-class AIService:
-    """Service class for handling AI operations with Gemini API."""
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution.
+    
+    The first caller for a key runs the function; callers that arrive while
+    it is in flight wait on the same future and receive the same result or
+    exception.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run func once per in-flight key. Returns (result, shared)."""
+        
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = func()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+generation_flight = SingleFlight()
+
+LEASE_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def acquire_generation_lease(key: str) -> bool:
+    """Try to become the only process generating a response for a prompt key."""
+    
+    now = timezone.now()
+    GenerationLease.objects.filter(key=key, expires_at__lte=now).delete()
+    
+    try:
+        with transaction.atomic():
+            GenerationLease.objects.create(
+                key=key,
+                owner=LEASE_OWNER,
+                expires_at=now + timedelta(seconds=settings.AI_COALESCE_LEASE_SECONDS)
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+def release_generation_lease(key: str):
+    GenerationLease.objects.filter(key=key, owner=LEASE_OWNER).delete()
+
+
+def token_usage(response: ProviderResponse) -> Dict:
+    """
+    Token counts reported with a provider response, with an estimated cost.
+    
+    Returns an empty dict when the response carries no usage.
+    """
+    if not response.has_usage:
+        return {}
+    
+    return {
+        'prompt_tokens': response.prompt_tokens,
+        'candidates_tokens': response.candidates_tokens,
+        'total_tokens': response.total_tokens,
+        'estimated_cost': estimate_cost(response.prompt_tokens, response.candidates_tokens),
+    }
+
+
+def merge_call_info(infos: List[Dict]) -> Dict:
+    """
+    Combine the log details of several API calls made for one request.
+    
+    Token counts, costs and hedges are summed; fallback_from is the first
+    fallback seen.
+    """
+    merged = {}
+    for info in infos:
+        for key in ('prompt_tokens', 'candidates_tokens', 'total_tokens', 'estimated_cost', 'hedge_count'):
+            if info.get(key) is not None:
+                merged[key] = merged.get(key, 0) + info[key]
+        if info.get('hedge_won'):
+            merged['hedge_won'] = True
+        if info.get('fallback_from') and not merged.get('fallback_from'):
+            merged['fallback_from'] = info['fallback_from']
+    return merged
+
+
+def estimate_cost(prompt_tokens: int, candidates_tokens: int) -> Decimal:
+    """Estimated cost in USD from the AI_PRICE_PER_MILLION_* settings."""
+    
+    cost = (
+        prompt_tokens * Decimal(str(settings.AI_PRICE_PER_MILLION_INPUT_TOKENS)) +
+        candidates_tokens * Decimal(str(settings.AI_PRICE_PER_MILLION_OUTPUT_TOKENS))
+    ) / 1000000
+    return cost.quantize(Decimal('0.000001'))
+
+
+class HedgePolicy:
+    """
+    Decide when to hedge a slow API call and enforce the hedge budget.
+    
+    The hedge delay is the AI_HEDGE_DELAY_PERCENTILE of recent successful
+    call latencies. Hedges are limited to AI_HEDGE_MAX_RATIO of the primary
+    calls made in the last minute; the ratio is capped at 1.0 so hedging can
+    at most double the load on the API.
+    """
+    
+    WINDOW_SECONDS = 60
+    MIN_SAMPLES = 20
     
     def __init__(self):
-        self.api_key = settings.GEMINI_API_KEY
-        self.model_name = settings.GEMINI_MODEL
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._primaries = deque()
+        self._hedges = deque()
+        self.hedges_sent = 0
+        self.hedges_won = 0
+    
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def delay(self) -> float:
+        """Seconds to wait on the primary call before hedging."""
+        
+        with self._lock:
+            samples = sorted(self._latencies)
         
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY is not configured")
+        if len(samples) < self.MIN_SAMPLES:
+            return settings.AI_HEDGE_INITIAL_DELAY
         
-        # Configure Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(self.model_name)
+        index = min(len(samples) - 1, int(len(samples) * settings.AI_HEDGE_DELAY_PERCENTILE / 100))
+        return max(settings.AI_HEDGE_MIN_DELAY, samples[index])
+    
+    def _prune(self, now: float):
+        # Caller holds the lock
+        for calls in (self._primaries, self._hedges):
+            while calls and calls[0] < now - self.WINDOW_SECONDS:
+                calls.popleft()
+    
+    def record_primary(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._primaries.append(now)
+    
+    def try_acquire_hedge(self) -> bool:
+        """Reserve budget for one hedge, if the recent hedge ratio allows it."""
+        
+        ratio = min(1.0, settings.AI_HEDGE_MAX_RATIO)
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._hedges) + 1 > ratio * len(self._primaries):
+                return False
+            self._hedges.append(now)
+            self.hedges_sent += 1
+            return True
+    
+    def record_outcome(self, hedge_won: bool):
+        if hedge_won:
+            with self._lock:
+                self.hedges_won += 1
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': settings.AI_HEDGING_ENABLED,
+                'hedges_sent': self.hedges_sent,
+                'hedges_won': self.hedges_won,
+                'win_rate': self.hedges_won / self.hedges_sent if self.hedges_sent else 0.0,
+            }
+
+
+hedge_policy = HedgePolicy()
+hedge_executor = ThreadPoolExecutor(max_workers=settings.AI_HEDGE_POOL_SIZE, thread_name_prefix='ai-hedge')
+
+
+class Route:
+    """The models to try for one request, in order, and its deadline."""
+    
+    __slots__ = ('models', 'estimates', 'deadline')
+    
+    def __init__(self, models: List[str], estimates: Dict[str, float], deadline: float):
+        self.models = models
+        self.estimates = estimates
+        self.deadline = deadline
+    
+    @property
+    def model(self) -> str:
+        return self.models[0]
     
-    def generate_study_notes(self, topic: StudyTopic, user_preferences: Optional[UserPreference] = None) -> Dict:
+    def attempt_timeout(self, index: int) -> Optional[float]:
+        """
+        Seconds the model at index may take before falling back to the next.
+        
+        The attempt must leave enough of the deadline for the next model's
+        estimated latency (half the remaining time if it has none). If the
+        next model could not finish in time either, this one gets all of the
+        remaining time. The last model gets None: it runs to completion.
+        """
+        if index >= len(self.models) - 1:
+            return None
+        
+        remaining = self.deadline - time.monotonic()
+        reserve = self.estimates.get(self.models[index + 1])
+        if reserve is None:
+            return remaining / 2
+        
+        timeout = remaining - reserve * settings.AI_ROUTER_FALLBACK_MARGIN
+        return timeout if timeout > 0 else remaining
+
+
+class ModelRouter:
+    """
+    Choose a model from AI_MODEL_POOL for each request.
+    
+    Latency and error rate per model come from the AIServiceLog rows of the
+    last AI_ROUTER_WINDOW_MINUTES, re-read at most every AI_ROUTER_STATS_TTL
+    seconds. Latency is kept per requested word, so the estimate for a
+    request scales with its max_word_count. A fallback counts as a failure of
+    the model that was tried first.
+    
+    Models are preferred in pool order. A request goes to the first healthy
+    model whose estimate fits the deadline; short beginner notes go to the
+    fastest healthy model. The remaining models follow as fallbacks, fastest
+    first, with unhealthy ones last.
+    """
+    
+    MIN_SAMPLES = 5
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+        self._expires = 0.0
+    
+    def pool(self) -> List[str]:
+        return [model.strip() for model in settings.AI_MODEL_POOL if model.strip()] or [default_model()]
+    
+    def route(self, topic: StudyTopic, max_words: int, deadline: Optional[float] = None) -> Route:
+        """
+        Order the pool for a request.
+        
+        Args:
+            topic: StudyTopic being generated
+            max_words: Target note length in words
+            deadline: Seconds the request may take (AI_GENERATION_DEADLINE_SECONDS by default)
+        
+        Returns:
+            Route with the models to try in order
+        """
+        deadline = deadline or settings.AI_GENERATION_DEADLINE_SECONDS
+        deadline_at = time.monotonic() + deadline
+        pool = self.pool()
+        if len(pool) == 1:
+            return Route(pool, {}, deadline_at)
+        
+        stats = self.model_stats()
+        estimates = {
+            model: stats[model]['seconds_per_word'] * max_words
+            for model in pool
+            if model in stats and stats[model]['seconds_per_word'] is not None
+        }
+        # A model needs a few calls in the window before it can be judged unhealthy
+        healthy = [
+            model for model in pool
+            if model not in stats or stats[model]['calls'] < self.MIN_SAMPLES
+            or stats[model]['error_rate'] <= settings.AI_ROUTER_MAX_ERROR_RATE
+        ] or pool
+        # Stable sort: models without an estimate keep their pool order after the measured ones
+        by_speed = sorted(healthy, key=lambda model: estimates.get(model, float('inf')))
+        
+        if topic.difficulty == 'beginner' and max_words <= settings.AI_ROUTER_SMALL_REQUEST_WORDS:
+            choice = by_speed[0]
+        else:
+            choice = next((model for model in healthy if estimates.get(model, 0) <= deadline), by_speed[0])
+        
+        models = [choice] + [model for model in by_speed if model != choice]
+        models += [model for model in pool if model not in healthy]
+        return Route(models, estimates, deadline_at)
+    
+    def model_stats(self) -> Dict[str, Dict]:
+        """Calls, error rate and seconds per requested word for each model in the pool."""
+        
+        now = time.monotonic()
+        with self._lock:
+            if now < self._expires:
+                return self._stats
+        
+        stats = self._load(self.pool())
+        
+        with self._lock:
+            self._stats = stats
+            self._expires = now + settings.AI_ROUTER_STATS_TTL
+        return stats
+    
+    def _load(self, pool: List[str]) -> Dict[str, Dict]:
+        since = timezone.now() - timedelta(minutes=settings.AI_ROUTER_WINDOW_MINUTES)
+        # Cache hits and coalesced requests never reached the model
+        logs = AIServiceLog.objects.filter(created_at__gte=since, cache_hit=False, coalesced=False)
+        
+        rows = logs.filter(model_used__in=pool).values('model_used').annotate(
+            calls=Count('id'),
+            failures=Count('id', filter=Q(status='failed')),
+            timed=Count('id', filter=Q(status='success', max_word_count__gt=0)),
+            seconds_per_word=Avg(
+                ExpressionWrapper(F('response_time_seconds') / F('max_word_count'), output_field=FloatField()),
+                filter=Q(status='success', max_word_count__gt=0),
+            ),
+        )
+        fallbacks = dict(
+            logs.filter(fallback_from__in=pool).values('fallback_from')
+            .annotate(count=Count('id')).values_list('fallback_from', 'count')
+        )
+        
+        stats = {}
+        for row in rows:
+            model = row['model_used']
+            calls = row['calls'] + fallbacks.pop(model, 0)
+            failures = row['failures'] + calls - row['calls']
+            stats[model] = {
+                'calls': calls,
+                'error_rate': failures / calls,
+                'seconds_per_word': row['seconds_per_word'] if row['timed'] >= self.MIN_SAMPLES else None,
+            }
+        for model, count in fallbacks.items():
+            stats[model] = {'calls': count, 'error_rate': 1.0, 'seconds_per_word': None}
+        return stats
+    
+    def get_stats(self) -> Dict:
+        """Pool and the last loaded model stats, without querying the logs."""
+        
+        with self._lock:
+            return {'pool': self.pool(), 'models': self._stats}
+
+
+model_router = ModelRouter()
+route_executor = ThreadPoolExecutor(max_workers=settings.AI_ROUTER_POOL_SIZE, thread_name_prefix='ai-route')
+section_executor = ThreadPoolExecutor(max_workers=settings.AI_SECTION_POOL_SIZE, thread_name_prefix='ai-section')
+
+
+class AIService:
+    """Service class for handling AI operations with the configured LLM provider (Gemini by default)."""
+    
+    def __init__(self):
+        self.provider = get_provider()
+        self.model_name = self.provider.model_name
+        self._providers = {self.model_name: self.provider}
+    
+    def generate_study_notes(self, topic: StudyTopic, user_preferences: Optional[UserPreference] = None,
+                             use_cache: bool = True, deadline: Optional[float] = None) -> Dict:
         """
         Generate study notes for a given topic using Gemini API.
         
         Args:
             topic: StudyTopic instance
             user_preferences: Optional UserPreference instance
+            use_cache: Serve an identical earlier prompt from the response cache
+            deadline: Seconds the request may take before falling back to a faster model
             
         Returns:
             Dict containing generated content, summary, key points, and metadata
         """
         start_time = time.time()
+        prompt = ""
+        template = None
+        route = None
         
         try:
             # Get or create prompt template
-            template = self._get_prompt_template(user_preferences)
+            with timing('template'):
+                template = self._get_prompt_template(user_preferences)
             
             # Build the prompt
-            prompt = self._build_prompt(topic, template, user_preferences)
+            with timing('prompt'):
+                prompt = self._build_prompt(topic, template, user_preferences)
+            
+            # Pick the model from the pool
+            max_words = self._max_words(user_preferences)
+            with timing('route'):
+                route = model_router.route(topic, max_words, deadline)
+            
+            if settings.AI_SECTIONED_MIN_WORDS and max_words >= settings.AI_SECTIONED_MIN_WORDS:
+                # Long notes: outline first, then the sections in parallel
+                fetch = lambda: self._generate_sectioned(topic, user_preferences, prompt, route)
+            else:
+                fetch = lambda: self._call_gemini_api(prompt, topic.user_id, route)
             
-            # Generate response from Gemini
-            response = self._call_gemini_api(prompt)
+            # Serve identical prompts from the cache, otherwise call Gemini
+            cache_key = response_cache.make_key(prompt, route.model)
+            with timing('cache'):
+                response = response_cache.get(cache_key) if use_cache else None
+            cache_hit = response is not None
             
-            # Parse the response
-            parsed_response = self._parse_response(response)
+            coalesced = False
+            call_info = {}
+            
+            if cache_hit:
+                parsed_response = self._parse_response(response)
+            elif use_cache:
+                # Share one in-flight call between identical concurrent requests
+                (response, parsed_response, remote, call_info), shared = generation_flight.do(
+                    cache_key, lambda: self._fetch_coalesced(cache_key, route.model, fetch)
+                )
+                coalesced = shared or remote
+                if coalesced:
+                    # Token usage is logged by the request that made the call
+                    call_info = {'model_used': call_info.get('model_used', route.model)}
+            else:
+                response, call_info = fetch()
+                response_cache.set(cache_key, route.model, response)
+                parsed_response = self._parse_response(response)
+            
+            call_info.setdefault('model_used', route.model)
             
             # Calculate metrics
             response_time = time.time() - start_time
-            word_count = len(parsed_response['content'].split())
-            reading_time = max(1, word_count // 200)  # Average reading speed: 200 words/minute
             
             # Log the API call
-            self._log_api_call(topic, prompt, response, response_time, 'success')
+            with timing('log'):
+                self._log_api_call(topic, prompt, response, response_time, 'success',
+                                   cache_hit=cache_hit, coalesced=coalesced, template=template,
+                                   user_preferences=user_preferences, **call_info)
             
-            return {
-                'content': parsed_response['content'],
-                'summary': parsed_response['summary'],
-                'key_points': parsed_response['key_points'],
-                'references': parsed_response['references'],
-                'word_count': word_count,
-                'reading_time_minutes': reading_time,
-                'generation_time_seconds': response_time,
-                'ai_model_used': self.model_name,
-            }
+            return self._build_result(parsed_response, response_time, call_info['model_used'])
             
         except Exception as e:
             response_time = time.time() - start_time
@@ -75,36 +482,160 @@ class AIService:
             logger.error(f"Error generating study notes: {error_message}")
             
             # Log the failed API call
-            self._log_api_call(topic, prompt, "", response_time, 'failed', error_message)
+            self._log_api_call(topic, prompt, "", response_time, 'failed', error_message,
+                               template=template, user_preferences=user_preferences,
+                               model_used=route.model if route else None)
+            
+            raise
+    
+    def stream_study_notes(self, topic: StudyTopic, user_preferences: Optional[UserPreference] = None,
+                           use_cache: bool = True, deadline: Optional[float] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Generate study notes for a topic using Gemini's streaming mode.
+        
+        Yields ('section', {'section': name}) when a new section header arrives and
+        ('delta', {'section': name, 'text': text}) for each run of section text,
+        followed by a final ('result', result) with the same shape as
+        generate_study_notes.
+        
+        Args:
+            topic: StudyTopic instance
+            user_preferences: Optional UserPreference instance
+            use_cache: Replay an identical earlier prompt from the response cache
+            deadline: Seconds the request may take, used to pick the model
+        """
+        start_time = time.time()
+        prompt = ""
+        template = None
+        chunks = []
+        call_info = {}
+        
+        try:
+            with timing('template'):
+                template = self._get_prompt_template(user_preferences)
+            with timing('prompt'):
+                prompt = self._build_prompt(topic, template, user_preferences)
+            with timing('route'):
+                route = model_router.route(topic, self._max_words(user_preferences), deadline)
+            call_info['model_used'] = route.model
+            
+            cache_key = response_cache.make_key(prompt, route.model)
+            cached = response_cache.get(cache_key) if use_cache else None
+            cache_hit = cached is not None
+            
+            parser = ResponseParser()
+            for text in ([cached] if cache_hit else self._stream_gemini_api(prompt, topic.user_id, call_info, route)):
+                chunks.append(text)
+                yield from parser.feed(text)
+            yield from parser.close()
+            
+            response = ''.join(chunks)
+            if not cache_hit:
+                response_cache.set(cache_key, route.model, response)
+            
+            parsed_response = parser.result()
+            response_time = time.time() - start_time
+            
+            with timing('log'):
+                self._log_api_call(topic, prompt, response, response_time, 'success', cache_hit=cache_hit,
+                                   template=template, user_preferences=user_preferences, **call_info)
+            
+            yield 'result', self._build_result(parsed_response, response_time, call_info['model_used'])
+            
+        except Exception as e:
+            response_time = time.time() - start_time
+            error_message = str(e)
+            logger.error(f"Error streaming study notes: {error_message}")
+            
+            self._log_api_call(topic, prompt, ''.join(chunks), response_time, 'failed', error_message,
+                               template=template, user_preferences=user_preferences, **call_info)
             
             raise
     
-    def _get_prompt_template(self, user_preferences: Optional[UserPreference]) -> PromptTemplate:
+    def _fetch_coalesced(self, cache_key: str, model: str,
+                         fetch: Callable[[], Tuple[str, Dict]]) -> Tuple[str, Dict, bool, Dict]:
+        """
+        Call Gemini for a prompt unless another process is already doing so.
+        
+        The process holding the lease makes the call and publishes the response
+        through the response cache; other processes poll the cache until it
+        appears. If the holder fails or the wait times out, the caller takes
+        over the call itself. A response from a fallback model is cached under
+        the routed model's key so that waiting processes find it.
+        
+        Args:
+            cache_key: Response cache key of the prompt
+            model: Routed model the response is cached under
+            fetch: Makes the call, returning (response text, call details)
+        
+        Returns:
+            Tuple of (raw response, parsed response, served by another process,
+            call details for the log)
+        """
+        if not response_cache.enabled:
+            response, call_info = fetch()
+            return response, self._parse_response(response), False, call_info
+        
+        deadline = time.monotonic() + settings.AI_COALESCE_WAIT_SECONDS
+        
+        while True:
+            if acquire_generation_lease(cache_key):
+                try:
+                    response, call_info = fetch()
+                    response_cache.set(cache_key, model, response)
+                    return response, self._parse_response(response), False, call_info
+                finally:
+                    release_generation_lease(cache_key)
+            
+            time.sleep(settings.AI_COALESCE_POLL_INTERVAL)
+            
+            response = response_cache.get(cache_key, count_miss=False)
+            if response is not None:
+                return response, self._parse_response(response), True, {}
+            
+            if time.monotonic() > deadline:
+                logger.warning("Timed out waiting for a coalesced generation, calling Gemini directly")
+                response, call_info = fetch()
+                response_cache.set(cache_key, model, response)
+                return response, self._parse_response(response), False, call_info
+    
+    def _build_result(self, parsed_response: Dict, response_time: float, model_used: str) -> Dict:
+        """Combine parsed sections with generation metrics."""
+        
+        word_count = len(parsed_response['content'].split())
+        reading_time = max(1, word_count // 200)  # Average reading speed: 200 words/minute
+        
+        return {
+            'content': parsed_response['content'],
+            'summary': parsed_response['summary'],
+            'key_points': parsed_response['key_points'],
+            'references': parsed_response['references'],
+            'word_count': word_count,
+            'reading_time_minutes': reading_time,
+            'generation_time_seconds': response_time,
+            'ai_model_used': model_used,
+        }
+    
+    def _get_prompt_template(self, user_preferences: Optional[UserPreference]) -> CompiledTemplate:
         """Get the appropriate prompt template based on user preferences."""
         
         if user_preferences and user_preferences.preferred_style:
-            template = PromptTemplate.objects.filter(
-                template_type=user_preferences.preferred_style,
-                is_active=True
-            ).first()
+            template = template_cache.get(user_preferences.preferred_style)
             
             if template:
                 return template
         
         # Default to academic template
-        template = PromptTemplate.objects.filter(
-            template_type='academic',
-            is_active=True
-        ).first()
+        template = template_cache.get('academic')
         
         if not template:
             # Create a default template if none exists
-            template = PromptTemplate.objects.create(
+            template = CompiledTemplate(PromptTemplate.objects.create(
                 name='Default Academic Template',
                 template_type='academic',
                 prompt_template=self._get_default_template(),
                 description='Default academic study notes template'
-            )
+            ))
         
         return template
     
@@ -152,140 +683,421 @@ class AIService:
         ...
         """
     
-    def _build_prompt(self, topic: StudyTopic, template: PromptTemplate, user_preferences: Optional[UserPreference]) -> str:
-        """Build the prompt using the template and topic information."""
+    def _max_words(self, user_preferences: Optional[UserPreference]) -> int:
+        """Target note length in words."""
         
-        max_words = 1000
         if user_preferences:
-            max_words = user_preferences.max_word_count
+            return user_preferences.max_word_count
+        return 1000
+    
+    def _build_prompt(self, topic: StudyTopic, template: CompiledTemplate, user_preferences: Optional[UserPreference]) -> str:
+        """Build the prompt using the template and topic information."""
         
-        prompt_vars = {
+        return template.render(self._prompt_variables(topic, user_preferences))
+    
+    def _prompt_variables(self, topic: StudyTopic, user_preferences: Optional[UserPreference]) -> Dict:
+        """Values for the prompt template variables."""
+        
+        return {
             'topic_title': topic.title,
             'topic_description': topic.description,
             'difficulty': topic.difficulty,
             'subject': topic.subject.name if topic.subject else 'General',
-            'max_words': max_words,
+            'max_words': self._max_words(user_preferences),
         }
+    
+    def _generate_sectioned(self, topic: StudyTopic, user_preferences: Optional[UserPreference],
+                            prompt: str, route: Route) -> Tuple[str, Dict]:
+        """
+        Generate long notes as an outline followed by sections written in parallel.
+        
+        The outline call asks for the section headings, then each section is
+        generated on the section pool with at most AI_SECTION_CONCURRENCY in
+        flight, and a last call writes the summary, key points and references
+        from the assembled content. If the outline cannot be parsed, the
+        single-call prompt is used instead.
+        
+        Returns:
+            Tuple of (response in the single-call section format, call details for the log)
+        """
+        prompt_vars = self._prompt_variables(topic, user_preferences)
+        sections = min(settings.AI_SECTION_MAX_SECTIONS,
+                       max(2, math.ceil(prompt_vars['max_words'] / settings.AI_SECTION_WORDS)))
         
-        # Simple template variable substitution
-        prompt = template.prompt_template
-        for key, value in prompt_vars.items():
-            prompt = prompt.replace(f'{{{key}}}', str(value))
+        outline, outline_info = self._call_gemini_api(
+            OUTLINE_PROMPT.format(sections=sections, **prompt_vars), topic.user_id, route
+        )
+        headings = parse_outline(outline)[:sections]
+        if len(headings) < 2:
+            logger.warning("Could not parse a note outline, generating the notes in one call")
+            return self._call_gemini_api(prompt, topic.user_id, route)
+        
+        # Sections are short, so they are routed by their own length
+        section_words = prompt_vars['max_words'] // len(headings)
+        section_route = model_router.route(topic, section_words, max(1.0, route.deadline - time.monotonic()))
+        outline_text = '\n'.join(f'{number}. {heading}' for number, heading in enumerate(headings, 1))
+        section_prompts = [
+            SECTION_PROMPT.format(outline=outline_text, number=number, heading=heading,
+                                  section_words=section_words, **prompt_vars)
+            for number, heading in enumerate(headings, 1)
+        ]
+        section_results = self._generate_sections(section_prompts, topic.user_id, section_route)
+        
+        content = '\n\n'.join(
+            f'## {heading}\n\n{text.strip()}' for heading, (text, _) in zip(headings, section_results)
+        )
+        summary, summary_info = self._call_gemini_api(
+            SUMMARY_PROMPT.format(content=content, **prompt_vars), topic.user_id, route
+        )
+        
+        call_info = merge_call_info([outline_info, *(info for _, info in section_results), summary_info])
+        # The content comes from the sections, so report their model
+        call_info['model_used'] = section_results[0][1].get('model_used', route.model)
+        return f'**CONTENT:**\n{content}\n\n{summary.strip()}', call_info
+    
+    def _generate_sections(self, prompts: List[str], user_id: Optional[int], route: Route) -> List[Tuple[str, Dict]]:
+        """Run the section calls on the section pool, keeping the prompts' order."""
+        
+        results: List[Optional[Tuple[str, Dict]]] = [None] * len(prompts)
+        waiting = list(enumerate(prompts))
+        pending: Dict[Future, int] = {}
+        
+        try:
+            while waiting or pending:
+                while waiting and len(pending) < max(1, settings.AI_SECTION_CONCURRENCY):
+                    index, prompt = waiting.pop(0)
+                    future = submit(section_executor, self._thread_call_gemini_api, prompt, user_id, route)
+                    pending[future] = index
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # A failed section fails the note
+                    results[pending.pop(future)] = future.result()
+        finally:
+            for future in pending:
+                future.cancel()
         
-        return prompt
+        return results
     
-    def _call_gemini_api(self, prompt: str) -> str:
-        """Call the Gemini API with the given prompt."""
+    def _thread_call_gemini_api(self, prompt: str, user_id: Optional[int], route: Route) -> Tuple[str, Dict]:
+        """Call the API on a section pool thread."""
         
         try:
-            response = self.model.generate_content(prompt)
+            return self._call_gemini_api(prompt, user_id, route)
+        finally:
+            # Pool threads outlive requests, so don't keep their DB connection
+            connection.close()
+    
+    def _call_gemini_api(self, prompt: str, user_id: Optional[int] = None,
+                         route: Optional[Route] = None) -> Tuple[str, Dict]:
+        """
+        Call the Gemini API with the given prompt, falling back along the route.
+        
+        Each model but the last runs on a route pool thread and is abandoned
+        if it fails or does not answer in time to leave room for the next one.
+        Rate limit and circuit breaker errors are not model specific, so they
+        are raised without falling back.
+        
+        Returns:
+            Tuple of (response text, call details for the log)
+        """
+        route = route or self._default_route()
+        fallback_from = ''
+        error = None
+        
+        for index, model in enumerate(route.models):
+            timeout = route.attempt_timeout(index)
+            if timeout is not None and timeout <= 0:
+                # The deadline has passed; go straight to the last model
+                continue
+            
+            try:
+                if timeout is None:
+                    response, call_info = self._call_model(model, prompt, user_id)
+                else:
+                    future = submit(route_executor, self._thread_call_model, model, prompt, user_id)
+                    response, call_info = future.result(timeout=timeout)
+            except (RateLimitExceeded, CircuitOpenError):
+                raise
+            except FuturesTimeoutError:
+                error = Exception(f"{model} did not answer within {timeout:.1f}s")
+                logger.warning(f"{str(error)}, falling back")
+            except Exception as e:
+                error = e
+                logger.error(f"Gemini API error from {model}: {str(e)}")
+            else:
+                call_info.update(token_usage(response), model_used=model, fallback_from=fallback_from)
+                return response.text, call_info
+            
+            fallback_from = fallback_from or model
+        
+        raise Exception(f"Failed to generate content: {str(error)}")
+    
+    def _call_model(self, model: str, prompt: str, user_id: Optional[int]) -> Tuple[ProviderResponse, Dict]:
+        """Call one model, hedging if enabled. Returns (response, call details for the log)."""
+        
+        provider = self._provider_for(model)
+        
+        def generate():
+            response = provider.generate(prompt)
             
             if response.text:
-                return response.text
+                return response
             else:
                 raise Exception("Empty response from Gemini API")
-                
-        except Exception as e:
-            logger.error(f"Gemini API error: {str(e)}")
-            raise Exception(f"Failed to generate content: {str(e)}")
+        
+        with timing('llm'):
+            if settings.AI_HEDGING_ENABLED:
+                return self._hedged_call(generate, user_id)
+            
+            start_time = time.monotonic()
+            response = self._guarded_call(generate, user_id, block=True)
+            hedge_policy.record_latency(time.monotonic() - start_time)
+            return response, {}
     
-    def _parse_response(self, response: str) -> Dict:
-        """Parse the AI response into structured components."""
+    def _thread_call_model(self, model: str, prompt: str, user_id: Optional[int]) -> Tuple[ProviderResponse, Dict]:
+        """Call one model on a route pool thread."""
         
         try:
-            # Simple parsing based on section headers
-            sections = response.split('**')
+            return self._call_model(model, prompt, user_id)
+        finally:
+            # Pool threads outlive requests, so don't keep their DB connection
+            connection.close()
+    
+    def _provider_for(self, model: str):
+        if model not in self._providers:
+            self._providers[model] = get_provider(model)
+        return self._providers[model]
+    
+    def _default_route(self) -> Route:
+        return Route([self.model_name], {}, time.monotonic() + settings.AI_GENERATION_DEADLINE_SECONDS)
+    
+    def _stream_gemini_api(self, prompt: str, user_id: Optional[int] = None,
+                           call_info: Optional[Dict] = None, route: Optional[Route] = None) -> Iterator[str]:
+        """
+        Call the Gemini API in streaming mode, yielding text chunks as they arrive.
+        
+        If a model fails before its first chunk, the next model on the route
+        is tried; once text has been sent there is no fallback. The model used
+        and token usage reported with the chunks are stored in call_info.
+        """
+        route = route or self._default_route()
+        call_info = call_info if call_info is not None else {}
+        received = False
+        
+        for index, model in enumerate(route.models):
+            call_info.update(model_used=model)
+            error = None
+            try:
+                # Streaming runs in the request thread, so never wait for rate limit budget
+                provider = self._provider_for(model)
+                stream = self._guarded_call(
+                    lambda: provider.stream(prompt), user_id, block=False
+                )
+            except (RateLimitExceeded, CircuitOpenError):
+                raise
+            except Exception as e:
+                # _guarded_call has already counted this failure for the circuit breaker
+                error = e
+            else:
+                try:
+                    for chunk in stream:
+                        call_info.update(token_usage(chunk))
+                        if chunk.text:
+                            received = True
+                            yield chunk.text
+                except Exception as e:
+                    if is_retryable_error(e):
+                        circuit_breaker.record_failure()
+                    error = e
             
-            content = ""
-            summary = ""
-            key_points = []
-            references = []
+            if error is not None:
+                logger.error(f"Gemini API error from {model}: {str(error)}")
+                if received or index == len(route.models) - 1:
+                    raise Exception(f"Failed to generate content: {str(error)}")
+                call_info.setdefault('fallback_from', model)
+                continue
             
-            current_section = None
+            if not received:
+                raise Exception("Failed to generate content: Empty response from Gemini API")
+            return
+    
+    def _hedged_call(self, func: Callable[[], Any], user_id: Optional[int]) -> Tuple[Any, Dict]:
+        """
+        Run an API call, sending one identical backup request if it is slow.
+        
+        If the primary call has not finished after the hedge delay (a
+        percentile of recent latencies), a second call is started and
+        whichever succeeds first wins; the other is cancelled if it has not
+        started yet, otherwise its result is ignored. The hedge budget caps
+        hedges to a fraction of recent primaries, and a request is never
+        hedged more than once.
+        """
+        hedge_policy.record_primary()
+        primary = submit(hedge_executor, self._timed_thread_call, func, user_id, True)
+        
+        try:
+            return primary.result(timeout=hedge_policy.delay()), {'hedge_count': 0, 'hedge_won': False}
+        except FuturesTimeoutError:
+            pass
+        
+        if not hedge_policy.try_acquire_hedge():
+            return primary.result(), {'hedge_count': 0, 'hedge_won': False}
+        
+        # The hedge must not wait for rate limit budget; if there is none it just fails
+        hedge = submit(hedge_executor, self._timed_thread_call, func, user_id, False)
+        is_hedge = {primary: False, hedge: True}
+        
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    won = is_hedge[future]
+                    hedge_policy.record_outcome(won)
+                    for loser in pending:
+                        # A call still queued for a pool thread need not be sent at all
+                        loser.cancel()
+                    return future.result(), {'hedge_count': 1, 'hedge_won': won}
+                if error is None or not is_hedge[future]:
+                    # Report the primary's error rather than the hedge's
+                    error = future.exception()
+        
+        hedge_policy.record_outcome(False)
+        raise error
+    
+    def _timed_thread_call(self, func: Callable[[], Any], user_id: Optional[int], block: bool) -> Any:
+        """Run a guarded call on a hedge pool thread and record its latency."""
+        
+        try:
+            start_time = time.monotonic()
+            result = self._guarded_call(func, user_id, block=block)
+            hedge_policy.record_latency(time.monotonic() - start_time)
+            return result
+        finally:
+            # Pool threads outlive requests, so don't keep their DB connection
+            connection.close()
+    
+    def _guarded_call(self, func: Callable[[], Any], user_id: Optional[int], block: bool) -> Any:
+        """
+        Run an API call behind the circuit breaker and rate limiter.
+        
+        Transient errors (quota, overload, timeouts) are retried with
+        exponential backoff and jitter; each attempt needs rate limit budget.
+        """
+        circuit_breaker.before_call()
+        
+        attempt = 0
+        while True:
+            try:
+                rate_limiter.acquire(user_id, block=block)
+            except RateLimitExceeded:
+                # The trial call of a half-open breaker never reached the API
+                circuit_breaker.release_trial()
+                raise
             
-            for section in sections:
-                section = section.strip()
-                if not section:
-                    continue
+            call_start = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                health_monitor.record_call(time.monotonic() - call_start, ok=False)
+                if not is_retryable_error(e):
+                    # The API answered, so upstream is healthy
+                    circuit_breaker.record_success()
+                    raise
                 
-                if 'CONTENT:' in section:
-                    current_section = 'content'
-                    content = section.replace('CONTENT:', '').strip()
-                elif 'SUMMARY:' in section:
-                    current_section = 'summary'
-                    summary = section.replace('SUMMARY:', '').strip()
-                elif 'KEY POINTS:' in section:
-                    current_section = 'key_points'
-                    points_text = section.replace('KEY POINTS:', '').strip()
-                    key_points = [point.strip('- ').strip() for point in points_text.split('\n') if point.strip().startswith('-')]
-                elif 'REFERENCES:' in section:
-                    current_section = 'references'
-                    refs_text = section.replace('REFERENCES:', '').strip()
-                    references = [ref.strip('- ').strip() for ref in refs_text.split('\n') if ref.strip().startswith('-')]
-                elif current_section == 'content':
-                    content += " " + section
-                elif current_section == 'summary':
-                    summary += " " + section
-                elif current_section == 'key_points':
-                    if section.strip().startswith('-'):
-                        key_points.append(section.strip('- ').strip())
-                elif current_section == 'references':
-                    if section.strip().startswith('-'):
-                        references.append(section.strip('- ').strip())
-            
-            # Fallback if parsing fails
-            if not content:
-                content = response
-            
-            return {
-                'content': content,
-                'summary': summary,
-                'key_points': key_points,
-                'references': references,
-            }
+                circuit_breaker.record_failure()
+                if attempt >= settings.AI_MAX_RETRIES or circuit_breaker.is_open:
+                    raise
+                
+                delay = backoff_delay(attempt)
+                logger.warning(f"Retryable Gemini API error, retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+                attempt += 1
+                continue
             
-        except Exception as e:
-            logger.error(f"Error parsing response: {str(e)}")
-            # Return the raw response as content if parsing fails
-            return {
-                'content': response,
-                'summary': '',
-                'key_points': [],
-                'references': [],
-            }
+            health_monitor.record_call(time.monotonic() - call_start, ok=True)
+            circuit_breaker.record_success()
+            return result
+    
+    def _parse_response(self, response: str) -> Dict:
+        """Parse the AI response into structured components."""
+        with timing('parse'):
+            return parse_response(response)
     
-    def _log_api_call(self, topic: StudyTopic, prompt: str, response: str, response_time: float, status: str, error_message: str = ""):
-        """Log the API call for monitoring and debugging."""
+    def _log_api_call(self, topic: StudyTopic, prompt: str, response: str, response_time: float, status: str,
+                      error_message: str = "", cache_hit: bool = False, coalesced: bool = False,
+                      hedge_count: int = 0, hedge_won: bool = False, template: Optional[CompiledTemplate] = None,
+                      user_preferences: Optional[UserPreference] = None, prompt_tokens: Optional[int] = None,
+                      candidates_tokens: Optional[int] = None, total_tokens: Optional[int] = None,
+                      estimated_cost: Optional[Decimal] = None, model_used: Optional[str] = None,
+                      fallback_from: str = ''):
+        """
+        Log the API call for monitoring and debugging.
+        
+        The row is handed to the buffered log writer, so the request never
+        waits for it to be saved. The prompt is stored as the template plus
+        its variables and the response compressed.
+        """
         
         try:
-            AIServiceLog.objects.create(
+            log = AIServiceLog(
                 user=topic.user,
                 topic=topic,
-                prompt=prompt,
-                response=response,
+                response_data=compress_text(response),
                 status=status,
-                model_used=self.model_name,
+                model_used=model_used or self.model_name,
+                fallback_from=fallback_from,
                 response_time_seconds=response_time,
                 error_message=error_message,
+                cache_hit=cache_hit,
+                coalesced=coalesced,
+                hedge_count=hedge_count,
+                hedge_won=hedge_won,
+                template_id=template.template_id if template else None,
+                max_word_count=self._max_words(user_preferences),
+                prompt_tokens=prompt_tokens,
+                candidates_tokens=candidates_tokens,
+                total_tokens=total_tokens,
+                estimated_cost=estimated_cost,
             )
+            if template:
+                pack_prompt(log, prompt, template.source, self._prompt_variables(topic, user_preferences))
+            else:
+                pack_prompt(log, prompt)
+            log_writer.write(log)
         except Exception as e:
             logger.error(f"Failed to log API call: {str(e)}")
     
     def get_service_status(self) -> Dict:
-        """Check the status of the AI service."""
+        """
+        Check the status of the AI service.
         
-        try:
-            # Test API connection
-            test_response = self.model.generate_content("Hello")
-            return {
-                'status': 'operational',
-                'model': self.model_name,
-                'api_working': True,
-            }
-        except Exception as e:
-            return {
-                'status': 'error',
-                'model': self.model_name,
-                'api_working': False,
-                'error': str(e),
-            } 
\ No newline at end of file
+        Answers from the health monitor's cached probe and traffic results
+        rather than calling the API.
+        """
+        
+        health_monitor.ensure_started()
+        health = health_monitor.snapshot()
+        
+        status_info = {
+            'status': health['status'],
+            'model': self.model_name,
+            'api_working': health['status'] in ('operational', 'degraded'),
+            'health': {'probe': health['probe'], 'traffic': health['traffic']},
+            'response_cache': response_cache.get_stats(),
+            'circuit_breaker': circuit_breaker.get_stats(),
+            'rate_limiter': rate_limiter.get_stats(include_budget=False),
+            'hedging': hedge_policy.get_stats(),
+            'routing': model_router.get_stats(),
+            'log_writer': log_writer.get_stats(),
+            'prompt_templates': template_cache.get_stats(),
+        }
+        
+        if circuit_breaker.is_open:
+            status_info.update(status='unavailable', api_working=False, error='Circuit breaker is open')
+        elif health['error']:
+            status_info['error'] = health['error']
+        
+        return status_info
@@ -1,3 +1,1040 @@
-from django.test import TestCase
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from google.api_core import exceptions as google_exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from core.metrics import RequestTimings, current_timings
+from notes.models import StudyTopic
+from . import log_storage
+from .cache import ResponseCache, response_cache
+from .jobs import claim_next_job, heartbeat, requeue_stale_jobs, run_generation_job
+from .log_storage import compress_text, content_hash, pack_prompt
+from .log_writer import BufferedLogWriter
+from .models import (
+    AIServiceLog, AIUsageRollup, GenerationJob, GenerationLease, PromptBlob, PromptTemplate, ResponseCacheEntry
+)
+from .parsing import ResponseParser, parse_outline, parse_response
+from .rollups import LATENCY_BUCKETS, period_start, record_usage, usage_stats
+from .providers import ProviderResponse
+from .services import (
+    LEASE_OWNER, AIService, HedgePolicy, ModelRouter, Route, SingleFlight, acquire_generation_lease,
+    release_generation_lease
+)
+from .throttling import CircuitBreaker, CircuitOpenError, RateLimitExceeded, TokenBucketLimiter, backoff_delay
 
-# Create your tests here.
+User = get_user_model()
+
+PAGE_SIZE = 20
+
+
+class QueryBudgetTests(TestCase):
+    """List and detail endpoints run the same number of queries for one row as for a full page."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.blob = PromptBlob.objects.create(hash=content_hash('Notes on {topic_title}'), content='Notes on {topic_title}')
+        self.jobs = []
+
+    def add_rows(self, count):
+        for _ in range(count):
+            topic = StudyTopic.objects.create(user=self.user, title=f'Topic {len(self.jobs)}', description='d')
+            log = AIServiceLog.objects.create(
+                user=self.user, topic=topic, prompt_blob=self.blob, prompt_variables={'topic_title': topic.title},
+                response_data=compress_text('response'), status='success', model_used='fake',
+                response_time_seconds=1.0, rolled_up=True,
+            )
+            record_usage([log])
+            self.jobs.append(GenerationJob.objects.create(user=self.user, topic=topic))
+            PromptTemplate.objects.create(name=f'Template {len(self.jobs)}', prompt_template='Notes on {topic_title}')
+
+    def assertQueryBudget(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list_endpoints(self):
+        # Token lookup, COUNT(*) and the page itself
+        for count in (1, PAGE_SIZE - 1):
+            self.add_rows(count)
+            with self.subTest(rows=len(self.jobs)):
+                logs = self.assertQueryBudget('/api/ai/logs/', 3).data['results']
+                self.assertEqual(len(logs), len(self.jobs))
+                self.assertEqual(logs[0]['prompt'], f'Notes on {self.jobs[-1].topic.title}')
+                self.assertEqual(len(self.assertQueryBudget('/api/ai/jobs/', 3).data['results']), len(self.jobs))
+                self.assertQueryBudget('/api/ai/templates/', 3)
+
+    def test_job_detail(self):
+        self.add_rows(1)
+        response = self.assertQueryBudget(f'/api/ai/jobs/{self.jobs[0].id}/', 2)
+        self.assertEqual(response.data['topic_title'], self.jobs[0].topic.title)
+
+    def test_stats(self):
+        for count in (1, PAGE_SIZE - 1):
+            self.add_rows(count)
+            with self.subTest(rows=len(self.jobs)):
+                self.assertEqual(self.assertQueryBudget('/api/ai/stats/', 2).data['total_requests'], len(self.jobs))
+
+
+@override_settings(GENERATION_JOB_MAX_ATTEMPTS=2)
+class GenerationJobTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.topic = StudyTopic.objects.create(user=self.user, title='Topic', description='d', status='processing')
+        self.job = GenerationJob.objects.create(user=self.user, topic=self.topic)
+
+    def claim(self):
+        self.assertEqual(claim_next_job('worker').pk, self.job.pk)
+        # Claimed long ago, last heard from a minute ago
+        GenerationJob.objects.filter(pk=self.job.pk).update(
+            started_at=timezone.now() - timedelta(hours=1), updated_at=timezone.now() - timedelta(seconds=60)
+        )
+
+    def test_slow_job_with_heartbeat_is_kept(self):
+        self.claim()
+        self.assertEqual(heartbeat([self.job.pk]), 1)
+
+        self.assertEqual(requeue_stale_jobs(30), 0)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'running')
+
+    def test_job_without_heartbeat_is_requeued(self):
+        self.claim()
+
+        self.assertEqual(requeue_stale_jobs(30), 1)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.worker_id), ('queued', ''))
+
+    def test_job_fails_after_max_attempts(self):
+        self.claim()
+        requeue_stale_jobs(30)
+        self.claim()
+
+        self.assertEqual(requeue_stale_jobs(30), 0)
+        self.job.refresh_from_db()
+        self.topic.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('failed', 2))
+        self.assertIsNotNone(self.job.finished_at)
+        self.assertEqual(self.topic.status, 'failed')
+
+    def test_deferral_is_not_an_attempt(self):
+        job = claim_next_job('worker')
+        with mock.patch('ai_service.jobs.AIService') as service:
+            service.return_value.generate_study_notes.side_effect = RateLimitExceeded(5.0)
+            job = run_generation_job(job)
+
+        self.assertEqual((job.status, job.attempts), ('queued', 0))
+
+
+@override_settings(AI_LOG_ASYNC=True, AI_LOG_FLUSH_INTERVAL=3600, AI_LOG_FLUSH_BATCH_SIZE=100)
+class BufferedLogWriterTests(TransactionTestCase):
+    # Foreign keys are checked at commit, which a TestCase never reaches
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.topic = StudyTopic.objects.create(user=self.user, title='Topic', description='d')
+        self.writer = BufferedLogWriter()
+        self.addCleanup(self.writer.close)
+        log_storage._blob_ids.clear()
+
+    def write(self, topic_id):
+        log = AIServiceLog(user=self.user, topic_id=topic_id, status='success', model_used='fake',
+                           response_time_seconds=1.0)
+        pack_prompt(log, 'Notes on Topic', 'Notes on {topic_title}', {'topic_title': 'Topic'})
+        self.writer.write(log)
+
+    def test_bad_row_drops_only_itself(self):
+        self.write(self.topic.id)
+        self.write(999999)  # A topic deleted before the flush
+        self.write(self.topic.id)
+
+        self.assertEqual(self.writer.flush(), 2)
+
+        stats = self.writer.get_stats()
+        self.assertEqual((stats['written'], stats['failed']), (2, 1))
+        logs = AIServiceLog.objects.all()
+        self.assertEqual([log.prompt_text for log in logs], ['Notes on Topic'] * 2)
+        self.assertEqual(PromptBlob.objects.count(), 1)
+        self.assertEqual(AIUsageRollup.objects.get(granularity='day').requests, 2)
+
+        # The blob id cached by the retry is one that was committed
+        self.write(self.topic.id)
+        self.assertEqual(self.writer.flush(), 1)
+
+
+class SingleFlightTests(TestCase):
+
+    def run_concurrently(self, leader_func, followers=3):
+        """Start a leader blocked in leader_func, then followers with the same key; return their outcomes."""
+
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        outcomes = []
+        follower_calls = []
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return leader_func()
+
+        def call(func):
+            try:
+                outcomes.append(('result', flight.do('key', func)))
+            except Exception as e:
+                outcomes.append(('error', e))
+
+        threads = [threading.Thread(target=call, args=(leader,))]
+        threads[0].start()
+        started.wait(5)
+        for _ in range(followers):
+            threads.append(threading.Thread(target=call, args=(lambda: follower_calls.append(1),)))
+            threads[-1].start()
+
+        # Let the followers reach the shared future before the leader finishes
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(follower_calls, [])
+        self.assertEqual(flight.in_flight(), 0)
+        return outcomes
+
+    def test_followers_share_the_result(self):
+        outcomes = self.run_concurrently(lambda: 'notes')
+
+        self.assertEqual(sorted(outcome for _, outcome in outcomes),
+                         [('notes', False)] + [('notes', True)] * 3)
+
+    def test_leader_exception_reaches_followers(self):
+        error = ValueError('upstream failed')
+
+        def fail():
+            raise error
+
+        outcomes = self.run_concurrently(fail)
+
+        self.assertEqual(outcomes, [('error', error)] * 4)
+
+    def test_key_is_released_after_the_call(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+        self.assertEqual(flight.do('key', lambda: 2), (2, False))
+
+
+@override_settings(AI_RESPONSE_CACHE_ENABLED=True, AI_RESPONSE_CACHE_MAX_ENTRIES=2, AI_RESPONSE_CACHE_EVICT_INTERVAL=60)
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.clock = 1000.0
+        patcher = mock.patch('ai_service.cache.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fill(self, *keys):
+        for key in keys:
+            self.cache.set(key, 'fake', f'response {key}')
+
+    def test_trims_at_most_once_per_interval(self):
+        self.fill('a', 'b', 'c')
+        self.assertEqual(ResponseCacheEntry.objects.count(), 3)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.cache._evict_due())
+
+        self.clock += 60
+        self.fill('d')
+        self.assertEqual(set(ResponseCacheEntry.objects.values_list('key', flat=True)), {'c', 'd'})
+
+    def test_expired_rows_are_dropped_on_trim(self):
+        self.fill('a')
+        ResponseCacheEntry.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.clock += 60
+        self.fill('b')
+        self.assertEqual(list(ResponseCacheEntry.objects.values_list('key', flat=True)), ['b'])
+
+    def test_hit_is_served_when_its_update_fails(self):
+        self.fill('a')
+        self.cache.clear_local()
+
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=DatabaseError('locked')):
+            self.assertEqual(self.cache.get('a'), 'response a')
+        self.assertEqual(self.cache.get_stats()['db_hits'], 1)
+
+    def test_hit_is_counted(self):
+        self.fill('a')
+        self.cache.clear_local()
+
+        self.assertEqual(self.cache.get('a'), 'response a')
+        self.assertEqual(ResponseCacheEntry.objects.get(key='a').hit_count, 1)
+
+
+@override_settings(AI_PROVIDER='fake', AI_RESPONSE_CACHE_ENABLED=True, AI_COALESCE_POLL_INTERVAL=0.01)
+class GenerationLeaseTests(TestCase):
+
+    def setUp(self):
+        response_cache.clear_local()
+        self.service = AIService()
+        self.fetch = mock.Mock(return_value=('# Notes', {'model_used': 'fake'}))
+
+    def hold_lease(self, key, expires_in=60):
+        GenerationLease.objects.create(key=key, owner='other-host:1',
+                                       expires_at=timezone.now() + timedelta(seconds=expires_in))
+
+    def test_lease_is_exclusive_until_released(self):
+        self.assertTrue(acquire_generation_lease('a'))
+        self.assertFalse(acquire_generation_lease('a'))
+
+        release_generation_lease('a')
+        self.assertTrue(acquire_generation_lease('a'))
+
+    def test_expired_lease_is_taken_over(self):
+        self.hold_lease('a', expires_in=-1)
+
+        self.assertTrue(acquire_generation_lease('a'))
+        self.assertEqual(GenerationLease.objects.get(key='a').owner, LEASE_OWNER)
+
+    def test_leader_calls_and_publishes(self):
+        response, parsed, shared, call_info = self.service._fetch_coalesced('leader', 'fake', self.fetch)
+
+        self.assertEqual((response, shared, call_info), ('# Notes', False, {'model_used': 'fake'}))
+        self.fetch.assert_called_once_with()
+        self.assertEqual(response_cache.get('leader'), '# Notes')
+        self.assertFalse(GenerationLease.objects.filter(key='leader').exists())
+
+    def test_follower_gets_the_published_response(self):
+        self.hold_lease('follower')
+        response_cache.set('follower', 'fake', '# Shared notes')
+
+        response, parsed, shared, call_info = self.service._fetch_coalesced('follower', 'fake', self.fetch)
+
+        self.assertEqual((response, shared, call_info), ('# Shared notes', True, {}))
+        self.fetch.assert_not_called()
+
+    @override_settings(AI_COALESCE_WAIT_SECONDS=0)
+    def test_follower_calls_itself_after_the_wait(self):
+        self.hold_lease('timeout')
+
+        response, parsed, shared, call_info = self.service._fetch_coalesced('timeout', 'fake', self.fetch)
+
+        self.assertEqual((response, shared), ('# Notes', False))
+        self.fetch.assert_called_once_with()
+        self.assertEqual(response_cache.get('timeout'), '# Notes')
+
+
+@override_settings(AI_RATE_LIMIT_GLOBAL_PER_MINUTE=60, AI_RATE_LIMIT_GLOBAL_BURST=2,
+                   AI_RATE_LIMIT_USER_PER_MINUTE=0, AI_RATE_LIMIT_USER_BURST=1)
+class TokenBucketLimiterTests(TestCase):
+
+    def setUp(self):
+        self.limiter = TokenBucketLimiter()
+        self.now = timezone.now()
+        patcher = mock.patch('ai_service.throttling.timezone')
+        patcher.start().now.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+    def test_burst_then_exhaustion(self):
+        self.assertEqual(self.limiter.try_acquire(), (0.0, ''))
+        self.assertEqual(self.limiter.try_acquire(), (0.0, ''))
+
+        wait, key = self.limiter.try_acquire()
+        self.assertAlmostEqual(wait, 1.0)
+        self.assertEqual(key, 'global')
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.acquire(block=False)
+        self.assertAlmostEqual(raised.exception.retry_after, 1.0)
+        self.assertEqual(raised.exception.scope, 'global')
+
+    def test_refill(self):
+        self.limiter.try_acquire()
+        self.limiter.try_acquire()
+
+        self.advance(0.5)
+        self.assertAlmostEqual(self.limiter.try_acquire()[0], 0.5)
+        self.advance(0.5)
+        self.assertEqual(self.limiter.try_acquire()[0], 0.0)
+
+    def test_refill_stops_at_burst(self):
+        self.limiter.try_acquire()
+        self.advance(3600)
+
+        self.assertEqual(self.limiter.try_acquire()[0], 0.0)
+        self.assertEqual(self.limiter.try_acquire()[0], 0.0)
+        self.assertAlmostEqual(self.limiter.try_acquire()[0], 1.0)
+
+    @override_settings(AI_RATE_LIMIT_USER_PER_MINUTE=6)
+    def test_user_budget(self):
+        self.assertEqual(self.limiter.try_acquire(user_id=1)[0], 0.0)
+
+        wait, key = self.limiter.try_acquire(user_id=1)
+        self.assertAlmostEqual(wait, 10.0)
+        self.assertEqual(key, 'user:1')
+        # A throttled call takes no global token, so another user still has budget
+        self.assertEqual(self.limiter.try_acquire(user_id=2)[0], 0.0)
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.acquire(user_id=1, timeout=5)
+        self.assertEqual(raised.exception.scope, 'user')
+
+
+@override_settings(AI_CIRCUIT_FAILURE_THRESHOLD=3, AI_CIRCUIT_RECOVERY_SECONDS=30)
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker()
+        self.clock = 1000.0
+        patcher = mock.patch('ai_service.throttling.time')
+        patcher.start().monotonic.side_effect = lambda: self.clock
+        self.addCleanup(patcher.stop)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_rejects_while_open(self):
+        self.open_breaker()
+        self.clock += 10
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before_call()
+        self.assertAlmostEqual(raised.exception.retry_after, 20.0)
+        self.assertEqual(self.breaker.get_stats()['rejected_calls'], 1)
+
+    def test_half_open_trial_closes_on_success(self):
+        self.open_breaker()
+        self.clock += 30
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()  # Only one trial at a time
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_half_open_trial_reopens_on_failure(self):
+        self.open_breaker()
+        self.clock += 30
+
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_released_trial_can_be_retried(self):
+        self.open_breaker()
+        self.clock += 30
+
+        self.breaker.before_call()
+        self.breaker.release_trial()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+
+@override_settings(AI_PROVIDER='fake', AI_MAX_RETRIES=0, AI_CIRCUIT_FAILURE_THRESHOLD=5,
+                   AI_RATE_LIMIT_GLOBAL_PER_MINUTE=0, AI_RATE_LIMIT_USER_PER_MINUTE=0)
+class StreamCircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker()
+        patcher = mock.patch('ai_service.services.circuit_breaker', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = AIService()
+        self.provider = mock.Mock()
+        self.service._providers['fake'] = self.provider
+
+    def stream(self):
+        route = Route(['fake'], {}, time.monotonic() + 60)
+        return list(self.service._stream_gemini_api('prompt', route=route))
+
+    def test_failed_stream_start_counts_once(self):
+        self.provider.stream.side_effect = google_exceptions.ServiceUnavailable('overloaded')
+
+        with self.assertRaises(Exception):
+            self.stream()
+
+        self.assertEqual(self.breaker.consecutive_failures, 1)
+
+    def test_failure_while_streaming_counts_once(self):
+        def chunks():
+            yield ProviderResponse('**CONTENT:**\n')
+            raise google_exceptions.ServiceUnavailable('connection reset')
+
+        self.provider.stream.return_value = chunks()
+
+        with self.assertRaises(Exception):
+            self.stream()
+
+        self.assertEqual(self.breaker.consecutive_failures, 1)
+
+
+@override_settings(AI_RETRY_BASE_DELAY=1.0, AI_RETRY_MAX_DELAY=20.0)
+class BackoffDelayTests(TestCase):
+
+    def test_jitter_bounds(self):
+        for attempt, ceiling in ((0, 1.0), (1, 2.0), (3, 8.0), (4, 16.0), (5, 20.0), (10, 20.0)):
+            with self.subTest(attempt=attempt):
+                delays = [backoff_delay(attempt) for _ in range(200)]
+                self.assertTrue(all(0 <= delay <= ceiling for delay in delays))
+                # Full jitter spreads retries over the whole range
+                self.assertGreater(max(delays), ceiling / 2)
+
+                with mock.patch('ai_service.throttling.random.uniform', side_effect=lambda low, high: high):
+                    self.assertEqual(backoff_delay(attempt), ceiling)
+
+
+@override_settings(AI_PROVIDER='fake', AI_MODEL_POOL=['pro', 'flash'], AI_FAKE_LATENCY='fixed',
+                   AI_FAKE_LATENCY_MEDIAN=0, AI_FAKE_ERROR_RATE=0, AI_HEDGING_ENABLED=False,
+                   AI_RATE_LIMIT_GLOBAL_PER_MINUTE=0, AI_RATE_LIMIT_USER_PER_MINUTE=0,
+                   AI_ROUTER_MAX_ERROR_RATE=0.3, AI_ROUTER_SMALL_REQUEST_WORDS=500,
+                   AI_ROUTER_FALLBACK_MARGIN=1.5, AI_SECTIONED_MIN_WORDS=0)
+class ModelRouterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.router = ModelRouter()
+        self.service = AIService()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def add_logs(self, model, count, seconds, status='success', fallback_from=''):
+        for _ in range(count):
+            AIServiceLog.objects.create(user=self.user, model_used=model, status=status, max_word_count=1000,
+                                        response_time_seconds=seconds, fallback_from=fallback_from)
+
+    def measure(self):
+        # pro takes 10s and flash 2s for a 1000 word note
+        self.add_logs('pro', 5, 10.0)
+        self.add_logs('flash', 5, 2.0)
+
+    def route(self, difficulty='intermediate', max_words=1000, deadline=60):
+        return self.router.route(StudyTopic(difficulty=difficulty), max_words, deadline)
+
+    def slow(self, prompt):
+        self.release.wait(5)
+        return ProviderResponse('**CONTENT:**\nslow')
+
+    def test_first_model_that_fits_the_deadline(self):
+        self.measure()
+
+        route = self.route()
+        self.assertEqual(route.models, ['pro', 'flash'])
+        self.assertAlmostEqual(route.estimates['pro'], 10.0)
+        self.assertAlmostEqual(route.estimates['flash'], 2.0)
+
+        self.router = ModelRouter()
+        self.assertEqual(self.route(deadline=5).models, ['flash', 'pro'])
+
+    def test_short_beginner_notes_go_to_the_fastest_model(self):
+        self.measure()
+
+        self.assertEqual(self.route(difficulty='beginner', max_words=400).models, ['flash', 'pro'])
+        self.assertEqual(self.route(difficulty='beginner', max_words=1000).models, ['pro', 'flash'])
+
+    def test_unhealthy_models_go_last(self):
+        self.measure()
+        self.add_logs('pro', 5, 30.0, status='failed')
+
+        self.assertEqual(self.route().models, ['flash', 'pro'])
+
+    def test_fallbacks_count_as_failures(self):
+        self.measure()
+        self.add_logs('flash', 5, 2.0, fallback_from='pro')
+
+        stats = self.router.model_stats()
+        self.assertEqual(stats['pro']['calls'], 10)
+        self.assertAlmostEqual(stats['pro']['error_rate'], 0.5)
+        self.assertEqual(self.route().models, ['flash', 'pro'])
+
+    def test_unmeasured_models_keep_pool_order(self):
+        self.assertEqual(self.route().models, ['pro', 'flash'])
+        self.assertEqual(self.route(difficulty='beginner', max_words=400).models, ['pro', 'flash'])
+
+    @mock.patch('ai_service.services.time')
+    def test_attempt_timeout(self, mock_time):
+        mock_time.monotonic.return_value = 1000.0
+
+        self.assertAlmostEqual(Route(['pro', 'flash'], {'flash': 10.0}, 1060.0).attempt_timeout(0), 45.0)
+        # Without an estimate the next model is left half the remaining time
+        self.assertAlmostEqual(Route(['pro', 'flash'], {}, 1060.0).attempt_timeout(0), 30.0)
+        # If the next model could not finish in time either, this one gets all of it
+        self.assertAlmostEqual(Route(['pro', 'flash'], {'flash': 50.0}, 1060.0).attempt_timeout(0), 60.0)
+        self.assertIsNone(Route(['pro', 'flash'], {'flash': 10.0}, 1060.0).attempt_timeout(1))
+
+    def test_falls_back_when_the_model_is_too_slow(self):
+        route = Route(['pro', 'flash'], {'flash': 0.0}, time.monotonic() + 0.2)
+
+        with mock.patch.object(self.service._provider_for('pro'), 'generate', side_effect=self.slow):
+            response, call_info = self.service._call_gemini_api('prompt', route=route)
+
+        self.assertNotIn('slow', response)
+        self.assertEqual((call_info['model_used'], call_info['fallback_from']), ('flash', 'pro'))
+
+    def test_falls_back_on_error(self):
+        route = Route(['pro', 'flash'], {}, time.monotonic() + 60)
+
+        with mock.patch.object(self.service._provider_for('pro'), 'generate', side_effect=ValueError('bad')):
+            response, call_info = self.service._call_gemini_api('prompt', route=route)
+
+        self.assertEqual((call_info['model_used'], call_info['fallback_from']), ('flash', 'pro'))
+
+    def test_last_model_error_is_raised(self):
+        route = Route(['pro', 'flash'], {}, time.monotonic() + 60)
+
+        with mock.patch.object(self.service._provider_for('pro'), 'generate', side_effect=ValueError('bad')), \
+                mock.patch.object(self.service._provider_for('flash'), 'generate', side_effect=ValueError('worse')):
+            with self.assertRaisesMessage(Exception, 'worse'):
+                self.service._call_gemini_api('prompt', route=route)
+
+    def test_no_fallback_when_the_first_model_answers(self):
+        response, call_info = self.service._call_gemini_api('prompt', route=Route(['pro', 'flash'], {}, time.monotonic() + 60))
+
+        self.assertEqual((call_info['model_used'], call_info['fallback_from']), ('pro', ''))
+
+    @override_settings(AI_LOG_ASYNC=False, AI_RESPONSE_CACHE_ENABLED=False)
+    def test_fallback_is_logged(self):
+        topic = StudyTopic.objects.create(user=self.user, title='Topic', description='d')
+
+        with mock.patch('ai_service.services.model_router', self.router), \
+                mock.patch.object(self.service._provider_for('pro'), 'generate', side_effect=ValueError('bad')):
+            result = self.service.generate_study_notes(topic, use_cache=False)
+
+        log = AIServiceLog.objects.get(topic=topic)
+        self.assertEqual((log.status, log.model_used, log.fallback_from), ('success', 'flash', 'pro'))
+        self.assertEqual(result['ai_model_used'], 'flash')
+
+
+@override_settings(AI_HEDGE_INITIAL_DELAY=30.0, AI_HEDGE_MIN_DELAY=2.0, AI_HEDGE_DELAY_PERCENTILE=95,
+                   AI_HEDGE_MAX_RATIO=0.5)
+class HedgePolicyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.policy = HedgePolicy()
+        self.clock = 1000.0
+        patcher = mock.patch('ai_service.services.time')
+        patcher.start().monotonic.side_effect = lambda: self.clock
+        self.addCleanup(patcher.stop)
+
+    def test_initial_delay_until_enough_samples(self):
+        for _ in range(HedgePolicy.MIN_SAMPLES - 1):
+            self.policy.record_latency(5.0)
+        self.assertEqual(self.policy.delay(), 30.0)
+
+        self.policy.record_latency(5.0)
+        self.assertEqual(self.policy.delay(), 5.0)
+
+    def test_delay_follows_the_latency_percentile(self):
+        for seconds in range(1, 101):
+            self.policy.record_latency(float(seconds))
+        self.assertEqual(self.policy.delay(), 96.0)
+
+        for _ in range(500):
+            self.policy.record_latency(0.5)
+        # Only recent latencies count, and the delay never drops below the minimum
+        self.assertEqual(self.policy.delay(), 2.0)
+
+    def test_budget_caps_hedges_per_primary(self):
+        self.policy.record_primary()
+        self.assertFalse(self.policy.try_acquire_hedge())
+
+        self.policy.record_primary()
+        self.assertTrue(self.policy.try_acquire_hedge())
+        self.assertFalse(self.policy.try_acquire_hedge())
+
+        self.policy.record_primary()
+        self.policy.record_primary()
+        self.assertTrue(self.policy.try_acquire_hedge())
+        self.assertEqual(self.policy.get_stats()['hedges_sent'], 2)
+
+    def test_budget_is_freed_after_the_window(self):
+        self.policy.record_primary()
+        self.policy.record_primary()
+        self.assertTrue(self.policy.try_acquire_hedge())
+
+        self.clock += HedgePolicy.WINDOW_SECONDS + 1
+        self.assertFalse(self.policy.try_acquire_hedge())  # The old primaries left the window too
+        self.policy.record_primary()
+        self.policy.record_primary()
+        self.assertTrue(self.policy.try_acquire_hedge())
+
+    @override_settings(AI_HEDGE_MAX_RATIO=5.0)
+    def test_ratio_is_capped_at_one(self):
+        self.policy.record_primary()
+        self.assertTrue(self.policy.try_acquire_hedge())
+        self.assertFalse(self.policy.try_acquire_hedge())
+
+
+@override_settings(AI_PROVIDER='fake', AI_HEDGE_INITIAL_DELAY=0.05, AI_HEDGE_MIN_DELAY=0.05, AI_HEDGE_MAX_RATIO=1.0,
+                   AI_RATE_LIMIT_GLOBAL_PER_MINUTE=0, AI_RATE_LIMIT_USER_PER_MINUTE=0)
+class HedgedCallTests(TestCase):
+
+    def setUp(self):
+        self.policy = HedgePolicy()
+        patcher = mock.patch('ai_service.services.hedge_policy', self.policy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = AIService()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def provider(self, *attempts):
+        """A call whose nth attempt runs attempts[n]: seconds to take or an exception to raise."""
+
+        def call():
+            with self.calls_lock:
+                attempt = attempts[self.calls]
+                self.calls += 1
+            if isinstance(attempt, Exception):
+                raise attempt
+            if attempt is None:
+                self.release.wait(5)
+                return 'slow'
+            time.sleep(attempt)
+            return f'after {attempt}s'
+
+        return call
+
+    def test_fast_primary_is_not_hedged(self):
+        result, info = self.service._hedged_call(self.provider(0), None)
+
+        self.assertEqual((result, info), ('after 0s', {'hedge_count': 0, 'hedge_won': False}))
+        self.assertEqual(self.calls, 1)
+
+    def test_hedge_wins_over_a_slow_primary(self):
+        result, info = self.service._hedged_call(self.provider(None, 0), None)
+
+        self.assertEqual((result, info), ('after 0s', {'hedge_count': 1, 'hedge_won': True}))
+        self.assertEqual(self.policy.get_stats()['hedges_won'], 1)
+
+    def test_primary_can_still_win(self):
+        result, info = self.service._hedged_call(self.provider(0.2, None), None)
+
+        self.assertEqual((result, info), ('after 0.2s', {'hedge_count': 1, 'hedge_won': False}))
+        self.assertEqual(self.policy.get_stats()['hedges_won'], 0)
+
+    def test_queued_loser_is_cancelled(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        queued = Future()
+        submitted = []
+
+        def submit(func, *args):
+            # The primary runs; the hedge stays queued as if every pool thread were busy
+            submitted.append(func)
+            return executor.submit(func, *args) if len(submitted) == 1 else queued
+
+        with mock.patch('ai_service.services.hedge_executor') as hedge_executor:
+            hedge_executor.submit.side_effect = submit
+            result, info = self.service._hedged_call(self.provider(0.2), None)
+
+        self.assertEqual((result, info), ('after 0.2s', {'hedge_count': 1, 'hedge_won': False}))
+        self.assertEqual(len(submitted), 2)
+        self.assertTrue(queued.cancelled())
+
+    @override_settings(AI_HEDGE_MAX_RATIO=0.0)
+    def test_no_hedge_without_budget(self):
+        result, info = self.service._hedged_call(self.provider(0.2, 0), None)
+
+        self.assertEqual((result, info), ('after 0.2s', {'hedge_count': 0, 'hedge_won': False}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.policy.get_stats()['hedges_sent'], 0)
+
+    def test_hedge_error_is_ignored_if_the_primary_succeeds(self):
+        result, info = self.service._hedged_call(self.provider(0.2, ValueError('hedge failed')), None)
+
+        self.assertEqual((result, info), ('after 0.2s', {'hedge_count': 1, 'hedge_won': False}))
+
+    @override_settings(AI_HEDGING_ENABLED=True)
+    def test_model_call_reports_the_hedge(self):
+        provider = self.service._provider_for('fake')
+        slow_then_fast = self.provider(None, 0)
+
+        with mock.patch.object(provider, 'generate', side_effect=lambda prompt: ProviderResponse(slow_then_fast())):
+            response, info = self.service._call_model('fake', 'prompt', None)
+
+        self.assertEqual((response.text, info), ('after 0s', {'hedge_count': 1, 'hedge_won': True}))
+
+    def test_primary_error_is_raised_when_both_fail(self):
+        def fail_late():
+            with self.calls_lock:
+                self.calls += 1
+                attempt = self.calls
+            if attempt == 1:
+                time.sleep(0.2)
+            raise ValueError(f'attempt {attempt} failed')
+
+        with self.assertRaisesMessage(ValueError, 'attempt 1 failed'):
+            self.service._hedged_call(fail_late, None)
+        self.assertEqual(self.calls, 2)
+
+
+@override_settings(AI_PROVIDER='fake', AI_FAKE_LATENCY='fixed', AI_FAKE_LATENCY_MEDIAN=0, AI_FAKE_ERROR_RATE=0,
+                   AI_HEDGE_INITIAL_DELAY=30.0, AI_RATE_LIMIT_GLOBAL_PER_MINUTE=0, AI_RATE_LIMIT_USER_PER_MINUTE=0)
+class PoolThreadTimingTests(TestCase):
+
+    def setUp(self):
+        self.service = AIService()
+        self.timings = RequestTimings()
+        token = current_timings.set(self.timings)
+        self.addCleanup(current_timings.reset, token)
+
+    def call(self):
+        # Every model but the last runs on a route pool thread
+        return self.service._call_gemini_api('prompt', route=Route(['fake', 'other'], {}, time.monotonic() + 60))
+
+    def test_route_thread_stages_reach_the_request(self):
+        response, call_info = self.call()
+
+        self.assertEqual(call_info['model_used'], 'fake')
+        self.assertIn('llm', self.timings.stages)
+
+    def test_section_thread_stages_reach_the_request(self):
+        route = Route(['fake'], {}, time.monotonic() + 60)
+        self.service._generate_sections(['first', 'second'], None, route)
+
+        self.assertIn('llm', self.timings.stages)
+
+    def test_other_requests_are_not_affected(self):
+        other = RequestTimings()
+        current_timings.set(other)
+        self.call()
+
+        self.assertIn('llm', other.stages)
+        self.assertEqual(self.timings.stages, {})
+
+
+RESPONSE = """**CONTENT:**
+Photosynthesis turns **light** into chemical energy.
+
+It happens in the chloroplasts.
+
+**SUMMARY:**
+Plants make sugar from light.
+
+**KEY POINTS:**
+- Light reactions make ATP
+- The Calvin cycle
+  fixes carbon
+1. Oxygen is released
+
+**REFERENCES:**
+* Campbell Biology
+"""
+
+PARSED = {
+    'content': 'Photosynthesis turns **light** into chemical energy.\n\nIt happens in the chloroplasts.',
+    'summary': 'Plants make sugar from light.',
+    'key_points': ['Light reactions make ATP', 'The Calvin cycle fixes carbon', 'Oxygen is released'],
+    'references': ['Campbell Biology'],
+}
+
+
+class ResponseParserTests(SimpleTestCase):
+
+    def parse_chunks(self, chunks):
+        parser = ResponseParser()
+        events = []
+        for chunk in chunks:
+            events += parser.feed(chunk)
+        events += parser.close()
+        return parser.result(), events
+
+    def test_parse_response(self):
+        self.assertEqual(parse_response(RESPONSE), PARSED)
+
+    def test_every_split_point(self):
+        # Includes every split inside a header such as "**KEY| POINTS:**"
+        for split in range(len(RESPONSE) + 1):
+            with self.subTest(split=split):
+                result, _ = self.parse_chunks([RESPONSE[:split], RESPONSE[split:]])
+                self.assertEqual(result, PARSED)
+
+    def test_single_character_chunks(self):
+        result, events = self.parse_chunks(RESPONSE)
+
+        self.assertEqual(result, PARSED)
+        self.assertEqual([data['section'] for event, data in events if event == 'section'],
+                         ['content', 'summary', 'key_points', 'references'])
+        deltas = ''.join(data['text'] for event, data in events if event == 'delta' and data['section'] == 'summary')
+        self.assertEqual(deltas.strip(), PARSED['summary'])
+
+    def test_crlf(self):
+        crlf = RESPONSE.replace('\n', '\r\n')
+
+        self.assertEqual(parse_response(crlf), PARSED)
+        # A line break split between chunks
+        split = crlf.index('\r\n**SUMMARY') + 1
+        self.assertEqual(self.parse_chunks([crlf[:split], crlf[split:]])[0], PARSED)
+
+    def test_header_variants(self):
+        for header in ('**SUMMARY:**', '**Summary:**', '**SUMMARY**:', '**Summary** :', '## **Summary**:',
+                       '  **summary :**'):
+            with self.subTest(header=header):
+                result = parse_response(f'**CONTENT:**\nText\n{header}\nShort.\n')
+                self.assertEqual((result['content'], result['summary']), ('Text', 'Short.'))
+
+    def test_text_on_the_header_line(self):
+        result = parse_response('**CONTENT:** Inline text\n**SUMMARY:** Inline summary')
+
+        self.assertEqual((result['content'], result['summary']), ('Inline text', 'Inline summary'))
+
+    def test_bold_that_is_not_a_header(self):
+        result = parse_response('**CONTENT:**\n**Note:** not a section\n**SUMMARY OF RESULTS:** still content')
+
+        self.assertEqual(result['content'], '**Note:** not a section\n**SUMMARY OF RESULTS:** still content')
+        self.assertEqual(result['summary'], '')
+
+    def test_no_sections(self):
+        self.assertEqual(parse_response('Just some text.'), {
+            'content': 'Just some text.', 'summary': '', 'key_points': [], 'references': [],
+        })
+
+    def test_parse_outline(self):
+        self.assertEqual(
+            parse_outline('Here is the outline:\n\n1. **Introduction**\n2. Light reactions:\n- ## Calvin cycle\n'),
+            ['Introduction', 'Light reactions', 'Calvin cycle'],
+        )
+        self.assertEqual(parse_outline('Introduction\r\n\r\n**Light reactions**\n  \n'),
+                         ['Introduction', 'Light reactions'])
+        self.assertEqual(parse_outline(''), [])
+
+
+class UsageRollupTests(TestCase):
+
+    # (hours before the current hour, model, status, seconds, cache hit, tokens)
+    FIXTURE = [
+        (0, 'gemini-pro', 'success', 0.8, False, 900), (0, 'gemini-pro', 'success', 2.5, False, 1200),
+        (0, 'gemini-flash', 'success', 0.05, True, None), (0, 'gemini-pro', 'failed', 30.0, False, None),
+        (1, 'gemini-flash', 'success', 1.7, False, 700), (1, 'gemini-pro', 'success', 12.0, False, 2100),
+        (5, 'gemini-pro', 'success', 4.2, False, 1500), (30, 'gemini-pro', 'success', 0.4, False, 800),
+        (30, 'gemini-flash', 'failed', 1.1, False, None), (50, 'gemini-pro', 'success', 400.0, False, 3000),
+        (50, 'gemini-pro', 'success', 6.6, False, 1300), (75, 'gemini-flash', 'success', 0.9, False, 600),
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        hour = period_start(timezone.now(), 'hour')
+        self.logs = []
+        for hours_ago, model, status, seconds, cache_hit, tokens in self.FIXTURE:
+            log = AIServiceLog.objects.create(
+                user=self.user, model_used=model, status=status, response_time_seconds=seconds, cache_hit=cache_hit,
+                hedge_count=int(seconds > 10), hedge_won=seconds == 12.0, fallback_from='gemini-pro' if model == 'gemini-flash' else '',
+                prompt_tokens=tokens and tokens // 3, candidates_tokens=tokens and tokens - tokens // 3,
+                total_tokens=tokens, estimated_cost=tokens and Decimal(tokens) / 1000000, rolled_up=True,
+            )
+            log.created_at = hour - timedelta(hours=hours_ago, minutes=-len(self.logs))
+            AIServiceLog.objects.filter(pk=log.pk).update(created_at=log.created_at)
+            self.logs.append(log)
+
+        # Two batches, so that the second one updates rows the first one created
+        record_usage(self.logs[::2])
+        record_usage(self.logs[1::2])
+
+    def expected(self, logs):
+        """The stats computed directly from log rows."""
+
+        successful = sorted(log.response_time_seconds for log in logs if log.status == 'success')
+        model_usage = {}
+        for log in logs:
+            model_usage[log.model_used] = model_usage.get(log.model_used, 0) + 1
+        return {
+            'total_requests': len(logs),
+            'successful_requests': len(successful),
+            'failed_requests': sum(log.status == 'failed' for log in logs),
+            'cache_hits': sum(log.cache_hit for log in logs),
+            'coalesced_requests': 0,
+            'hedged_requests': sum(log.hedge_count > 0 for log in logs),
+            'hedges_won': sum(log.hedge_won for log in logs),
+            'fallback_requests': sum(bool(log.fallback_from) for log in logs),
+            'average_response_time': sum(successful) / len(successful) if successful else 0,
+            'model_usage': model_usage,
+            'total_tokens_used': sum(log.total_tokens or 0 for log in logs),
+            'prompt_tokens_used': sum(log.prompt_tokens or 0 for log in logs),
+            'candidates_tokens_used': sum(log.candidates_tokens or 0 for log in logs),
+            'estimated_cost': sum((log.estimated_cost or 0 for log in logs), Decimal(0)),
+        }, successful
+
+    def assertStatsMatch(self, stats, logs):
+        expected, latencies = self.expected(logs)
+        self.assertAlmostEqual(stats.pop('average_response_time'), expected.pop('average_response_time'))
+        percentiles = stats.pop('response_time_percentiles')
+        self.assertEqual(stats, expected)
+
+        for name, estimate in percentiles.items():
+            if not latencies:
+                self.assertIsNone(estimate)
+                continue
+            # Nearest-rank percentile of the raw latencies; the estimate lies in its bucket
+            exact = latencies[max(0, math.ceil(len(latencies) * int(name[1:]) / 100) - 1)]
+            bounds = (0.0, *LATENCY_BUCKETS, math.inf)
+            bucket = next(index for index, bound in enumerate(bounds[1:]) if exact <= bound)
+            with self.subTest(percentile=name, exact=exact):
+                self.assertGreaterEqual(estimate, bounds[bucket])
+                self.assertLessEqual(estimate, bounds[bucket + 1])
+
+    def test_all_time(self):
+        self.assertStatsMatch(usage_stats(self.user), self.logs)
+
+    def test_recent_days_and_hours(self):
+        today = period_start(timezone.now(), 'day')
+        hour = period_start(timezone.now(), 'hour')
+        for days in (1, 2, 4):
+            with self.subTest(days=days):
+                since = today - timedelta(days=days - 1)
+                self.assertStatsMatch(usage_stats(self.user, days=days),
+                                      [log for log in self.logs if log.created_at >= since])
+        for hours in (1, 2, 6):
+            with self.subTest(hours=hours):
+                since = hour - timedelta(hours=hours - 1)
+                self.assertStatsMatch(usage_stats(self.user, hours=hours),
+                                      [log for log in self.logs if log.created_at >= since])
+
+    def test_other_users_are_excluded(self):
+        other = User.objects.create_user(username='b@example.com', email='b@example.com', password='x')
+        self.assertStatsMatch(usage_stats(other), [])
+
+    def test_rebuild_gives_the_same_stats(self):
+        before = usage_stats(self.user)
+
+        call_command('backfill_ai_usage_rollups', '--rebuild', stdout=StringIO())
+
+        self.assertEqual(usage_stats(self.user), before)
@@ -0,0 +1,255 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from google.api_core import exceptions as google_exceptions
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no AI API budget is available within the allowed wait."""
+
+    def __init__(self, retry_after: float, scope: str = 'global'):
+        self.retry_after = retry_after
+        self.scope = scope
+        super().__init__(f"AI rate limit exceeded ({scope}), retry in {retry_after:.1f}s")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the AI API while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"AI service is unavailable, retry in {retry_after:.1f}s")
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether an API error is transient (quota, overload or timeout)."""
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (0-based)."""
+    ceiling = min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket rate limiter shared by all processes through the database.
+
+    Each call needs one token from the global bucket and one from the calling
+    user's bucket. Buckets refill continuously at their per-minute rate up to
+    their burst size. A rate of 0 disables that budget.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+        self.total_wait_seconds = 0.0
+
+    def _budgets(self, user_id: Optional[int]) -> List[Tuple[str, float, float]]:
+        budgets = []
+        if settings.AI_RATE_LIMIT_GLOBAL_PER_MINUTE > 0:
+            budgets.append((
+                'global',
+                settings.AI_RATE_LIMIT_GLOBAL_PER_MINUTE,
+                settings.AI_RATE_LIMIT_GLOBAL_BURST,
+            ))
+        if user_id is not None and settings.AI_RATE_LIMIT_USER_PER_MINUTE > 0:
+            budgets.append((
+                f'user:{user_id}',
+                settings.AI_RATE_LIMIT_USER_PER_MINUTE,
+                settings.AI_RATE_LIMIT_USER_BURST,
+            ))
+        return budgets
+
+    def try_acquire(self, user_id: Optional[int] = None) -> Tuple[float, str]:
+        """
+        Take one token from every applicable bucket, or none at all.
+
+        Returns:
+            Tuple of (seconds until a token is available, limiting bucket key).
+            A wait of 0 means the tokens were taken.
+        """
+        budgets = self._budgets(user_id)
+        if not budgets:
+            return 0.0, ''
+
+        now = timezone.now()
+        wait, limiting_key = 0.0, ''
+
+        with transaction.atomic():
+            buckets = []
+            # Lock in key order so concurrent callers cannot deadlock
+            for key, rate, burst in sorted(budgets):
+                bucket, _ = RateLimitBucket.objects.select_for_update().get_or_create(
+                    key=key,
+                    defaults={'tokens': burst, 'updated_at': now}
+                )
+                elapsed = max(0.0, (now - bucket.updated_at).total_seconds())
+                bucket.tokens = min(burst, bucket.tokens + elapsed * rate / 60.0)
+                bucket.updated_at = now
+                buckets.append(bucket)
+
+                if bucket.tokens < 1:
+                    bucket_wait = (1 - bucket.tokens) * 60.0 / rate
+                    if bucket_wait > wait:
+                        wait, limiting_key = bucket_wait, key
+
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+
+            for bucket in buckets:
+                bucket.save(update_fields=['tokens', 'updated_at'])
+
+        return wait, limiting_key
+
+    def acquire(self, user_id: Optional[int] = None, block: bool = True, timeout: Optional[float] = None):
+        """
+        Wait for budget to call the AI API.
+
+        Raises:
+            RateLimitExceeded: if no token is available (block=False) or the
+                wait would exceed the timeout.
+        """
+        if timeout is None:
+            timeout = settings.AI_RATE_LIMIT_MAX_WAIT
+
+        waited = 0.0
+        while True:
+            wait, key = self.try_acquire(user_id)
+            if wait == 0:
+                with self._lock:
+                    self.allowed += 1
+                    self.total_wait_seconds += waited
+                return
+
+            if not block or waited + wait > timeout:
+                with self._lock:
+                    self.throttled += 1
+                raise RateLimitExceeded(wait, scope='user' if key.startswith('user:') else 'global')
+
+            time.sleep(wait)
+            waited += wait
+
+    def get_stats(self, include_budget: bool = True) -> Dict:
+        """
+        Limiter configuration and counters for this process.
+
+        With include_budget the current global budget is read from the database.
+        """
+
+        global_bucket = RateLimitBucket.objects.filter(key='global').first() if include_budget else None
+        with self._lock:
+            stats = {
+                'global_per_minute': settings.AI_RATE_LIMIT_GLOBAL_PER_MINUTE,
+                'user_per_minute': settings.AI_RATE_LIMIT_USER_PER_MINUTE,
+                'allowed': self.allowed,
+                'throttled': self.throttled,
+                'average_wait_seconds': self.total_wait_seconds / self.allowed if self.allowed else 0.0,
+            }
+        if include_budget:
+            stats['global_tokens'] = round(global_bucket.tokens, 2) if global_bucket else None
+        return stats
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the upstream API is unhealthy.
+
+    After AI_CIRCUIT_FAILURE_THRESHOLD consecutive transient failures the
+    breaker opens and rejects calls for AI_CIRCUIT_RECOVERY_SECONDS. It then
+    lets a single trial call through (half-open); success closes it again
+    and failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.rejected = 0
+        self.times_opened = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call should not be attempted."""
+
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + settings.AI_CIRCUIT_RECOVERY_SECONDS - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(remaining)
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(settings.AI_CIRCUIT_RECOVERY_SECONDS)
+                self.trial_in_flight = True
+
+    def release_trial(self):
+        """Give back the half-open trial slot when the call was never made."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= settings.AI_CIRCUIT_FAILURE_THRESHOLD:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning("AI circuit breaker opened after %d failure(s)", self.consecutive_failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            retry_after = 0.0
+            if self.state == self.OPEN:
+                retry_after = max(0.0, self.opened_at + settings.AI_CIRCUIT_RECOVERY_SECONDS - time.monotonic())
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'rejected_calls': self.rejected,
+                'retry_after_seconds': round(retry_after, 1),
+            }
+
+
+rate_limiter = TokenBucketLimiter()
+circuit_breaker = CircuitBreaker()
@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('status/', views.ai_service_status, name='ai_service_status'),
     path('stats/', views.ai_service_stats, name='ai_service_stats'),
+    path('stats/breakdown/', views.ai_service_stats_breakdown, name='ai_service_stats_breakdown'),
     path('logs/', views.AIServiceLogListView.as_view(), name='ai_service_logs'),
     path('templates/', views.PromptTemplateListView.as_view(), name='prompt_templates'),
+    path('jobs/', views.GenerationJobListView.as_view(), name='generation_jobs'),
+    path('jobs/<int:pk>/', views.GenerationJobDetailView.as_view(), name='generation_job_detail'),
 ] 
\ No newline at end of file
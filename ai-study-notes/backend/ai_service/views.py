@@ -3,8 +3,9 @@ from rest_framework import status, generics
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from .models import AIServiceLog, PromptTemplate
-from .serializers import AIServiceLogSerializer, PromptTemplateSerializer
+from .models import AIServiceLog, PromptTemplate, GenerationJob
+from .rollups import usage_stats
+from .serializers import AIServiceLogSerializer, PromptTemplateSerializer, GenerationJobSerializer
 from .services import AIService
 from django.db import models
 
@@ -19,7 +20,9 @@ class AIServiceLogListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return AIServiceLog.objects.filter(user=self.request.user).order_by('-created_at')
+        return AIServiceLog.objects.filter(user=self.request.user).select_related(
+            'prompt_blob', 'topic', 'user'
+        ).order_by('-created_at')
 
 
 class PromptTemplateListView(generics.ListAPIView):
@@ -30,6 +33,34 @@ class PromptTemplateListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
 
+class GenerationJobListView(generics.ListAPIView):
+    """List note generation jobs for the current user."""
+    
+    serializer_class = GenerationJobSerializer
+    permission_classes = [IsAuthenticated]
+    filterset_fields = ['status', 'kind', 'topic']
+    
+    def get_queryset(self):
+        queryset = GenerationJob.objects.filter(user=self.request.user).select_related('topic').order_by('-created_at')
+        
+        # Allow polling a batch of jobs in one request: ?ids=1,2,3
+        ids = self.request.query_params.get('ids')
+        if ids:
+            queryset = queryset.filter(id__in=[job_id for job_id in ids.split(',') if job_id.isdigit()])
+        
+        return queryset
+
+
+class GenerationJobDetailView(generics.RetrieveAPIView):
+    """Get the status of a note generation job."""
+    
+    serializer_class = GenerationJobSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return GenerationJob.objects.filter(user=self.request.user).select_related('topic')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def ai_service_status(request):
@@ -49,21 +80,41 @@ def ai_service_status(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def ai_service_stats(request):
-    """Get AI service statistics for the current user."""
+    """
+    Get AI service statistics for the current user.
+    
+    Served from the hourly and daily usage rollups, so the cost doesn't grow
+    with the log history. ?days=N limits the stats to the last N days and
+    ?hours=N to the last N hours.
+    """
+    
+    try:
+        days = int(request.query_params.get('days') or 0)
+        hours = int(request.query_params.get('hours') or 0)
+    except ValueError:
+        return Response({'error': 'days and hours must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if days < 0 or hours < 0:
+        return Response({'error': 'days and hours must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(usage_stats(request.user, days=days, hours=hours), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ai_service_stats_breakdown(request):
+    """Latency, token usage and cost of API calls per template and max word count."""
     
-    logs = AIServiceLog.objects.filter(user=request.user)
+    # Only calls that reached the API; cache hits and coalesced requests cost nothing
+    logs = AIServiceLog.objects.filter(user=request.user, cache_hit=False, coalesced=False)
     
-    stats = {
-        'total_requests': logs.count(),
-        'successful_requests': logs.filter(status='success').count(),
-        'failed_requests': logs.filter(status='failed').count(),
-        'average_response_time': logs.filter(status='success').aggregate(
-            avg_time=models.Avg('response_time_seconds')
-        )['avg_time'] or 0,
-        'total_tokens_used': logs.filter(status='success').count(),  # Simplified
-        'model_usage': {
-            'gemini-pro': logs.filter(model_used='gemini-pro').count(),
-        }
-    }
+    breakdown = logs.values('template', 'template__name', 'max_word_count').annotate(
+        requests=models.Count('id'),
+        failed_requests=models.Count('id', filter=models.Q(status='failed')),
+        average_response_time=models.Avg('response_time_seconds', filter=models.Q(status='success')),
+        average_total_tokens=models.Avg('total_tokens'),
+        total_tokens=models.Sum('total_tokens'),
+        estimated_cost=models.Sum('estimated_cost'),
+    ).order_by(models.F('estimated_cost').desc(nulls_last=True), '-requests')
     
-    return Response(stats, status=status.HTTP_200_OK)
+    return Response(list(breakdown), status=status.HTTP_200_OK)
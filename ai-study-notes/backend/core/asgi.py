@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Build the shared LLM client before the first request arrives
+from django.conf import settings  # noqa: E402
+from ai_service import providers  # noqa: E402
+from ai_service.health import health_monitor  # noqa: E402
+
+if settings.GEMINI_WARM_UP_ON_BOOT:
+    providers.warm_up()
+
+# Start probing upstream health so status checks never call the API themselves
+health_monitor.ensure_started()
@@ -0,0 +1,219 @@
+"""
+In-process timing metrics.
+
+timing() records how long a stage took, both into a histogram and, during a
+request, into that request's timings, which ServerTimingMiddleware sends as
+a Server-Timing header. Work handed to a thread pool with submit() keeps
+adding to the timings of the request that submitted it. The histograms are served in the Prometheus text
+format by metrics_view, or by serve() for processes without a web server.
+Every process keeps its own histograms, so each process must be scraped.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from django.conf import settings
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+
+        for key, counts, total in series:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", _format_number(bound))])} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {repr(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """The histograms of this process."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, documentation, label_names, buckets)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    'app_stage_duration_seconds', 'Time spent in an instrumented stage.', ['stage']
+)
+request_duration = registry.histogram(
+    'app_http_request_duration_seconds', 'Time to produce an HTTP response.', ['view', 'method', 'status']
+)
+request_db_queries = registry.histogram(
+    'app_http_request_db_queries', 'Database queries per HTTP request.', ['view'], COUNT_BUCKETS
+)
+request_db_duration = registry.histogram(
+    'app_http_request_db_duration_seconds', 'Database time per HTTP request.', ['view']
+)
+
+
+class RequestTimings:
+    """Stage and database timings of one request."""
+
+    __slots__ = ('stages', 'db_queries', 'db_seconds', '_lock')
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        # A stage that runs more than once, or on several pool threads at once, is reported as its total
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook that counts and times queries."""
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.db_queries += 1
+
+    def server_timing(self, total: float) -> str:
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in stages]
+        entries.append(f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_queries} queries"')
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    'current_timings', default=None
+)
+
+
+@contextmanager
+def timing(stage: str):
+    """Time a block as a stage. Outside a request only the histogram is updated."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=stage)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+def submit(executor: Executor, func: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    Submit a call to a thread pool in a copy of the current context.
+
+    Pool threads start with an empty context, so without this the stages
+    timed there would be missing from the request's Server-Timing header.
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def metrics_view(request):
+    """Serve the histograms of this process in the Prometheus text format."""
+
+    if not settings.DEBUG:
+        # Timings reveal how the service behaves; require the scrape token outside development
+        token = settings.METRICS_AUTH_TOKEN
+        if not token or request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        token = settings.METRICS_AUTH_TOKEN
+        if token and self.headers.get('Authorization') != f'Bearer {token}':
+            self.send_error(403)
+            return
+
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the output
+
+
+def serve(port: int, address: str = '') -> ThreadingHTTPServer:
+    """Serve the histograms on a port from a daemon thread, for processes without a web server."""
+
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
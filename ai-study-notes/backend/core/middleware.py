@@ -0,0 +1,42 @@
+import time
+from django.conf import settings
+from django.db import connection
+from .metrics import (
+    RequestTimings, current_timings, request_db_duration, request_db_queries, request_duration,
+)
+
+
+class ServerTimingMiddleware:
+    """
+    Time each request, its database queries and its instrumented stages.
+
+    The results go into the request histograms and, with SERVER_TIMING_ENABLED,
+    a Server-Timing header. Queries made by other threads and by streaming
+    responses after they are returned are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings.db_wrapper):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total = time.perf_counter() - start
+
+        # The URL name keeps the label set small; unmatched paths share one label
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+
+        request_duration.observe(total, view=view, method=request.method, status=response.status_code)
+        request_db_queries.observe(timings.db_queries, view=view)
+        request_db_duration.observe(timings.db_seconds, view=view)
+
+        if settings.SERVER_TIMING_ENABLED:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
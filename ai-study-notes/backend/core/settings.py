@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -158,6 +159,114 @@ AUTHENTICATION_BACKENDS = [
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
 GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-pro')
 print('DEBUG: GEMINI_MODEL =', GEMINI_MODEL)
+GEMINI_WARM_UP_ON_BOOT = config('GEMINI_WARM_UP_ON_BOOT', default=True, cast=bool)
+
+# Background note generation worker settings
+GENERATION_WORKER_POLL_INTERVAL = config('GENERATION_WORKER_POLL_INTERVAL', default=1.0, cast=float)
+GENERATION_WORKER_CONCURRENCY = config('GENERATION_WORKER_CONCURRENCY', default=4, cast=int)
+GENERATION_WORKER_METRICS_PORT = config('GENERATION_WORKER_METRICS_PORT', default=0, cast=int)  # 0 disables
+GENERATION_BATCH_MAX_TOPICS = config('GENERATION_BATCH_MAX_TOPICS', default=100, cast=int)
+# Workers bump their running jobs every GENERATION_JOB_HEARTBEAT_SECONDS; jobs without a
+# heartbeat for GENERATION_JOB_STALE_SECONDS are requeued, or failed after GENERATION_JOB_MAX_ATTEMPTS
+GENERATION_JOB_HEARTBEAT_SECONDS = config('GENERATION_JOB_HEARTBEAT_SECONDS', default=30.0, cast=float)
+GENERATION_JOB_STALE_SECONDS = config('GENERATION_JOB_STALE_SECONDS', default=120, cast=int)
+GENERATION_JOB_MAX_ATTEMPTS = config('GENERATION_JOB_MAX_ATTEMPTS', default=3, cast=int)
+
+# AI response cache settings
+AI_RESPONSE_CACHE_ENABLED = config('AI_RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+AI_RESPONSE_CACHE_TTL = config('AI_RESPONSE_CACHE_TTL', default=7 * 24 * 60 * 60, cast=int)  # Seconds
+AI_RESPONSE_CACHE_MAX_ENTRIES = config('AI_RESPONSE_CACHE_MAX_ENTRIES', default=10000, cast=int)
+AI_RESPONSE_CACHE_LOCAL_ENTRIES = config('AI_RESPONSE_CACHE_LOCAL_ENTRIES', default=256, cast=int)
+AI_RESPONSE_CACHE_EVICT_INTERVAL = config('AI_RESPONSE_CACHE_EVICT_INTERVAL', default=60, cast=float)  # Seconds between trims
+
+# Coalescing of concurrent identical generation requests
+AI_COALESCE_LEASE_SECONDS = config('AI_COALESCE_LEASE_SECONDS', default=120, cast=int)
+AI_COALESCE_WAIT_SECONDS = config('AI_COALESCE_WAIT_SECONDS', default=90, cast=int)
+AI_COALESCE_POLL_INTERVAL = config('AI_COALESCE_POLL_INTERVAL', default=0.5, cast=float)
+
+# Gemini rate limiting (requests per minute; 0 disables a budget)
+AI_RATE_LIMIT_GLOBAL_PER_MINUTE = config('AI_RATE_LIMIT_GLOBAL_PER_MINUTE', default=60, cast=float)
+AI_RATE_LIMIT_GLOBAL_BURST = config('AI_RATE_LIMIT_GLOBAL_BURST', default=10, cast=float)
+AI_RATE_LIMIT_USER_PER_MINUTE = config('AI_RATE_LIMIT_USER_PER_MINUTE', default=10, cast=float)
+AI_RATE_LIMIT_USER_BURST = config('AI_RATE_LIMIT_USER_BURST', default=3, cast=float)
+AI_RATE_LIMIT_MAX_WAIT = config('AI_RATE_LIMIT_MAX_WAIT', default=30, cast=float)  # Seconds
+
+# Circuit breaker and retries for transient Gemini errors
+AI_CIRCUIT_FAILURE_THRESHOLD = config('AI_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+AI_CIRCUIT_RECOVERY_SECONDS = config('AI_CIRCUIT_RECOVERY_SECONDS', default=30, cast=float)
+AI_MAX_RETRIES = config('AI_MAX_RETRIES', default=3, cast=int)
+AI_RETRY_BASE_DELAY = config('AI_RETRY_BASE_DELAY', default=1.0, cast=float)
+AI_RETRY_MAX_DELAY = config('AI_RETRY_MAX_DELAY', default=20.0, cast=float)
+
+# Gemini pricing used to estimate the cost of each call (USD per million tokens)
+AI_PRICE_PER_MILLION_INPUT_TOKENS = config('AI_PRICE_PER_MILLION_INPUT_TOKENS', default=0.5, cast=float)
+AI_PRICE_PER_MILLION_OUTPUT_TOKENS = config('AI_PRICE_PER_MILLION_OUTPUT_TOKENS', default=1.5, cast=float)
+
+# Seconds a compiled prompt template is reused before re-reading it (changes
+# made in this process invalidate it immediately)
+PROMPT_TEMPLATE_CACHE_TTL = config('PROMPT_TEMPLATE_CACHE_TTL', default=300, cast=int)
+
+# LLM backend: 'gemini', or 'fake' for load tests without calling an API
+AI_PROVIDER = config('AI_PROVIDER', default='gemini')
+AI_FAKE_LATENCY = config('AI_FAKE_LATENCY', default='lognormal')  # fixed, uniform or lognormal
+AI_FAKE_LATENCY_MEDIAN = config('AI_FAKE_LATENCY_MEDIAN', default=2.0, cast=float)  # Seconds
+AI_FAKE_LATENCY_SIGMA = config('AI_FAKE_LATENCY_SIGMA', default=0.5, cast=float)  # Lognormal spread
+AI_FAKE_ERROR_RATE = config('AI_FAKE_ERROR_RATE', default=0.0, cast=float)
+AI_FAKE_RESPONSE_WORDS = config('AI_FAKE_RESPONSE_WORDS', default=800, cast=int)
+AI_FAKE_SEED = config('AI_FAKE_SEED', default=0, cast=int)
+
+# Background health probe of the Gemini API (0 disables the prober)
+AI_HEALTH_PROBE_INTERVAL = config('AI_HEALTH_PROBE_INTERVAL', default=30, cast=float)  # Seconds
+AI_HEALTH_WINDOW_SECONDS = config('AI_HEALTH_WINDOW_SECONDS', default=300, cast=int)
+AI_HEALTH_DEGRADED_ERROR_RATE = config('AI_HEALTH_DEGRADED_ERROR_RATE', default=0.2, cast=float)
+
+# Hedged Gemini requests: send a backup call when the first one is slow
+AI_HEDGING_ENABLED = config('AI_HEDGING_ENABLED', default=False, cast=bool)
+AI_HEDGE_DELAY_PERCENTILE = config('AI_HEDGE_DELAY_PERCENTILE', default=95, cast=float)
+AI_HEDGE_INITIAL_DELAY = config('AI_HEDGE_INITIAL_DELAY', default=30.0, cast=float)  # Until enough latencies are seen
+AI_HEDGE_MIN_DELAY = config('AI_HEDGE_MIN_DELAY', default=2.0, cast=float)
+AI_HEDGE_MAX_RATIO = config('AI_HEDGE_MAX_RATIO', default=0.1, cast=float)  # Hedges per primary call, capped at 1.0
+AI_HEDGE_POOL_SIZE = config('AI_HEDGE_POOL_SIZE', default=16, cast=int)
+
+# Model routing: models tried in order of preference, with fallback (empty: the provider's default model)
+AI_MODEL_POOL = config('AI_MODEL_POOL', default='').split(',')
+AI_GENERATION_DEADLINE_SECONDS = config('AI_GENERATION_DEADLINE_SECONDS', default=60.0, cast=float)
+AI_ROUTER_WINDOW_MINUTES = config('AI_ROUTER_WINDOW_MINUTES', default=30, cast=int)  # Log history used per model
+AI_ROUTER_STATS_TTL = config('AI_ROUTER_STATS_TTL', default=30, cast=float)  # Seconds between log queries
+AI_ROUTER_MAX_ERROR_RATE = config('AI_ROUTER_MAX_ERROR_RATE', default=0.3, cast=float)
+AI_ROUTER_SMALL_REQUEST_WORDS = config('AI_ROUTER_SMALL_REQUEST_WORDS', default=500, cast=int)
+AI_ROUTER_FALLBACK_MARGIN = config('AI_ROUTER_FALLBACK_MARGIN', default=1.5, cast=float)
+AI_ROUTER_POOL_SIZE = config('AI_ROUTER_POOL_SIZE', default=16, cast=int)
+
+# Long notes are generated as an outline, then sections in parallel (0 disables)
+AI_SECTIONED_MIN_WORDS = config('AI_SECTIONED_MIN_WORDS', default=3000, cast=int)
+AI_SECTION_WORDS = config('AI_SECTION_WORDS', default=600, cast=int)  # Target length of one section
+AI_SECTION_MAX_SECTIONS = config('AI_SECTION_MAX_SECTIONS', default=8, cast=int)
+AI_SECTION_CONCURRENCY = config('AI_SECTION_CONCURRENCY', default=4, cast=int)  # Sections in flight per note
+AI_SECTION_POOL_SIZE = config('AI_SECTION_POOL_SIZE', default=16, cast=int)
+
+# Reuse of existing notes for near-duplicate topics of any user
+NOTE_REUSE_MIN_SIMILARITY = config('NOTE_REUSE_MIN_SIMILARITY', default=0.8, cast=float)  # Estimated Jaccard
+NOTE_REUSE_MIN_RATING = config('NOTE_REUSE_MIN_RATING', default=4, cast=int)  # Owner's rating; 0 allows unrated
+NOTE_REUSE_MAX_CANDIDATES = config('NOTE_REUSE_MAX_CANDIDATES', default=200, cast=int)  # Compared per lookup
+NOTE_REUSE_MAX_RESULTS = config('NOTE_REUSE_MAX_RESULTS', default=5, cast=int)
+
+# Note views are counted in memory and written at most this many seconds later; 0 writes each view at once
+NOTE_VIEW_FLUSH_INTERVAL = config('NOTE_VIEW_FLUSH_INTERVAL', default=10.0, cast=float)
+
+# Recent topics and notes returned by the dashboard endpoint
+DASHBOARD_RECENT_ITEMS = config('DASHBOARD_RECENT_ITEMS', default=5, cast=int)
+
+# AI service logs are saved in batches from a background thread
+AI_LOG_ASYNC = config('AI_LOG_ASYNC', default=True, cast=bool)
+AI_LOG_FLUSH_BATCH_SIZE = config('AI_LOG_FLUSH_BATCH_SIZE', default=100, cast=int)
+AI_LOG_FLUSH_INTERVAL = config('AI_LOG_FLUSH_INTERVAL', default=1.0, cast=float)  # Seconds
+AI_LOG_BUFFER_MAX_SIZE = config('AI_LOG_BUFFER_MAX_SIZE', default=10000, cast=int)  # Rows beyond this are dropped
+AI_LOG_COMPRESSION_LEVEL = config('AI_LOG_COMPRESSION_LEVEL', default=6, cast=int)  # zlib level for stored responses
+
+# Request and stage timings
+SERVER_TIMING_ENABLED = config('SERVER_TIMING_ENABLED', default=True, cast=bool)  # Send Server-Timing headers
+METRICS_AUTH_TOKEN = config('METRICS_AUTH_TOKEN', default='')  # Bearer token for /metrics; required unless DEBUG
 
 # Logging configuration
 LOGGING = {
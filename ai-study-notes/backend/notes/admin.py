@@ -30,6 +30,7 @@ class StudyNoteAdmin(admin.ModelAdmin):
     list_filter = ['ai_model_used', 'created_at']
     search_fields = ['topic__title', 'content', 'summary']
     ordering = ['-created_at']
+    raw_id_fields = ['cloned_from']
     readonly_fields = ['created_at', 'updated_at']
 
 
@@ -0,0 +1,114 @@
+import logging
+from typing import Dict, Optional, Tuple
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from .models import StudyTopic, TopicCounter
+
+logger = logging.getLogger(__name__)
+
+STATUSES = [value for value, _ in StudyTopic.STATUS_CHOICES]
+DIFFICULTIES = [value for value, _ in StudyTopic.DIFFICULTY_CHOICES]
+COUNTER_FIELDS = ['total', *STATUSES, *DIFFICULTIES]
+
+
+def count_aggregates() -> Dict:
+    """Conditional aggregates that compute every counter field in one query."""
+
+    aggregates = {'total': Count('id')}
+    aggregates.update({value: Count('id', filter=Q(status=value)) for value in STATUSES})
+    aggregates.update({value: Count('id', filter=Q(difficulty=value)) for value in DIFFICULTIES})
+    return aggregates
+
+
+def count_topics(user_id: int) -> Dict[str, int]:
+    return StudyTopic.objects.filter(user_id=user_id).aggregate(**count_aggregates())
+
+
+def topic_counts(user) -> Dict[str, int]:
+    """
+    The user's topic counts, read from their counter row.
+
+    A user without one yet gets it from a single aggregate query, and the
+    row is created for the next read.
+    """
+    counts = TopicCounter.objects.filter(user=user).values(*COUNTER_FIELDS).first()
+    if counts is not None:
+        return counts
+
+    counts = count_topics(user.pk)
+    try:
+        with transaction.atomic():
+            TopicCounter.objects.create(user=user, **counts)
+    except IntegrityError:
+        pass  # Created by a concurrent request or topic save
+    return counts
+
+
+def _apply(user_id: int, deltas: Dict[str, int]):
+    # Values outside the choices have no counter; reconciliation ignores them too
+    deltas = {field: delta for field, delta in deltas.items() if delta and field in COUNTER_FIELDS}
+    if not deltas:
+        return
+
+    updated = TopicCounter.objects.filter(user_id=user_id).update(
+        updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    if updated:
+        return
+
+    # No row yet: count from scratch, which already includes this change
+    try:
+        with transaction.atomic():
+            TopicCounter.objects.create(user_id=user_id, **count_topics(user_id))
+    except IntegrityError:
+        # Another transaction created it first, without this change
+        TopicCounter.objects.filter(user_id=user_id).update(
+            updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+
+
+def _deltas(old: Optional[Tuple[str, str]], new: Optional[Tuple[str, str]]) -> Dict[str, int]:
+    deltas: Dict[str, int] = {}
+    for values, sign in ((old, -1), (new, 1)):
+        if values is None:
+            continue
+        deltas['total'] = deltas.get('total', 0) + sign
+        for value in values:
+            deltas[value] = deltas.get(value, 0) + sign
+    return deltas
+
+
+def _topic_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {'status', 'difficulty'}:
+        return
+
+    new = (instance.status, instance.difficulty)
+    old = None if created else getattr(instance, '_counted', None)
+    if not created and (old is None or None in old):
+        # Unknown previous values; reconcile_topic_counters will catch any drift
+        instance._counted = new
+        return
+
+    if old != new:
+        _apply(instance.user_id, _deltas(old, new))
+    instance._counted = new
+
+
+def _topic_deleted(sender, instance, **kwargs):
+    # Count what was stored, not unsaved changes to the instance
+    stored = getattr(instance, '_counted', None)
+    if stored is None or None in stored:
+        stored = (instance.status, instance.difficulty)
+    deltas = {field: delta for field, delta in _deltas(stored, None).items() if field in COUNTER_FIELDS}
+    TopicCounter.objects.filter(user_id=instance.user_id).update(
+        updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def connect_signals():
+    """Keep topic counters current as topics change. Called from AppConfig.ready()."""
+
+    post_save.connect(_topic_saved, sender=StudyTopic, dispatch_uid='topic_counter_save')
+    post_delete.connect(_topic_deleted, sender=StudyTopic, dispatch_uid='topic_counter_delete')
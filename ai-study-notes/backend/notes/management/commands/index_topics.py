@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from notes.models import StudyTopic
+from notes.similarity import index_topic
+
+
+class Command(BaseCommand):
+    help = 'Build or refresh the similarity fingerprints of existing topics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        count = 0
+
+        # Saved topics are indexed by a signal; this covers older and bulk-created ones
+        topics = StudyTopic.objects.order_by('id').iterator(chunk_size=options['batch_size'])
+        for topic in topics:
+            index_topic(topic)
+            count += 1
+            if count % options['batch_size'] == 0:
+                self.stdout.write(f'Indexed {count} topics')
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} topics in {time.monotonic() - start:.1f}s'))
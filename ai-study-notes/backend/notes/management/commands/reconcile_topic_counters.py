@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from notes.counters import COUNTER_FIELDS, count_aggregates, count_topics
+from notes.models import StudyTopic, TopicCounter
+
+
+class Command(BaseCommand):
+    help = 'Recount the topic counters from the topics and fix any that drifted. Meant to run periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted counters without fixing them.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+
+        # One grouped query for every user, compared with one read of the counters
+        actual = {
+            row.pop('user'): row
+            for row in StudyTopic.objects.order_by().values('user').annotate(**count_aggregates())
+        }
+        stored = {row.pop('user'): row for row in TopicCounter.objects.values('user', *COUNTER_FIELDS)}
+        empty = dict.fromkeys(COUNTER_FIELDS, 0)
+
+        # Users without a counter get one from their topics on their next analytics read
+        drifted = [user_id for user_id, counts in stored.items() if counts != actual.get(user_id, empty)]
+        for user_id in drifted:
+            self.stdout.write(f'User {user_id}: {stored[user_id]} -> {actual.get(user_id, empty)}')
+            if options['dry_run']:
+                continue
+
+            # Lock the row and recount, so topic changes made meanwhile are neither lost nor counted twice
+            with transaction.atomic():
+                counter = TopicCounter.objects.select_for_update().filter(user_id=user_id).first()
+                if counter is None:
+                    continue
+                for field, value in count_topics(user_id).items():
+                    setattr(counter, field, value)
+                counter.save()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Found" if options["dry_run"] else "Fixed"} {len(drifted)} drifted of {len(stored)} topic counters '
+            f'in {time.monotonic() - start:.1f}s'
+        ))
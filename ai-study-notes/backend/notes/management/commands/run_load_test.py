@@ -0,0 +1,268 @@
+import itertools
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import uuid
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from notes.models import StudyTopic, StudyNote
+
+
+class LoadUser:
+    """A seeded user with its token and the ids its requests pick from."""
+
+    def __init__(self, token):
+        self.user = token.user
+        self.authorization = f'Token {token.key}'
+        self.topic_ids = list(StudyTopic.objects.filter(user=self.user).values_list('id', flat=True))
+        self.note_ids = list(StudyNote.objects.filter(topic__user=self.user).values_list('id', flat=True))
+
+
+def _new_topic(user):
+    # Generation needs a topic without a note; a unique title also avoids response cache hits
+    topic = StudyTopic.objects.create(
+        user=user.user,
+        title=f'Load test topic {uuid.uuid4().hex[:12]}',
+        description='Generated by run_load_test.',
+    )
+    return topic.pk
+
+
+# name -> (method, function returning the path for a user)
+ENDPOINTS = {
+    'topic_list': ('GET', lambda user, rng: '/api/notes/topics/'),
+    'note_list': ('GET', lambda user, rng: '/api/notes/notes/'),
+    'note_detail': ('GET', lambda user, rng: f'/api/notes/notes/{rng.choice(user.note_ids)}/'),
+    'topic_analytics': ('GET', lambda user, rng: '/api/notes/topics/analytics/'),
+    'ai_stats': ('GET', lambda user, rng: '/api/ai/stats/'),
+    'ai_stats_breakdown': ('GET', lambda user, rng: '/api/ai/stats/breakdown/'),
+    'generate_enqueue': ('POST', lambda user, rng: f'/api/notes/topics/{_new_topic(user)}/generate/'),
+    'generate_stream': ('POST', lambda user, rng: f'/api/notes/topics/{_new_topic(user)}/generate/stream/'),
+}
+
+# Endpoints that call the LLM synchronously are slow, so they get fewer requests by default
+SLOW_ENDPOINTS = {'generate_stream'}
+
+
+def _percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Drive the API endpoints in-process under concurrency and report latency, throughput and queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--endpoints',
+            default=','.join(ENDPOINTS),
+            help=f'Comma-separated endpoints to test. Available: {", ".join(ENDPOINTS)}',
+        )
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--slow-requests', type=int, default=40, help='Requests for LLM-backed endpoints.')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per endpoint.')
+        parser.add_argument('--prefix', default='loadtest', help='Email prefix of the seeded users.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--provider', default='fake', help='AI_PROVIDER to use during the run.')
+        parser.add_argument('--fake-latency-median', type=float, help='Override AI_FAKE_LATENCY_MEDIAN.')
+        parser.add_argument(
+            '--keep-rate-limits',
+            action='store_true',
+            help='Keep AI rate limits; by default they are disabled so the run measures the stack, not the quota.',
+        )
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--compare', help='Compare with a previous JSON results file.')
+        parser.add_argument(
+            '--fail-threshold',
+            type=float,
+            help='With --compare, fail if p95 latency or queries per request grow by more than this percent.',
+        )
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f'Unknown endpoint(s): {", ".join(unknown)}')
+
+        tokens = Token.objects.filter(user__email__startswith=f'{options["prefix"]}-').select_related('user')
+        users = [LoadUser(token) for token in tokens]
+        if not users:
+            raise CommandError('No seeded users found; run "python manage.py seed_load_data" first')
+        if 'note_detail' in names and not any(user.note_ids for user in users):
+            raise CommandError('The seeded users have no notes for note_detail')
+        users = [user for user in users if user.note_ids] if 'note_detail' in names else users
+
+        self._configure(options)
+
+        results = {}
+        for name in names:
+            count = options['slow_requests'] if name in SLOW_ENDPOINTS else options['requests']
+            results[name] = self._run_endpoint(name, users, count, options)
+            self._print_result(name, results[name])
+
+        report = {'meta': self._meta(options, users), 'results': results}
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+        if options['compare']:
+            self._compare(options['compare'], results, options['fail_threshold'])
+
+    def _configure(self, options):
+        # The test client's host must be allowed
+        if '*' not in settings.ALLOWED_HOSTS and 'testserver' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        settings.AI_PROVIDER = options['provider']
+        if options['fake_latency_median'] is not None:
+            settings.AI_FAKE_LATENCY_MEDIAN = options['fake_latency_median']
+        if not options['keep_rate_limits']:
+            settings.AI_RATE_LIMIT_GLOBAL_PER_MINUTE = 0
+            settings.AI_RATE_LIMIT_USER_PER_MINUTE = 0
+
+    def _run_endpoint(self, name, users, count, options):
+        method, make_path = ENDPOINTS[name]
+        samples = []
+        samples_lock = threading.Lock()
+        counter = itertools.count()
+
+        def request(client, rng, index):
+            user = users[index % len(users)]
+            path = make_path(user, rng)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.generic(method, path, HTTP_AUTHORIZATION=user.authorization)
+                ok = response.status_code < 400
+                if response.streaming:
+                    # Stream errors arrive as an event in a 200 response
+                    ok = ok and b'event: error' not in b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            query_time = sum(float(query['time']) for query in queries.captured_queries)
+            return elapsed, ok, len(queries), query_time
+
+        def worker(worker_index):
+            rng = random.Random(options['seed'] * 1000 + worker_index)
+            client = Client()
+            try:
+                while True:
+                    index = next(counter)
+                    if index >= count:
+                        break
+                    sample = request(client, rng, index)
+                    with samples_lock:
+                        samples.append(sample)
+            finally:
+                connection.close()
+
+        warmup_client = Client()
+        warmup_rng = random.Random(options['seed'])
+        for index in range(options['warmup']):
+            request(warmup_client, warmup_rng, index)
+
+        threads = [
+            threading.Thread(target=worker, args=(i,), name=f'load-{name}-{i}')
+            for i in range(max(1, options['concurrency']))
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        query_counts = [sample[2] for sample in samples]
+        errors = sum(1 for sample in samples if not sample[1])
+
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+            'duration_seconds': round(duration, 3),
+            'throughput_rps': round(len(samples) / duration, 2) if duration else 0.0,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                'p50': round(_percentile(latencies, 50), 2),
+                'p95': round(_percentile(latencies, 95), 2),
+                'p99': round(_percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2) if latencies else 0.0,
+            },
+            'queries': {
+                'mean': round(sum(query_counts) / len(query_counts), 2) if query_counts else 0.0,
+                'max': max(query_counts) if query_counts else 0,
+                'mean_time_ms': round(sum(sample[3] for sample in samples) * 1000 / len(samples), 2) if samples else 0.0,
+            },
+        }
+
+    def _print_result(self, name, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f'{name:>20}: {result["requests"]:5d} req  {result["throughput_rps"]:8.1f} req/s  '
+            f'p50 {latency["p50"]:8.1f} ms  p95 {latency["p95"]:8.1f} ms  p99 {latency["p99"]:8.1f} ms  '
+            f'queries {result["queries"]["mean"]:5.1f} (max {result["queries"]["max"]})  '
+            f'errors {result["errors"]}'
+        )
+
+    def _meta(self, options, users):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            commit = ''
+
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'commit': commit,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'slow_requests': options['slow_requests'],
+            'seed': options['seed'],
+            'users': len(users),
+            'provider': settings.AI_PROVIDER,
+            'fake_latency_median': settings.AI_FAKE_LATENCY_MEDIAN,
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        }
+
+    def _compare(self, path, results, threshold):
+        with open(path) as f:
+            baseline = json.load(f)['results']
+
+        self.stdout.write(f'Compared with {path}:')
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+
+            changes = {
+                'p95': (before['latency_ms']['p95'], result['latency_ms']['p95']),
+                'throughput': (before['throughput_rps'], result['throughput_rps']),
+                'queries': (before['queries']['mean'], result['queries']['mean']),
+            }
+            deltas = {key: (new - old) * 100 / old if old else 0.0 for key, (old, new) in changes.items()}
+            self.stdout.write(
+                f'{name:>20}: p95 {deltas["p95"]:+7.1f}%  throughput {deltas["throughput"]:+7.1f}%  '
+                f'queries {changes["queries"][0]:.1f} -> {changes["queries"][1]:.1f}'
+            )
+
+            if threshold is not None and (deltas['p95'] > threshold or deltas['queries'] > threshold):
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError(f'Regression beyond {threshold}% in: {", ".join(regressions)}')
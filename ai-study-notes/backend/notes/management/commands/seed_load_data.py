@@ -0,0 +1,169 @@
+import random
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from ai_service.models import AIServiceLog
+from ai_service.parsing import parse_response
+from ai_service.providers import FakeProvider
+from ai_service.rollups import record_usage
+from ai_service.services import estimate_cost
+from notes.models import Subject, StudyTopic, StudyNote, NoteAnalytics, UserPreference
+
+User = get_user_model()
+
+SUBJECTS = [
+    ('Biology', '#28a745'), ('Chemistry', '#17a2b8'), ('Physics', '#007bff'), ('Mathematics', '#6f42c1'),
+    ('History', '#fd7e14'), ('Economics', '#ffc107'), ('Computer Science', '#20c997'), ('Literature', '#e83e8c'),
+]
+
+TOPIC_WORDS = [
+    'Photosynthesis', 'Cell Division', 'Thermodynamics', 'Quantum States', 'Linear Algebra', 'Probability',
+    'The French Revolution', 'Supply and Demand', 'Graph Algorithms', 'Databases', 'Poetry Forms', 'Genetics',
+    'Organic Reactions', 'Electromagnetism', 'Calculus', 'The Cold War', 'Market Structures', 'Operating Systems',
+]
+
+STYLES = ['academic', 'casual', 'technical', 'simple', 'detailed']
+
+
+class Command(BaseCommand):
+    help = 'Seed users, topics, notes and AI logs at realistic volumes for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--topics-per-user', type=int, default=50)
+        parser.add_argument('--notes-ratio', type=float, default=0.8, help='Share of topics that have a note.')
+        parser.add_argument('--logs-per-note', type=int, default=2, help='AI service log rows per note.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='loadtest', help='Seeded users are <prefix>-<n>@example.com.')
+        parser.add_argument('--reset', action='store_true', help='Delete previously seeded users first.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        start = time.monotonic()
+
+        if options['reset']:
+            deleted, _ = User.objects.filter(email__startswith=f'{prefix}-').delete()
+            self.stdout.write(f'Deleted {deleted} rows from the previous seed')
+
+        if User.objects.filter(email__startswith=f'{prefix}-').exists():
+            self.stdout.write(self.style.WARNING(f'Users with prefix "{prefix}" already exist; use --reset to reseed'))
+            return
+
+        with transaction.atomic():
+            subjects = [
+                Subject.objects.get_or_create(name=name, defaults={'color': color})[0]
+                for name, color in SUBJECTS
+            ]
+            users = self._create_users(options['users'], prefix)
+            topics = self._create_topics(users, subjects, options['topics_per_user'], rng)
+            notes = self._create_notes(topics, options['notes_ratio'], rng)
+            logs = self._create_logs(notes, options['logs_per_note'], rng)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users, {len(topics)} topics, {len(notes)} notes and {logs} AI logs '
+            f'in {time.monotonic() - start:.1f}s'
+        ))
+
+    def _create_users(self, count, prefix):
+        # Hash once; every seeded user shares the password "loadtest"
+        password = make_password('loadtest')
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}@example.com', email=f'{prefix}-{i}@example.com', password=password)
+            for i in range(count)
+        ])
+        users = list(User.objects.filter(email__startswith=f'{prefix}-').order_by('id'))
+
+        Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+        UserPreference.objects.bulk_create([
+            UserPreference(user=user, preferred_style=STYLES[i % len(STYLES)], max_word_count=[500, 1000, 2000][i % 3])
+            for i, user in enumerate(users)
+        ])
+        return users
+
+    def _create_topics(self, users, subjects, per_user, rng):
+        statuses = ['completed'] * 7 + ['pending', 'failed', 'processing']
+        topics = []
+        for user in users:
+            for i in range(per_user):
+                title = f'{rng.choice(TOPIC_WORDS)} {i + 1}'
+                topics.append(StudyTopic(
+                    user=user,
+                    title=title,
+                    description=f'Study notes on {title.lower()} for revision.',
+                    subject=rng.choice(subjects + [None]),
+                    difficulty=rng.choice(['beginner', 'intermediate', 'advanced']),
+                    status=rng.choice(statuses),
+                    tags=rng.sample(['exam', 'revision', 'lecture', 'lab', 'reading'], 2),
+                ))
+        StudyTopic.objects.bulk_create(topics, batch_size=1000)
+        return list(StudyTopic.objects.filter(user__in=users).order_by('id'))
+
+    def _create_notes(self, topics, ratio, rng):
+        provider = FakeProvider()
+        notes = []
+        for topic in topics:
+            if rng.random() >= ratio:
+                continue
+            parsed = parse_response(provider.response_text(f'{topic.title}\n{topic.pk}'))
+            word_count = len(parsed['content'].split())
+            notes.append(StudyNote(
+                topic=topic,
+                content=parsed['content'],
+                summary=parsed['summary'],
+                key_points=parsed['key_points'],
+                references=parsed['references'],
+                word_count=word_count,
+                reading_time_minutes=max(1, word_count // 200),
+                ai_model_used=provider.model_name,
+                generation_time_seconds=rng.lognormvariate(1, 0.5),
+            ))
+        StudyNote.objects.bulk_create(notes, batch_size=500)
+        notes = list(StudyNote.objects.filter(topic__in=topics).select_related('topic').order_by('id'))
+
+        NoteAnalytics.objects.bulk_create([
+            NoteAnalytics(
+                note=note,
+                views_count=rng.randint(0, 200),
+                shares_count=rng.randint(0, 10),
+                rating=rng.choice([None, 3.0, 4.0, 4.5, 5.0]),
+                last_viewed=timezone.now() - timedelta(hours=rng.randint(0, 24 * 30)),
+            )
+            for note in notes
+        ], batch_size=1000)
+        return notes
+
+    def _create_logs(self, notes, per_note, rng):
+        logs = []
+        for note in notes:
+            for _ in range(per_note):
+                failed = rng.random() < 0.05
+                cache_hit = not failed and rng.random() < 0.2
+                # Only calls that reached the API report token usage
+                prompt_tokens = None if failed or cache_hit else rng.randint(300, 600)
+                candidates_tokens = None if prompt_tokens is None else note.word_count * 4 // 3
+                logs.append(AIServiceLog(
+                    user_id=note.topic.user_id,
+                    topic=note.topic,
+                    prompt=f'Study notes for {note.topic.title}',
+                    response='' if failed else note.content,
+                    status='failed' if failed else 'success',
+                    model_used=note.ai_model_used,
+                    response_time_seconds=0.01 if cache_hit else note.generation_time_seconds,
+                    cache_hit=cache_hit,
+                    max_word_count=1000,
+                    prompt_tokens=prompt_tokens,
+                    candidates_tokens=candidates_tokens,
+                    total_tokens=None if prompt_tokens is None else prompt_tokens + candidates_tokens,
+                    estimated_cost=None if prompt_tokens is None else estimate_cost(prompt_tokens, candidates_tokens),
+                    rolled_up=True,
+                ))
+        AIServiceLog.objects.bulk_create(logs, batch_size=1000)
+        # Stats are served from the rollups, so count the logs as the log writer would
+        record_usage(logs)
+        return len(logs)
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.JSONField(default=list)),
+                ('source_hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='notes.studytopic')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='studynote',
+            name='cloned_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='clones', to='notes.studynote'),
+        ),
+        migrations.CreateModel(
+            name='TopicFingerprintBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('fingerprint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='notes.topicfingerprint')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0003_topicfingerprint_studynote_cloned_from_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('processing', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('beginner', models.IntegerField(default=0)),
+                ('intermediate', models.IntegerField(default=0)),
+                ('advanced', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='topic_counter', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
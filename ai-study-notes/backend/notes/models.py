@@ -47,6 +47,18 @@ class StudyTopic(models.Model):
     def __str__(self):
         return f"{self.title} - {self.user.email}"
     
+    # Fields a TopicFingerprint is computed from
+    FINGERPRINT_FIELDS = ('title', 'description', 'difficulty', 'subject_id')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored status and difficulty, so that saving can move the topic between TopicCounter fields
+        instance._counted = (instance.__dict__.get('status'), instance.__dict__.get('difficulty'))
+        # The stored fingerprinted fields, so that saves which don't change them skip re-indexing
+        instance._indexed = tuple(instance.__dict__.get(field) for field in cls.FINGERPRINT_FIELDS)
+        return instance
+    
     class Meta:
         ordering = ['-created_at']
 
@@ -63,6 +75,8 @@ class StudyNote(models.Model):
     reading_time_minutes = models.PositiveIntegerField(default=0)
     ai_model_used = models.CharField(max_length=50, default='gemini-pro')
     generation_time_seconds = models.FloatField(default=0.0)
+    # Set when the note was copied from a similar topic's note instead of generated
+    cloned_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='clones')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -119,3 +133,49 @@ class UserPreference(models.Model):
     
     def __str__(self):
         return f"Preferences for: {self.user.email}"
+
+
+class TopicFingerprint(models.Model):
+    """MinHash signature of a topic's text, used to find near-duplicate topics."""
+    
+    topic = models.OneToOneField(StudyTopic, on_delete=models.CASCADE, related_name='fingerprint')
+    signature = models.JSONField(default=list)  # MinHash values, empty if the topic has no words
+    source_hash = models.CharField(max_length=64)  # Digest of the indexed fields, to skip unchanged topics
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Fingerprint for: {self.topic_id}"
+
+
+class TopicFingerprintBand(models.Model):
+    """One LSH band of a fingerprint; topics sharing a band key are similarity candidates."""
+    
+    fingerprint = models.ForeignKey(TopicFingerprint, on_delete=models.CASCADE, related_name='bands')
+    key = models.BigIntegerField(db_index=True)
+    
+    def __str__(self):
+        return f"Band {self.key} of {self.fingerprint_id}"
+
+
+class TopicCounter(models.Model):
+    """
+    Per-user topic counts by status and difficulty, for analytics.
+    
+    Kept current by StudyTopic save and delete signals. queryset.update(),
+    bulk_create() and raw SQL bypass them; reconcile_topic_counters repairs
+    any drift.
+    """
+    
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='topic_counter')
+    total = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    processing = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    beginner = models.IntegerField(default=0)
+    intermediate = models.IntegerField(default=0)
+    advanced = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Topic counts for: {self.user_id}"
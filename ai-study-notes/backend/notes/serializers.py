@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Subject, StudyTopic, StudyNote, NoteAnalytics, UserPreference
 
@@ -35,10 +36,10 @@ class StudyNoteSerializer(serializers.ModelSerializer):
         fields = ['id', 'topic', 'topic_title', 'topic_difficulty', 'content', 
                  'summary', 'key_points', 'references', 'word_count', 
                  'reading_time_minutes', 'ai_model_used', 'generation_time_seconds',
-                 'created_at', 'updated_at']
+                 'cloned_from', 'created_at', 'updated_at']
         read_only_fields = ['id', 'word_count', 'reading_time_minutes', 
                            'ai_model_used', 'generation_time_seconds', 
-                           'created_at', 'updated_at']
+                           'cloned_from', 'created_at', 'updated_at']
 
 
 class NoteAnalyticsSerializer(serializers.ModelSerializer):
@@ -81,4 +82,18 @@ class StudyTopicSearchSerializer(serializers.Serializer):
     difficulty = serializers.CharField(required=False)
     status = serializers.CharField(required=False)
     date_from = serializers.DateField(required=False)
-    date_to = serializers.DateField(required=False) 
\ No newline at end of file
+    date_to = serializers.DateField(required=False) 
+
+
+class GenerateNotesBatchSerializer(serializers.Serializer):
+    """Serializer for queueing note generation for several topics."""
+    
+    topic_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+    regenerate = serializers.BooleanField(default=False)
+    
+    def validate_topic_ids(self, value):
+        if len(value) > settings.GENERATION_BATCH_MAX_TOPICS:
+            raise serializers.ValidationError(
+                f'At most {settings.GENERATION_BATCH_MAX_TOPICS} topics can be generated per batch'
+            )
+        return value
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import random
+import re
+from typing import List, Optional, Set, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from .models import StudyTopic, StudyNote, NoteAnalytics, TopicFingerprint, TopicFingerprintBand
+
+logger = logging.getLogger(__name__)
+
+# 64 MinHash values in 16 bands of 4: topics whose text has a Jaccard
+# similarity of 0.5 share a band about 65% of the time, at 0.8 almost always
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures are stored, so the permutations must never change
+_rng = random.Random(1729)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+INDEXED_FIELDS = ('title', 'description', 'difficulty', 'subject')
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def topic_shingles(topic: StudyTopic) -> Set[int]:
+    """Hashed words and word pairs of the topic's title and description."""
+
+    words = WORD_RE.findall(f'{topic.title} {topic.description}'.lower())
+    shingles = set(words)
+    shingles.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return {_stable_hash(shingle) for shingle in shingles}
+
+
+def minhash(shingles: Set[int]) -> List[int]:
+    if not shingles:
+        return []
+    return [min((a * shingle + b) % _PRIME for shingle in shingles) for a, b in _PERMUTATIONS]
+
+
+def band_keys(topic: StudyTopic, signature: List[int]) -> List[int]:
+    """
+    LSH bucket keys for a signature.
+
+    Difficulty and subject are part of every key, so only topics that agree
+    on both can be candidates.
+    """
+    if not signature:
+        return []
+
+    keys = []
+    for band in range(BANDS):
+        rows = ','.join(str(value) for value in signature[band * ROWS:(band + 1) * ROWS])
+        key = _stable_hash(f'{topic.difficulty}|{topic.subject_id}|{band}|{rows}')
+        # Fit the unsigned hash into a signed BigIntegerField
+        keys.append(key - (1 << 63))
+    return keys
+
+
+def similarity(first: List[int], second: List[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+
+    if not first or len(first) != len(second):
+        return 0.0
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+def _source_hash(topic: StudyTopic) -> str:
+    source = '\0'.join([topic.title, topic.description, topic.difficulty, str(topic.subject_id)])
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def index_topic(topic: StudyTopic) -> TopicFingerprint:
+    """Store the topic's fingerprint and band keys; unchanged topics are left alone."""
+
+    source_hash = _source_hash(topic)
+    fingerprint = TopicFingerprint.objects.filter(topic=topic).first()
+    if fingerprint is not None and fingerprint.source_hash == source_hash:
+        return fingerprint
+
+    signature = minhash(topic_shingles(topic))
+    with transaction.atomic():
+        fingerprint, _ = TopicFingerprint.objects.update_or_create(
+            topic=topic, defaults={'signature': signature, 'source_hash': source_hash}
+        )
+        fingerprint.bands.all().delete()
+        TopicFingerprintBand.objects.bulk_create([
+            TopicFingerprintBand(fingerprint=fingerprint, key=key) for key in band_keys(topic, signature)
+        ])
+    return fingerprint
+
+
+def find_similar_notes(topic: StudyTopic, limit: Optional[int] = None) -> List[Tuple[StudyNote, float]]:
+    """
+    Notes of other topics that are near-duplicates of this one, best first.
+
+    A note qualifies when its topic's estimated similarity is at least
+    NOTE_REUSE_MIN_SIMILARITY and, unless NOTE_REUSE_MIN_RATING is 0, its
+    owner rated it at least that. Ties are broken by rating.
+
+    Returns:
+        List of (note, similarity) tuples
+    """
+    fingerprint = index_topic(topic)
+    keys = band_keys(topic, fingerprint.signature)
+    if not keys:
+        return []
+
+    candidates = (
+        TopicFingerprint.objects
+        .filter(bands__key__in=keys, topic__study_note__isnull=False)
+        .exclude(topic=topic)
+        .select_related('topic__study_note__analytics')
+        .distinct()
+    )
+    if settings.NOTE_REUSE_MIN_RATING:
+        candidates = candidates.filter(topic__study_note__analytics__user_rating__gte=settings.NOTE_REUSE_MIN_RATING)
+
+    matches = []
+    for candidate in candidates[:settings.NOTE_REUSE_MAX_CANDIDATES]:
+        score = similarity(fingerprint.signature, candidate.signature)
+        if score >= settings.NOTE_REUSE_MIN_SIMILARITY:
+            matches.append((candidate.topic.study_note, score))
+
+    matches.sort(key=lambda match: (match[1], _rating(match[0]) or 0), reverse=True)
+    return matches[:limit or settings.NOTE_REUSE_MAX_RESULTS]
+
+
+def _rating(note: StudyNote) -> Optional[int]:
+    analytics = getattr(note, 'analytics', None)
+    return analytics.user_rating if analytics else None
+
+
+def describe_match(note: StudyNote, score: float) -> dict:
+    """What a user is shown about a reusable note; the other topic and its owner stay private."""
+
+    return {
+        'note_id': note.id,
+        'similarity': round(score, 3),
+        'rating': _rating(note),
+        'summary': note.summary,
+        'word_count': note.word_count,
+        'ai_model_used': note.ai_model_used,
+    }
+
+
+def clone_note(source: StudyNote, topic: StudyTopic) -> StudyNote:
+    """Copy a note to a topic as its study note, replacing any existing note."""
+
+    with transaction.atomic():
+        StudyNote.objects.filter(topic=topic).delete()
+
+        study_note = StudyNote.objects.create(
+            topic=topic,
+            content=source.content,
+            summary=source.summary,
+            key_points=source.key_points,
+            references=source.references,
+            word_count=source.word_count,
+            reading_time_minutes=source.reading_time_minutes,
+            ai_model_used=source.ai_model_used,
+            generation_time_seconds=0.0,
+            cloned_from=source,
+        )
+        NoteAnalytics.objects.create(note=study_note)
+
+        topic.status = 'completed'
+        topic.save()
+
+    return study_note
+
+
+def _index_saved_topic(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {*INDEXED_FIELDS, 'subject_id'}:
+        return
+
+    # Status saves from the worker and stream paths leave the fingerprinted fields alone
+    indexed = tuple(getattr(instance, field) for field in StudyTopic.FINGERPRINT_FIELDS)
+    if not created and getattr(instance, '_indexed', None) == indexed:
+        return
+
+    try:
+        # A savepoint, so that a failure doesn't break the caller's transaction
+        with transaction.atomic():
+            index_topic(instance)
+    except Exception as e:
+        # The index is an optimisation; never fail the save because of it
+        logger.error(f"Failed to index topic {instance.pk}: {str(e)}")
+        return
+    instance._indexed = indexed
+
+
+def connect_signals():
+    """Keep fingerprints current as topics are saved. Called from AppConfig.ready()."""
+
+    post_save.connect(_index_saved_topic, sender=StudyTopic, dispatch_uid='topic_fingerprint_index')
@@ -1,3 +1,344 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from ai_service.models import GenerationJob
+from .counters import COUNTER_FIELDS, count_topics, topic_counts
+from .models import Subject, StudyTopic, StudyNote, NoteAnalytics, UserPreference, TopicCounter
+from .view_counter import ViewCounter
+from .views import _stream_note_events
 
-# Create your tests here.
+User = get_user_model()
+
+PAGE_SIZE = 20
+
+
+class QueryBudgetTests(TestCase):
+    """List and detail endpoints run the same number of queries for one row as for a full page."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.subject = Subject.objects.create(name='Biology')
+        UserPreference.objects.create(user=self.user)
+        self.topics = []
+
+    def add_topics(self, count):
+        for _ in range(count):
+            topic = StudyTopic.objects.create(
+                user=self.user, title=f'Topic {len(self.topics)}', description='d', subject=self.subject
+            )
+            note = StudyNote.objects.create(topic=topic, content='content', summary='summary', ai_model_used='fake')
+            NoteAnalytics.objects.create(note=note)
+            self.topics.append(topic)
+
+    def assertQueryBudget(self, url, queries, **headers):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, **headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def test_list_endpoints(self):
+        # Token lookup, COUNT(*) and the page itself
+        for count in (1, PAGE_SIZE - 1):
+            self.add_topics(count)
+            with self.subTest(rows=len(self.topics)):
+                self.assertEqual(len(self.assertQueryBudget('/api/notes/topics/', 3).data['results']), len(self.topics))
+                self.assertEqual(len(self.assertQueryBudget('/api/notes/notes/', 3).data['results']), len(self.topics))
+                self.assertQueryBudget('/api/notes/subjects/', 3)
+
+    @mock.patch('notes.views.view_counter')
+    def test_detail_endpoints(self, view_counter):
+        self.add_topics(1)
+        topic = self.topics[0]
+
+        self.assertQueryBudget(f'/api/notes/topics/{topic.id}/', 2)
+        self.assertQueryBudget(f'/api/notes/notes/{topic.study_note.id}/', 2)
+        self.assertQueryBudget('/api/notes/preferences/', 2)
+        view_counter.record.assert_called_once_with(topic.study_note.id)
+
+    def test_topic_analytics(self):
+        for count in (1, PAGE_SIZE - 1):
+            self.add_topics(count)
+            with self.subTest(rows=len(self.topics)):
+                self.assertEqual(self.assertQueryBudget('/api/notes/topics/analytics/', 2).data['total_topics'],
+                                 len(self.topics))
+
+    def test_dashboard(self):
+        for count in (1, PAGE_SIZE - 1):
+            self.add_topics(count)
+            with self.subTest(rows=len(self.topics)):
+                # Token, ETag, topics, notes, preferences, topic counter and usage rollups
+                response = self.assertQueryBudget('/api/notes/dashboard/', 7)
+                self.assertEqual(response.status_code, 200)
+
+                # Token and ETag only
+                not_modified = self.assertQueryBudget('/api/notes/dashboard/', 2, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_dashboard_etag_changes(self):
+        self.add_topics(2)
+        etag = self.client.get('/api/notes/dashboard/')['ETag']
+
+        self.topics[0].delete()
+        response = self.client.get('/api/notes/dashboard/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['topic_analytics']['total_topics'], 1)
+
+
+@override_settings(NOTE_VIEW_FLUSH_INTERVAL=3600)
+class ViewCounterTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.notes = [
+            StudyNote.objects.create(topic=StudyTopic.objects.create(user=user, title=f'Topic {i}', description='d'),
+                                     content='content', ai_model_used='fake')
+            for i in range(3)
+        ]
+        self.counter = ViewCounter()
+        self.addCleanup(self.counter.close)
+
+    def stored_views(self):
+        return dict(NoteAnalytics.objects.values_list('note_id', 'views_count'))
+
+    def test_flush_adds_counts(self):
+        for note in self.notes + self.notes[:1]:
+            self.counter.record(note.id)
+
+        self.assertEqual(self.counter.flush(), 4)
+        self.assertEqual(self.stored_views(), {self.notes[0].id: 2, self.notes[1].id: 1, self.notes[2].id: 1})
+
+    @mock.patch('notes.view_counter.FLUSH_CHUNK_SIZE', 1)
+    def test_failed_chunk_writes_nothing(self):
+        for note in self.notes:
+            self.counter.record(note.id)
+
+        create_missing = ViewCounter._create_missing
+        calls = []
+
+        def fail_second_chunk(counter, note_ids):
+            calls.append(note_ids)
+            if len(calls) == 2:
+                raise DatabaseError('connection lost')
+            create_missing(counter, note_ids)
+
+        with mock.patch.object(ViewCounter, '_create_missing', autospec=True, side_effect=fail_second_chunk):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.stored_views(), {})
+
+        # The next flush writes each view exactly once
+        self.counter.record(self.notes[0].id)
+        self.assertEqual(self.counter.flush(), 4)
+        self.assertEqual(self.stored_views(), {self.notes[0].id: 2, self.notes[1].id: 1, self.notes[2].id: 1})
+
+
+class GenerateNotesBatchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.topic = StudyTopic.objects.create(user=self.user, title='Topic', description='d')
+
+    def post(self, data):
+        return self.client.post('/api/notes/topics/generate/batch/', data, format='json')
+
+    def test_invalid_topic_ids(self):
+        for topic_ids in (None, [], 'abc', ['abc'], [{'a': 1}], [0], [self.topic.id] * 101):
+            with self.subTest(topic_ids=topic_ids):
+                response = self.post({'topic_ids': topic_ids})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('topic_ids', response.data)
+
+    def test_numeric_strings(self):
+        response = self.post({'topic_ids': [str(self.topic.id), self.topic.id, 999999]})
+
+        self.assertEqual(response.status_code, 202)
+        results = response.data['results']
+        self.assertEqual([result['topic_id'] for result in results], [self.topic.id, 999999])
+        self.assertIn('job', results[0])
+        self.assertEqual(results[1]['error'], 'Topic not found')
+
+
+class StreamNotesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.topic = StudyTopic.objects.create(user=self.user, title='Topic', description='d')
+
+    def test_conflicts_with_active_job(self):
+        self.client.post(f'/api/notes/topics/{self.topic.id}/generate/', {}, format='json')
+        job = GenerationJob.objects.get(topic=self.topic)
+
+        response = self.client.post(f'/api/notes/topics/{self.topic.id}/generate/stream/')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['job']['id'], job.id)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.status, 'processing')
+
+    def disconnect_after_first_event(self):
+        with mock.patch('notes.views.AIService') as service:
+            service.return_value.stream_study_notes.return_value = iter([('section', {'title': 'Intro'})] * 2)
+            events = _stream_note_events(self.topic, None)
+            next(events)
+            events.close()
+
+    def test_disconnect_resets_status(self):
+        self.topic.status = 'processing'
+        self.topic.save()
+
+        self.disconnect_after_first_event()
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.status, 'pending')
+
+    def test_disconnect_keeps_status_of_job_queued_meanwhile(self):
+        self.topic.status = 'processing'
+        self.topic.save()
+        GenerationJob.objects.create(user=self.user, topic=self.topic)
+
+        self.disconnect_after_first_event()
+
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.status, 'processing')
+
+
+class SimilarNotesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        source_topic = StudyTopic.objects.create(user=self.user, title='Photosynthesis', description='d')
+        self.source = StudyNote.objects.create(topic=source_topic, content='content', ai_model_used='fake')
+
+    def generate(self, reuse_similar):
+        topic = StudyTopic.objects.create(user=self.user, title='Photosynthesis basics', description='d')
+        with mock.patch('notes.views.find_similar_notes', return_value=[(self.source, 0.9)]):
+            return self.client.post(f'/api/notes/topics/{topic.id}/generate/', {'reuse_similar': reuse_similar},
+                                    format='json')
+
+    def test_reuse_similar_parsing(self):
+        for value, expected in ((True, 201), ('true', 201), ('1', 201), (False, 202), ('false', 202), ('0', 202),
+                                ('maybe', 400)):
+            with self.subTest(reuse_similar=value):
+                self.assertEqual(self.generate(value).status_code, expected)
+
+    def clone(self, note_id, format='json'):
+        topic = StudyTopic.objects.create(user=self.user, title='Photosynthesis basics', description='d')
+        with mock.patch('notes.views.find_similar_notes', return_value=[(self.source, 0.9)]):
+            return self.client.post(f'/api/notes/topics/{topic.id}/clone/', {'note_id': note_id},
+                                    format=format)
+
+    def test_clone_note_id_parsing(self):
+        for note_id, format, expected in ((self.source.id, 'json', 201), (str(self.source.id), 'json', 201),
+                                          (self.source.id, 'multipart', 201), (self.source.id + 1, 'json', 400),
+                                          ('five', 'json', 400), ('', 'multipart', 400)):
+            with self.subTest(note_id=note_id, format=format):
+                self.assertEqual(self.clone(note_id, format).status_code, expected)
+
+    def test_status_saves_skip_indexing(self):
+        topic = StudyTopic.objects.get(pk=self.source.topic_id)
+
+        with mock.patch('notes.similarity.index_topic') as index_topic:
+            topic.status = 'completed'
+            topic.save()
+            index_topic.assert_not_called()
+
+            topic.title = 'Photosynthesis in plants'
+            topic.save()
+            index_topic.assert_called_once_with(topic)
+
+            topic.status = 'failed'
+            topic.save()
+            index_topic.assert_called_once()
+
+
+class TopicCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='a@example.com', email='a@example.com', password='x')
+
+    def stored(self, user=None):
+        return TopicCounter.objects.filter(user=user or self.user).values(*COUNTER_FIELDS).get()
+
+    def assertCountersMatch(self, user=None):
+        user = user or self.user
+        self.assertEqual(self.stored(user), count_topics(user.pk))
+
+    def test_create(self):
+        StudyTopic.objects.create(user=self.user, title='a', description='d', difficulty='beginner')
+        StudyTopic.objects.create(user=self.user, title='b', description='d', difficulty='advanced')
+
+        self.assertCountersMatch()
+        self.assertEqual(self.stored()['total'], 2)
+
+    def test_status_and_difficulty_changes(self):
+        topic = StudyTopic.objects.create(user=self.user, title='a', description='d')
+
+        topic.status = 'processing'
+        topic.save()
+        self.assertCountersMatch()
+
+        # A fresh instance, as the worker loads it
+        topic = StudyTopic.objects.get(pk=topic.pk)
+        topic.status = 'completed'
+        topic.difficulty = 'advanced'
+        topic.save()
+        self.assertCountersMatch()
+
+        topic.status = 'failed'
+        topic.save(update_fields=['status'])
+        topic.title = 'b'
+        topic.save(update_fields=['title'])
+        topic.save()
+        self.assertCountersMatch()
+        self.assertEqual(self.stored()['failed'], 1)
+
+    def test_delete(self):
+        kept = StudyTopic.objects.create(user=self.user, title='a', description='d', status='completed')
+        deleted = StudyTopic.objects.create(user=self.user, title='b', description='d')
+
+        # Unsaved changes to the instance don't affect what is subtracted
+        deleted.status = 'completed'
+        deleted.delete()
+        self.assertCountersMatch()
+
+        StudyTopic.objects.filter(pk=kept.pk).delete()
+        self.assertCountersMatch()
+        self.assertEqual(self.stored()['total'], 0)
+
+    def test_missing_counter_is_created_on_read(self):
+        StudyTopic.objects.create(user=self.user, title='a', description='d')
+        TopicCounter.objects.filter(user=self.user).delete()
+
+        self.assertEqual(topic_counts(self.user), count_topics(self.user.pk))
+        self.assertCountersMatch()
+
+    def test_reconcile_fixes_drift(self):
+        other = User.objects.create_user(username='b@example.com', email='b@example.com', password='x')
+        topic = StudyTopic.objects.create(user=self.user, title='a', description='d')
+        StudyTopic.objects.create(user=other, title='a', description='d')
+
+        # queryset.update() sends no signals, so the counter drifts
+        StudyTopic.objects.filter(pk=topic.pk).update(status='completed')
+        self.assertNotEqual(self.stored(), count_topics(self.user.pk))
+
+        output = StringIO()
+        call_command('reconcile_topic_counters', '--dry-run', stdout=output)
+        self.assertIn('Found 1 drifted of 2', output.getvalue())
+        self.assertNotEqual(self.stored(), count_topics(self.user.pk))
+
+        call_command('reconcile_topic_counters', stdout=StringIO())
+        self.assertCountersMatch()
+        self.assertCountersMatch(other)
@@ -11,13 +11,20 @@ urlpatterns = [
     path('topics/<int:pk>/', views.StudyTopicDetailView.as_view(), name='topic_detail'),
     path('topics/<int:topic_id>/generate/', views.generate_notes, name='generate_notes'),
     path('topics/<int:topic_id>/regenerate/', views.regenerate_notes, name='regenerate_notes'),
+    path('topics/<int:topic_id>/generate/stream/', views.stream_notes, name='stream_notes'),
+    path('topics/<int:topic_id>/similar-notes/', views.similar_notes, name='similar_notes'),
+    path('topics/<int:topic_id>/clone/', views.clone_similar_note, name='clone_similar_note'),
     path('topics/analytics/', views.topic_analytics, name='topic_analytics'),
+    path('topics/generate/batch/', views.generate_notes_batch, name='generate_notes_batch'),
     
     # Study Notes
     path('notes/', views.StudyNoteListView.as_view(), name='notes'),
     path('notes/<int:pk>/', views.StudyNoteDetailView.as_view(), name='note_detail'),
     path('notes/<int:note_id>/rate/', views.rate_note, name='rate_note'),
     
+    # Dashboard
+    path('dashboard/', views.dashboard, name='dashboard'),
+    
     # User Preferences
     path('preferences/', views.UserPreferenceView.as_view(), name='preferences'),
 ] 
\ No newline at end of file
@@ -0,0 +1,181 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import StudyNote, NoteAnalytics
+
+logger = logging.getLogger(__name__)
+
+# Notes per UPDATE statement
+FLUSH_CHUNK_SIZE = 500
+
+
+class ViewCounter:
+    """
+    Count note views in memory and add them to NoteAnalytics in batches.
+
+    record() only bumps an in-process counter. A daemon thread adds the
+    counts with F('views_count') + n updates, and moves last_viewed forward,
+    every NOTE_VIEW_FLUSH_INTERVAL seconds and at interpreter exit, so
+    stored counts lag by up to that interval. Counts from a flush that fails
+    are kept for the next one. With an interval of 0 each view is written
+    immediately instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # note id -> (views, last viewed)
+        self._pending: Dict[int, Tuple[int, datetime]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = False
+        self.recorded = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def record(self, note_id: int):
+        """Count one view of a note; never touches the database unless flushing is disabled."""
+
+        now = timezone.now()
+        if settings.NOTE_VIEW_FLUSH_INTERVAL <= 0:
+            self._write({note_id: (1, now)})
+            with self._lock:
+                self.recorded += 1
+                self.flushed += 1
+            return
+
+        self._ensure_started()
+        with self._lock:
+            views, _ = self._pending.get(note_id, (0, now))
+            self._pending[note_id] = (views + 1, now)
+            self.recorded += 1
+
+    def flush(self) -> int:
+        """Write the pending counts in the calling thread. Returns the views written."""
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            self._write(pending)
+        except Exception as e:
+            logger.error(f"Failed to write view counts of {len(pending)} note(s): {str(e)}")
+            with self._lock:
+                self.failed_flushes += 1
+                # Keep them for the next flush, merged with views counted meanwhile
+                for note_id, (views, last_viewed) in pending.items():
+                    newer_views, newer_last_viewed = self._pending.get(note_id, (0, last_viewed))
+                    self._pending[note_id] = (views + newer_views, max(last_viewed, newer_last_viewed))
+            return 0
+
+        views = sum(views for views, _ in pending.values())
+        with self._lock:
+            self.flushed += views
+        return views
+
+    def _write(self, pending: Dict[int, Tuple[int, datetime]]):
+        note_ids = list(pending)
+        # One transaction for every chunk: flush() requeues all of pending when
+        # this fails, so no chunk may stay committed
+        with transaction.atomic():
+            for start in range(0, len(note_ids), FLUSH_CHUNK_SIZE):
+                chunk = note_ids[start:start + FLUSH_CHUNK_SIZE]
+                self._create_missing(chunk)
+
+                views = Case(*[When(note_id=note_id, then=Value(pending[note_id][0])) for note_id in chunk],
+                             output_field=IntegerField())
+                last_viewed = Case(*[When(note_id=note_id, then=Value(pending[note_id][1])) for note_id in chunk],
+                                   output_field=DateTimeField())
+                NoteAnalytics.objects.filter(note_id__in=chunk).update(
+                    views_count=F('views_count') + views,
+                    # Another process may have flushed a later view already
+                    last_viewed=Greatest(Coalesce('last_viewed', last_viewed), last_viewed),
+                    updated_at=timezone.now(),
+                )
+
+    def _create_missing(self, note_ids: List[int]):
+        existing = set(NoteAnalytics.objects.filter(note_id__in=note_ids).values_list('note_id', flat=True))
+        missing = [note_id for note_id in note_ids if note_id not in existing]
+        if missing:
+            # Notes deleted since they were viewed are skipped
+            NoteAnalytics.objects.bulk_create(
+                [NoteAnalytics(note_id=note_id) for note_id in StudyNote.objects.filter(id__in=missing).values_list('id', flat=True)],
+                ignore_conflicts=True,
+            )
+
+    def close(self):
+        """Stop the flush thread and write what is left."""
+
+        with self._lock:
+            self._stopping = True
+            self._wake.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def _ensure_started(self):
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='note-view-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + settings.NOTE_VIEW_FLUSH_INTERVAL
+            with self._lock:
+                while not self._stopping and time.monotonic() < deadline:
+                    self._wake.wait(max(0.0, deadline - time.monotonic()))
+                stopping = self._stopping
+
+            if stopping:
+                # close() flushes the rest in its own thread
+                break
+
+            close_old_connections()
+            self.flush()
+
+        connection.close()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending_notes': len(self._pending),
+                'recorded': self.recorded,
+                'flushed': self.flushed,
+                'failed_flushes': self.failed_flushes,
+            }
+
+    def _reset_after_fork(self):
+        # Views counted in the parent are the parent's to write
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pending = {}
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+
+view_counter = ViewCounter()
+
+atexit.register(view_counter.close)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=view_counter._reset_after_fork)
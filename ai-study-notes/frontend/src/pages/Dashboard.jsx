@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react'
 import { Link } from 'react-router-dom'
 import { useAuth } from '../hooks/useAuth.jsx'
-import { topicsAPI, aiServiceAPI } from '../services/api'
+import { dashboardAPI } from '../services/api'
 import { 
   BookOpen, 
   FileText, 
@@ -24,15 +24,11 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchDashboardData = async () => {
       try {
-        const [topicsRes, analyticsRes, aiStatsRes] = await Promise.all([
-          topicsAPI.getAll({ limit: 5 }),
-          topicsAPI.getAnalytics(),
-          aiServiceAPI.getStats()
-        ])
+        const { data } = await dashboardAPI.get()
 
-        setTopics(topicsRes.data.results || topicsRes.data)
-        setAnalytics(analyticsRes.data)
-        setAiStats(aiStatsRes.data)
+        setTopics(data.topics)
+        setAnalytics(data.topic_analytics)
+        setAiStats(data.ai_stats)
       } catch (error) {
         console.error('Error fetching dashboard data:', error)
         toast.error('Failed to load dashboard data')
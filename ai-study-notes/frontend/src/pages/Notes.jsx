@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react'
-import { notesAPI, topicsAPI } from '../services/api'
+import { notesAPI, topicsAPI, waitForJob } from '../services/api'
 import { Search, FileText, Clock, Star, Trash2, RefreshCw, Eye, X } from 'lucide-react'
 import toast from 'react-hot-toast'
 
@@ -71,7 +71,8 @@ const Notes = () => {
 
     setRegeneratingNotes(prev => ({ ...prev, [note.id]: true }))
     try {
-      await topicsAPI.regenerateNotes(note.topic)
+      const { data } = await topicsAPI.regenerateNotes(note.topic)
+      await waitForJob(data.job.id)
       toast.success('Note regenerated successfully!')
       // Refresh notes
       const response = await notesAPI.getAll()
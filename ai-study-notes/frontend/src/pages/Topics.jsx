@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react'
-import { topicsAPI, subjectsAPI } from '../services/api'
+import { topicsAPI, subjectsAPI, waitForJob } from '../services/api'
 import { Plus, Search, Filter, X, BookOpen, Edit, Trash2 } from 'lucide-react'
 import toast from 'react-hot-toast'
 
@@ -109,7 +109,8 @@ const Topics = () => {
         if (shouldRegenerate) {
           setGeneratingNotes(prev => ({ ...prev, [response.data.id]: true }))
           try {
-            await topicsAPI.regenerateNotes(response.data.id)
+            const { data } = await topicsAPI.regenerateNotes(response.data.id)
+            await waitForJob(data.job.id)
             toast.success('Notes regenerated successfully!')
             // Refresh the topics to show updated status
             const updatedTopics = await topicsAPI.getAll();
@@ -236,7 +237,8 @@ const Topics = () => {
                   onClick={async () => {
                     setGeneratingNotes(prev => ({ ...prev, [topic.id]: true }))
                     try {
-                      await topicsAPI.generateNotes(topic.id);
+                      const { data } = await topicsAPI.generateNotes(topic.id);
+                      await waitForJob(data.job.id);
                       toast.success('Notes generated successfully!');
                       // Refresh the topics to show updated status
                       const updatedTopics = await topicsAPI.getAll();
@@ -68,6 +68,12 @@ export const notesAPI = {
   rateNote: (id, rating) => api.post(`/notes/notes/${id}/rate/`, { rating }),
 }
 
+// Dashboard API
+export const dashboardAPI = {
+  // The browser revalidates with If-None-Match and reuses its copy on a 304
+  get: () => api.get('/notes/dashboard/'),
+}
+
 // Subjects API
 export const subjectsAPI = {
   getAll: () => api.get('/notes/subjects/'),
@@ -89,6 +95,21 @@ export const aiServiceAPI = {
   getStats: () => api.get('/ai/stats/'),
   getLogs: () => api.get('/ai/logs/'),
   getTemplates: () => api.get('/ai/templates/'),
+  getJob: (id) => api.get(`/ai/jobs/${id}/`),
+}
+
+// Poll a note generation job until the worker finishes it
+export const waitForJob = async (jobId, { interval = 2000 } = {}) => {
+  for (;;) {
+    const { data: job } = await aiServiceAPI.getJob(jobId)
+    if (job.status === 'succeeded') {
+      return job
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error_message || 'Note generation failed')
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval))
+  }
 }
 
 export default api 
\ No newline at end of file